@@ -3,7 +3,12 @@ from fastapi import APIRouter, Depends, Query, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from app.models.scheme import SchemeHistNavData
-from app.schemas.scheme import SchemeHistNavDataSchema
+from app.schemas.scheme import SchemeHistNavDataSchema, ReturnsBatchRequest, NavAsOnRequest, NavAsOnData, RollingReturnsResponse, SchemeRiskMetricsSchema, PortfolioOverlapRequest, PortfolioOverlapResponse, SimilarFundsResponse, StockHoldersResponse, MostHeldStock, MainCategory
+from app.services.rolling_returns import SchemeRollingReturnsService
+from app.services.risk_metrics import SchemeRiskMetricsService
+from app.services.portfolio_overlap import PortfolioOverlapService
+from app.services.similar_funds import SimilarFundsService
+from app.services.reverse_holdings import ReverseHoldingsService
 from app.services.service import ReturnsCalculator, SchemeHistNavService
 from app.db.base import get_db, get_idb
 import logging
@@ -55,6 +60,83 @@ async def calculate_returns(
         logger.error(f"Error in calculate_returns: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.post("/returns/batch", response_model=List[dict])
+async def calculate_batch_returns(
+    payload: ReturnsBatchRequest, db: AsyncSession = Depends(get_idb)
+):
+    try:
+        data_list = [item.model_dump() for item in payload.requests]
+        return await ReturnsCalculator.calculate_batch_returns(data_list, db=db)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in calculate_batch_returns: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post("/nav/as-on", response_model=List[NavAsOnData])
+async def get_as_on_nav_data(
+    payload: NavAsOnRequest, db: AsyncSession = Depends(get_idb)
+):
+    try:
+        as_on = payload.as_on or datetime.now().date()
+        return await SchemeHistNavService.get_as_on_hist_nav_data_for_ids(
+            db, id_type=payload.id_type, id_values=payload.id_values, as_on=as_on, approx=payload.approx
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_as_on_nav_data: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.get("/rolling-returns/{wpc}/", response_model=RollingReturnsResponse)
+async def get_rolling_returns(
+    wpc: str,
+    beat_percentage: float = Query(10, ge=-100, le=100, description="Share of windows with a CAGR above this percentage"),
+    db: AsyncSession = Depends(get_idb)
+):
+    return await SchemeRollingReturnsService.get_rolling_returns(db, wpc=wpc, beat_percentage=beat_percentage)
+
+@router.get("/risk-metrics/{wpc}/", response_model=List[SchemeRiskMetricsSchema])
+async def get_risk_metrics(wpc: str, db: AsyncSession = Depends(get_idb)):
+    return await SchemeRiskMetricsService.get_risk_metrics(db, wpc=wpc)
+
+@router.post("/portfolio-overlap/", response_model=PortfolioOverlapResponse)
+async def get_portfolio_overlap(payload: PortfolioOverlapRequest, db: AsyncSession = Depends(get_idb)):
+    return await PortfolioOverlapService.get_overlap(db, wpcs=payload.wpcs)
+
+@router.get("/similar-funds/{wpc}/", response_model=SimilarFundsResponse)
+async def get_similar_funds(
+    wpc: str,
+    k: int = Query(10, ge=1, le=50, description="Number of similar schemes to return"),
+    db: AsyncSession = Depends(get_idb)
+):
+    return await SimilarFundsService.get_similar_funds(db, wpc=wpc, k=k)
+
+@router.get("/stock-holders/{id_value}/", response_model=StockHoldersResponse)
+async def get_stock_holders(
+    id_value: str,
+    sort_by: str = Query('holding_percentage', description="holding_percentage or market_value"),
+    fund_type: Optional[MainCategory] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_idb)
+):
+    return await ReverseHoldingsService.get_holders(
+        db, id_value=id_value, sort_by=sort_by, fund_type=fund_type.value if fund_type else None,
+        limit=limit, offset=offset
+    )
+
+@router.get("/most-held-stocks/", response_model=List[MostHeldStock])
+async def get_most_held_stocks(
+    fund_type: Optional[MainCategory] = Query(None, description="Only schemes of this fund type, all when not given"),
+    sort_by: str = Query('funds_count', description="funds_count, market_value or average_holding_percentage"),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_idb)
+):
+    return await ReverseHoldingsService.get_most_held(
+        db, fund_type=fund_type.value if fund_type else None, sort_by=sort_by, limit=limit
+    )
+
 @router.get("/get-scheme-hist-nav/{wpc}/", response_model=List[SchemeHistNavDataSchema])
 async def get_scheme_hist_nav_data(
     wpc: str, db: AsyncSession = Depends(get_idb)
@@ -1,8 +1,13 @@
+from datetime import date
 from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.schemas.stock import StockResponse, PaginatedStockResponse, StockFundamentalsResponse, ShareHoldingPatternResponse, FinancialsOverviewResponse, DetailedFinancialsResponse
+from app.schemas.stock import StockResponse, PaginatedStockResponse, StockCandlesResponse, StockIndicatorSeriesResponse, StockFundamentalsResponse, ShareHoldingPatternResponse, FinancialsOverviewResponse, DetailedFinancialsResponse
 from app.services.stock import StockService
+from app.services.stock_hist import StockHistPriceService
+from app.services.stock_indicators import StockIndicatorService
+from app.utils.constants import ExchangeChoices
 from app.db.base import get_db, get_idb
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -68,12 +73,38 @@ async def get_stock(
 
 
 
+def get_hist_price_streaming_response(
+    exchange: str, wstockcode: str, output_format: str, fields: Optional[str],
+    start_date: Optional[date], end_date: Optional[date]
+) -> StreamingResponse:
+    fields = StockHistPriceService.clean_hist_price_stream_params(output_format, fields)
+    media_type = "text/csv" if output_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        StockHistPriceService.stream_hist_prices(
+            exchange=exchange, wstockcode=wstockcode, fields=fields, start_date=start_date, end_date=end_date,
+            output_format=output_format
+        ),
+        media_type=media_type
+    )
+
 @router.get("/stock-nse-hist-price/{wstockcode}/", response_model=List[StockNSEHistPriceDataSchema])
 async def get_stock_nse_hist_price_data(
-    wstockcode: str, db: AsyncSession = Depends(get_idb)
-):
+    wstockcode: str,
+    format: Optional[str] = Query(None, description="Stream the rows as 'ndjson' or 'csv'"),
+    fields: Optional[str] = Query(None, description="Comma separated columns to stream"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    db: AsyncSession = Depends(get_idb)
+):
+    if format:
+        return get_hist_price_streaming_response(ExchangeChoices.NSE, wstockcode, format, fields, start_date, end_date)
     logger.debug(f"Fetching NSE historical price data for wstockcode: {wstockcode}")
-    result = await db.execute(select(StockNSEHistPriceData).where(StockNSEHistPriceData.wstockcode == wstockcode))
+    query = select(StockNSEHistPriceData).where(StockNSEHistPriceData.wstockcode == wstockcode)
+    if start_date:
+        query = query.where(StockNSEHistPriceData.price_date >= start_date)
+    if end_date:
+        query = query.where(StockNSEHistPriceData.price_date <= end_date)
+    result = await db.execute(query)
     records = result.scalars().all()
     if not records:
         logger.debug(f"No NSE historical price data found for wstockcode: {wstockcode}")
@@ -83,10 +114,22 @@ async def get_stock_nse_hist_price_data(
 
 @router.get("/stock-bse-hist-price/{wstockcode}/", response_model=List[StockBSEHistPriceDataSchema])
 async def get_stock_bse_hist_price_data(
-    wstockcode: str, db: AsyncSession = Depends(get_idb)
-):
+    wstockcode: str,
+    format: Optional[str] = Query(None, description="Stream the rows as 'ndjson' or 'csv'"),
+    fields: Optional[str] = Query(None, description="Comma separated columns to stream"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    db: AsyncSession = Depends(get_idb)
+):
+    if format:
+        return get_hist_price_streaming_response(ExchangeChoices.BSE, wstockcode, format, fields, start_date, end_date)
     logger.debug(f"Fetching BSE historical price data for wstockcode: {wstockcode}")
-    result = await db.execute(select(StockBSEHistPriceData).where(StockBSEHistPriceData.wstockcode == wstockcode))
+    query = select(StockBSEHistPriceData).where(StockBSEHistPriceData.wstockcode == wstockcode)
+    if start_date:
+        query = query.where(StockBSEHistPriceData.price_date >= start_date)
+    if end_date:
+        query = query.where(StockBSEHistPriceData.price_date <= end_date)
+    result = await db.execute(query)
     records = result.scalars().all()
     if not records:
         logger.debug(f"No BSE historical price data found for wstockcode: {wstockcode}")
@@ -94,6 +137,43 @@ async def get_stock_bse_hist_price_data(
     logger.debug(f"Records found: {len(records)}")
     return records
 
+@router.get("/stock-candles/{wstockcode}/", response_model=StockCandlesResponse)
+async def get_stock_candles(
+    wstockcode: str,
+    exchange: str = Query(ExchangeChoices.NSE.value, description="Stock exchange: 'nse' or 'bse'"),
+    resolution: str = Query('d', description="Candle size: d, w, m, q or y"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    db: AsyncSession = Depends(get_idb)
+):
+    logger.debug(f"Fetching {resolution} candles for wstockcode: {wstockcode}")
+    return await StockHistPriceService.get_candles_for_wstockcode(
+        db, exchange=exchange, wstockcode=wstockcode, start_date=start_date, end_date=end_date, resolution=resolution
+    )
+
+@router.get("/stock-indicators/{wstockcode}/", response_model=StockIndicatorSeriesResponse)
+async def get_stock_indicator_series(
+    wstockcode: str,
+    exchange: str = Query(ExchangeChoices.NSE.value, description="Stock exchange: 'nse' or 'bse'"),
+    start_date: Optional[date] = Query(None, description="Defaults to one year back"),
+    end_date: Optional[date] = Query(None),
+    rsi_period: Optional[int] = Query(None, ge=2, le=250),
+    macd_fast: Optional[int] = Query(None, ge=2, le=250),
+    macd_slow: Optional[int] = Query(None, ge=2, le=250),
+    macd_signal: Optional[int] = Query(None, ge=2, le=250),
+    ema_span: Optional[int] = Query(None, ge=2, le=250),
+    sma_window: Optional[int] = Query(None, ge=2, le=250),
+    std_window: Optional[int] = Query(None, ge=2, le=250),
+    db: AsyncSession = Depends(get_idb)
+):
+    params = dict(
+        rsi_period=rsi_period, macd_fast=macd_fast, macd_slow=macd_slow, macd_signal=macd_signal,
+        ema_span=ema_span, sma_window=sma_window, std_window=std_window
+    )
+    return await StockIndicatorService.get_indicator_series(
+        db, exchange=exchange, wstockcode=wstockcode, start_date=start_date, end_date=end_date, params=params
+    )
+
 @router.get("/stock-management-info/{wstockcode}/", response_model=StockManagementInfoSchema)
 async def get_stock_management_info(
     wstockcode: str, db: AsyncSession = Depends(get_idb)
@@ -1,21 +1,119 @@
-
+import asyncio
+import logging
+import uuid
+from typing import Dict, List, Optional
 import redis.asyncio as redis
 
 from pydantic_settings import BaseSettings
+from app.cache.lru_cache import LRUCache
+
+logger = logging.getLogger("app")
 
 class Settings(BaseSettings):
     REDIS_URL: str = "redis://localhost:6379/0"
-    
+    LOCAL_CACHE_MAX_SIZE: int = 1024
+    LOCAL_CACHE_TTL: int = 30
+    CACHE_INVALIDATION_CHANNEL: str = "cache_invalidation"
+
 
 settings = Settings()
 
 redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
 
-async def get_cache_value(key: str):
-    return await redis_client.get(key)
+# L1 cache of this worker, kept coherent across workers through CACHE_INVALIDATION_CHANNEL
+local_cache = LRUCache(maxsize=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+WORKER_ID = uuid.uuid4().hex
+
+async def get_cache_value(key: str, use_local_cache: bool = True):
+    if use_local_cache:
+        value = local_cache.get(key)
+        if value is not None:
+            return value
+    async with redis_client.pipeline(transaction=False) as pipe:
+        value, pttl = await pipe.get(key).pttl(key).execute()
+    if use_local_cache and value is not None:
+        # never keep a local copy longer than redis keeps the key (pttl is -1 for keys without expiry)
+        local_cache.set(key, value, ttl=pttl / 1000 if pttl > 0 else None)
+    return value
 
 async def set_cache_value(key: str, value: str, expire: int = None):
     await redis_client.set(key, value, ex=expire)
+    local_cache.set(key, value, ttl=expire)
+    await publish_cache_invalidation(key)
 
 async def delete_cache_key(key: str):
-    await redis_client.delete(key)
\ No newline at end of file
+    await redis_client.delete(key)
+    local_cache.delete(key)
+    await publish_cache_invalidation(key)
+
+async def get_cache_values(keys: List[str], use_local_cache: bool = True) -> Dict[str, Optional[str]]:
+    values = {key: local_cache.get(key) if use_local_cache else None for key in keys}
+    missing = [key for key, value in values.items() if value is None]
+    if missing:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key in missing:
+                pipe.get(key).pttl(key)
+            results = await pipe.execute()
+        for key, value, pttl in zip(missing, results[::2], results[1::2]):
+            values[key] = value
+            if use_local_cache and value is not None:
+                local_cache.set(key, value, ttl=pttl / 1000 if pttl > 0 else None)
+    return values
+
+async def set_cache_values(values: Dict[str, str], expire: int = None, chunk_size: int = 1000):
+    items = list(values.items())
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, value in chunk:
+                pipe.set(key, value, ex=expire)
+            pipe.publish(settings.CACHE_INVALIDATION_CHANNEL, make_invalidation_message([key for key, _ in chunk]))
+            await pipe.execute()
+        for key, value in chunk:
+            local_cache.set(key, value, ttl=expire)
+
+async def delete_cache_keys(keys: List[str], chunk_size: int = 1000):
+    # one pipelined round trip and one invalidation message per chunk instead of two per key
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.unlink(*chunk)
+            pipe.publish(settings.CACHE_INVALIDATION_CHANNEL, make_invalidation_message(chunk))
+            await pipe.execute()
+        for key in chunk:
+            local_cache.delete(key)
+
+def make_invalidation_message(keys: List[str]) -> str:
+    # keys never contain a newline, one message can carry a whole chunk of them
+    return f"{WORKER_ID}:" + "\n".join(keys)
+
+async def publish_cache_invalidation(key: str):
+    try:
+        await redis_client.publish(settings.CACHE_INVALIDATION_CHANNEL, make_invalidation_message([key]))
+    except Exception as e:
+        logger.error(f"Failed to publish cache invalidation for {key}. {e}")
+
+async def listen_for_cache_invalidations():
+    '''
+        Drops local copies of keys changed by other workers. If the subscription breaks, invalidations
+        may have been missed, so the whole local cache is cleared before resubscribing.
+    '''
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(settings.CACHE_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                sender, _, keys = message['data'].partition(':')
+                if sender != WORKER_ID:
+                    for key in keys.split('\n'):
+                        local_cache.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cache invalidation listener failed. {e}")
+            local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
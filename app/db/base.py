@@ -85,7 +85,8 @@ async def get_session() -> AsyncIterator[AsyncSession]:
 import contextlib
 from typing import Any, AsyncIterator
 
-from sqlalchemy.ext.asyncio import (AsyncConnection, AsyncSession,
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (AsyncConnection, AsyncEngine, AsyncSession,
                                     async_sessionmaker, create_async_engine)
 from sqlalchemy.orm import declarative_base
 
@@ -96,16 +97,52 @@ from app.models import *  # Import all your models
 # logger = GetLogger(__name__)
 
 Base = declarative_base()
-engine = create_async_engine(settings.postgres_database_uri, echo=settings.ECHO_SQL)
+
+
+def create_db_engine(host: str = None, **engine_kwargs) -> AsyncEngine:
+    '''
+        The only place an engine should be created, so every module shares the pool settings below.
+        engine_kwargs override the defaults from settings.
+    '''
+    host = host or settings.postgres_database_uri
+    kwargs = dict(
+        echo=settings.ECHO_SQL,
+        future=True,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    if make_url(host).get_driver_name() == 'asyncpg':
+        kwargs['connect_args'] = dict(prepared_statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE)
+    kwargs.update(engine_kwargs)
+    return create_async_engine(host, **kwargs)
+
+
+def get_pool_status(db_engine: AsyncEngine = None) -> dict:
+    pool = (db_engine or engine).pool
+    return dict(
+        pool_class=type(pool).__name__,
+        size=pool.size() if hasattr(pool, 'size') else None,
+        checked_in=pool.checkedin() if hasattr(pool, 'checkedin') else None,
+        checked_out=pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        overflow=pool.overflow() if hasattr(pool, 'overflow') else None,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        status=pool.status(),
+    )
+
+
+engine = create_db_engine()
 async_session = async_sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
 class DatabaseSessionManager:
-    def __init__(self, host: str, engine_kwargs: dict[str, Any] | None = None):
-        if engine_kwargs is None:
-            engine_kwargs = {}
-        self._engine = create_async_engine(host, **engine_kwargs)
+    def __init__(self, host: str = None, engine_kwargs: dict[str, Any] | None = None, db_engine: AsyncEngine = None):
+        if db_engine is None:
+            db_engine = create_db_engine(host, **(engine_kwargs or {}))
+        self._engine = db_engine
         self._sessionmaker = async_sessionmaker(
             bind=self._engine,
             autocommit=False,
@@ -144,10 +181,7 @@ class DatabaseSessionManager:
                 await session.rollback()
                 raise e
 
-sessionmanager = DatabaseSessionManager(
-    settings.postgres_database_uri,
-    {"echo": settings.ECHO_SQL, "future": True},
-)
+sessionmanager = DatabaseSessionManager(db_engine=engine)
 
 async def get_idb() -> AsyncIterator[AsyncSession]:
     async with sessionmanager.session() as session:
@@ -1,11 +1,8 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
-from app.core.config import settings
-
-DATABASE_URL = settings.postgres_database_uri
-
-engine = create_async_engine(DATABASE_URL, echo=settings.ECHO_SQL)
+from app.db.base import engine
 
+# shares the engine (and so the connection pool) of app.db.base instead of opening a second one
 SessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -10,7 +10,7 @@ from app.utils.model_utils import WealthyProductCodeField, WealthyExternalIdFiel
 from enum import Enum as PyEnum
 from decimal import Decimal
 import pytz
-from datetime import datetime
+from datetime import date, datetime
 from app.models.base import BaseModel
 from sqlalchemy.dialects.postgresql import JSONB
 from typing import Dict
@@ -393,6 +393,20 @@ class SchemeCodeWPCMapping(BaseModel, table=True):
         super().__init_subclass__(**kwargs)
         cls.div_type = Field(sa_column=Column(String, nullable=True), validator=cls.validate_div_type)
 
+class TPSLSchemeCodeWPCMapping(BaseModel, table=True):
+    __tablename__ = "funnal_tpslschemecodewpcmapping"
+
+    external_id: str = WealthyExternalIdField(prefix="tpsl_sc_wpc_map_", primary_key=True)
+    tpsl_scheme_code: str = Field(max_length=20)
+    wpc: str = Field(max_length=12)
+    hidden: bool = Field(default=False)
+
+    __table_args__ = (
+        UniqueConstraint('tpsl_scheme_code', 'wpc', name='uq_tpsl_scheme_code_wpc'),
+        Index('ix_tswm_tsc_513', 'tpsl_scheme_code'),
+        Index('ix_tswm_wpc_862', 'wpc'),
+    )
+
 class ParentChildSchemeMapping(BaseModel, table=True):
     __tablename__ = "funnal_parentchildschememapping"
 
@@ -459,4 +473,24 @@ class ISINWPCMapping(BaseModel, table=True):
         UniqueConstraint('isin', 'wpc', name='uq_isin_wpc'),
         Index('ix_iwm_isin_823', 'isin'),
         Index('ix_iwm_wpc_591', 'wpc'),
-    )
\ No newline at end of file
+    )
+
+class SchemeRiskMetrics(BaseModel, table=True):
+    __tablename__ = "funnal_schemeriskmetrics"
+
+    wpc: str = Field(max_length=12, primary_key=True)
+    period_years: int = Field(primary_key=True)
+    as_on: date = Field(nullable=False)
+    benchmark_tpid: str = Field(max_length=10, nullable=True)
+    observations: int = Field(default=0)
+    annualized_return: float = Field(nullable=True)
+    volatility: float = Field(nullable=True)
+    sharpe: float = Field(nullable=True)
+    sortino: float = Field(nullable=True)
+    max_drawdown: float = Field(nullable=True)
+    max_drawdown_peak_date: date = Field(nullable=True)
+    max_drawdown_trough_date: date = Field(nullable=True)
+    max_drawdown_recovery_date: date = Field(nullable=True)
+    beta: float = Field(nullable=True)
+    alpha: float = Field(nullable=True)
+    computed_at: datetime = Field(nullable=False)
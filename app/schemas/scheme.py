@@ -71,6 +71,26 @@ class SchemeHistNavDataSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class SchemeRiskMetricsSchema(BaseModel):
+    wpc: str
+    period_years: int
+    as_on: date
+    benchmark_tpid: Optional[str]
+    observations: int
+    annualized_return: Optional[float]
+    volatility: Optional[float]
+    sharpe: Optional[float]
+    sortino: Optional[float]
+    max_drawdown: Optional[float]
+    max_drawdown_peak_date: Optional[date]
+    max_drawdown_trough_date: Optional[date]
+    max_drawdown_recovery_date: Optional[date]
+    beta: Optional[float]
+    alpha: Optional[float]
+    computed_at: datetime
+    class Config:
+        from_attributes = True
+
 class WPCToTWPCMapping(BaseSettings):
     external_id: str
     wpc: str
@@ -332,6 +352,131 @@ class ReturnsRequest(BaseModel):
     sip_day: Optional[int] = Field(default=None, ge=1, le=28)
     
     
+class ReturnsBatchItem(BaseModel):
+    id_type: str
+    id_value: str
+    amount: int = Field(gt=0)
+    period: int = Field(gt=0)
+    investment_type: str
+    sip_day: Optional[int] = Field(default=None, ge=1, le=28)
+
+
+class ReturnsBatchRequest(BaseModel):
+    requests: List[ReturnsBatchItem] = Field(min_length=1, max_length=100)
+
+
+class NavAsOnRequest(BaseModel):
+    id_type: str
+    id_values: List[str] = Field(min_length=1, max_length=5000)
+    as_on: Optional[date] = None
+    approx: bool = True
+
+
+class NavAsOnData(BaseModel):
+    id_type: str
+    id_value: str
+    wpc: Optional[str]
+    nav_date: Optional[str]
+    nav: Optional[float]
+    adj_nav: Optional[float]
+
+
+class RollingReturnsDistribution(BaseModel):
+    count: int
+    start_date: Optional[str]
+    latest: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+    median: Optional[float]
+    mean: Optional[float]
+    beat_percentage: Optional[float]
+    negative_percentage: Optional[float]
+
+
+class RollingReturnsResponse(BaseModel):
+    wpc: str
+    nav_date_from: str
+    nav_date_to: str
+    beat_percentage: float
+    periods: Dict[str, RollingReturnsDistribution]
+
+
+class PortfolioOverlapRequest(BaseModel):
+    wpcs: List[str] = Field(min_length=2, max_length=20)
+
+
+class OverlapScheme(BaseModel):
+    wpc: str
+    portfolio_date: datetime
+    holdings_count: int
+
+
+class PairCommonHolding(BaseModel):
+    holding_key: str
+    holding_name: Optional[str]
+    weight_a: float
+    weight_b: float
+
+
+class PairOverlap(BaseModel):
+    wpc_a: str
+    wpc_b: str
+    overlap: float
+    common_count: int
+    common_holdings: List[PairCommonHolding]
+
+
+class CommonHolding(BaseModel):
+    holding_key: str
+    holding_name: Optional[str]
+    weights: Dict[str, float]
+
+
+class PortfolioOverlapResponse(BaseModel):
+    schemes: List[OverlapScheme]
+    pairs: List[PairOverlap]
+    common_holdings: List[CommonHolding]
+
+
+class SimilarFund(BaseModel):
+    wpc: str
+    overlap: float
+    common_count: int
+    estimated_jaccard: float
+    portfolio_date: datetime
+
+
+class SimilarFundsResponse(BaseModel):
+    wpc: str
+    portfolio_date: datetime
+    candidates_count: int
+    similar: List[SimilarFund]
+
+
+class StockHolder(BaseModel):
+    wpc: str
+    holding_percentage: float
+    market_value: float
+    portfolio_date: datetime
+
+
+class StockHoldersResponse(BaseModel):
+    holding_key: str
+    holding_name: Optional[str]
+    funds_count: int
+    total_market_value: float
+    holders: List[StockHolder]
+
+
+class MostHeldStock(BaseModel):
+    holding_key: str
+    holding_name: Optional[str]
+    funds_count: int
+    funds_percentage: float
+    total_market_value: float
+    average_holding_percentage: float
+
+
 class ReturnsData(BaseModel):
     invested_value: Optional[float]
     current_value: Optional[float]
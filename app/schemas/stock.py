@@ -633,3 +633,30 @@ class StockFinancialYearlyResultSchema(BaseModel):
     total_assets: Decimal = Decimal('0.00')
     total_liabilities: Decimal = Decimal('0.00')
     # Add any additional fields from the model if necessary.
+
+
+class StockCandlesResponse(BaseModel):
+    wstockcode: str
+    exchange: str
+    resolution: str
+    t: List[str]
+    o: List[float]
+    h: List[float]
+    l: List[float]
+    c: List[float]
+    v: List[float]
+
+
+class StockIndicatorSeriesResponse(BaseModel):
+    wstockcode: str
+    exchange: str
+    params: Dict[str, int]
+    t: List[str]
+    close: List[Optional[float]]
+    rsi: List[Optional[float]]
+    macd: List[Optional[float]]
+    macd_signal: List[Optional[float]]
+    macd_hist: List[Optional[float]]
+    ema: List[Optional[float]]
+    sma: List[Optional[float]]
+    std: List[Optional[float]]
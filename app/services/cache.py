@@ -1,8 +1,11 @@
 import datetime
+import time
 import pytz
 from app.utils.constants import NavTypeChoices, WShareHoldingEntity
 #from app.constants.scheme_constants import MainCategoryChoices
-from app.cache.redis_cache import get_cache_value, set_cache_value, delete_cache_key
+from app.cache.redis_cache import (
+    get_cache_value, get_cache_values, set_cache_value, set_cache_values, delete_cache_key, delete_cache_keys
+)
 
 class CacheKeysService:
     @staticmethod
@@ -17,6 +20,10 @@ class CacheKeysService:
     async def delete_cache_key(key: str):
         await delete_cache_key(key)
 
+    @staticmethod
+    async def delete_cache_keys(keys: list):
+        await delete_cache_keys(keys)
+
     @staticmethod
     def get_stock_futures_market_live_news_cache_key(record_count: int = 50):
         if not record_count:
@@ -35,6 +42,36 @@ class CacheKeysService:
             return
         return f"6091_{wschemecode}_latest_hist_nav_updated"
 
+    # longer than any NAV key lives, so a key never outlives the version it was built with
+    HIST_NAV_VERSION_EXPIRE = 7 * 24 * 60 * 60
+
+    @staticmethod
+    def get_hist_nav_version_cache_key(wpc: str):
+        if not wpc:
+            return
+        return f"hist_nav_version_{wpc}_4127"
+
+    @classmethod
+    async def get_hist_nav_version(cls, wpc: str):
+        return await get_cache_value(cls.get_hist_nav_version_cache_key(wpc))
+
+    @classmethod
+    async def get_hist_nav_versions(cls, wpcs: list) -> dict:
+        values = await get_cache_values([cls.get_hist_nav_version_cache_key(wpc) for wpc in wpcs])
+        return {wpc: values[cls.get_hist_nav_version_cache_key(wpc)] for wpc in wpcs}
+
+    @classmethod
+    async def set_hist_nav_versions(cls, wpcs: list) -> str:
+        '''
+            Moves the NAV version of wpcs to now (epoch milliseconds). The NAV cache keys of a wpc are built
+            with its version, so this drops all of them at once, whatever their arguments.
+        '''
+        version = str(int(time.time() * 1000))
+        await set_cache_values(
+            {cls.get_hist_nav_version_cache_key(wpc): version for wpc in wpcs}, cls.HIST_NAV_VERSION_EXPIRE
+        )
+        return version
+
     @staticmethod
     def get_hist_nav_last_processed_pointer_cache_key(service_name: str):
         if not service_name:
@@ -84,6 +121,29 @@ class CacheKeysService:
             return f"get_hnd_for_n_years_with_sip_day_{wpc}_{n_years}_{sip_day}_{include_left_end_edge_case}_{include_right_end_edge_case}_{nav_date_gte}_{show_percentage_change}_5540"
         return f"get_hnd_for_n_years_with_sip_day_{wpc}_{n_years}_{sip_day}_{include_left_end_edge_case}_{include_right_end_edge_case}_{nav_date_gte}_5540"
 
+    @staticmethod
+    def scheme_hist_nav_data_for_n_years_cache_key(
+            wpc, years, step=1, as_list=False, nav_type='Nav'
+    ):
+        if not (wpc and years):
+            return
+        return f"scheme_hnd_for_n_years_{wpc}_{years}_{step}_{as_list}_{nav_type}_7213"
+
+    @staticmethod
+    def get_hist_navs_for_wpc_cache_key(
+            wpc: str, start_date: datetime.date = None, end_date: datetime.date = None, periodicity: str = 'd'
+    ):
+        if not (wpc and periodicity):
+            return
+        return f"get_hist_navs_for_wpc_{wpc}_{str(start_date)}_{str(end_date)}_{periodicity}_3307"
+
+    @staticmethod
+    def get_scheme_rolling_returns_cache_key(wpc: str, beat_percentage: float = 10):
+        if not wpc:
+            return
+        # 10, 10.0 and 1e1 are the same request
+        return f"scheme_rolling_returns_{wpc}_{float(beat_percentage):g}_5126"
+
     @staticmethod
     def get_max_starting_nav_date_for_wpcs_cache_key(
             wpcs: list, start_date: datetime.date = None, ignore_missing_schemes=False
@@ -109,6 +169,12 @@ class CacheKeysService:
             return
         return f"get_hist_prices_for_{exchange}_wstockcode_{wstockcode}_{str(start_date)}_{str(end_date)}_{periodicity}_{fields}_6621"
 
+    @staticmethod
+    def get_stock_indicator_state_cache_key(wstockcode: str):
+        if not wstockcode:
+            return
+        return f"stock_indicator_state_{wstockcode}_8153"
+
     @staticmethod
     def get_stock_pre_session_live_news_cache_key(record_count: int = 50):
         if not record_count:
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.holdings_engine import HoldingsEngine, HoldingVector
+
+logger = logging.getLogger("app")
+
+
+class SchemeHoldingVectors:
+    '''
+        Per-worker in-memory copy of the latest portfolio of every scheme as a HoldingVector, keyed by
+        isin (holding_third_party_id when there is none). SchemeHolding rows are upserted per holding, so
+        a scheme can still have rows of an older portfolio_date for holdings it exited; only the rows of
+        its latest portfolio_date are kept. load() reads every portfolio once at startup and refresh()
+        only reloads the schemes whose latest portfolio_date changed since.
+    '''
+    vectors: Dict[str, HoldingVector] = {}
+    loaded_at: Optional[datetime] = None
+    # bumped on every change of vectors, lets derived indexes skip syncing when nothing changed
+    version: int = 0
+
+    @classmethod
+    def is_loaded(cls) -> bool:
+        return cls.loaded_at is not None
+
+    @staticmethod
+    def get_raw_query_for_latest_portfolio_dates(wpcs_filter: bool = False) -> str:
+        query = "select wpc, max(portfolio_date) as portfolio_date from public.funnal_schemeholding"
+        if wpcs_filter:
+            query += " where wpc = any(CAST(:wpcs AS varchar[]))"
+        return query + " group by wpc"
+
+    @staticmethod
+    def get_raw_query_for_holdings() -> str:
+        return '''
+            select h.wpc, h.portfolio_date, coalesce(nullif(h.isin, ''), h.holding_third_party_id) as holding_key,
+                h.holding_name, h.holding_percentage, h.holding_third_party_id, h.market_value
+            from public.funnal_schemeholding h
+            join unnest(CAST(:wpcs AS varchar[]), CAST(:portfolio_dates AS timestamp[])) as l(wpc, portfolio_date)
+                on h.wpc = l.wpc and h.portfolio_date = l.portfolio_date
+            order by h.wpc
+        '''
+
+    @classmethod
+    async def get_latest_portfolio_dates(cls, db: AsyncSession, wpcs: List[str] = None) -> Dict[str, datetime]:
+        query = cls.get_raw_query_for_latest_portfolio_dates(wpcs_filter=wpcs is not None)
+        result = await db.execute(text(query), dict(wpcs=list(wpcs)) if wpcs is not None else {})
+        return {r.wpc: r.portfolio_date for r in result.fetchall()}
+
+    @classmethod
+    async def fetch_vectors(cls, db: AsyncSession, portfolio_dates: Dict[str, datetime]) -> Dict[str, HoldingVector]:
+        if not portfolio_dates:
+            return {}
+        wpcs = list(portfolio_dates)
+        result = await db.execute(
+            text(cls.get_raw_query_for_holdings()),
+            dict(wpcs=wpcs, portfolio_dates=[portfolio_dates[wpc] for wpc in wpcs])
+        )
+        rows_by_wpc = {}
+        for row in result.fetchall():
+            rows_by_wpc.setdefault(row.wpc, []).append(row)
+        vectors = {}
+        for wpc, rows in rows_by_wpc.items():
+            vectors[sys.intern(wpc)] = HoldingsEngine.make_vector(
+                rows[0].portfolio_date, [r.holding_key for r in rows], [r.holding_name for r in rows],
+                [float(r.holding_percentage or 0) for r in rows],
+                third_party_ids=[r.holding_third_party_id for r in rows],
+                market_values=[float(r.market_value or 0) for r in rows]
+            )
+        return vectors
+
+    @classmethod
+    async def load(cls, db: AsyncSession):
+        portfolio_dates = await cls.get_latest_portfolio_dates(db)
+        # swap in one go so concurrent lookups never see a half built mapping
+        cls.vectors = await cls.fetch_vectors(db, portfolio_dates)
+        cls.loaded_at = datetime.now()
+        cls.version += 1
+        logger.info(f"Loaded holding vectors of {len(cls.vectors)} schemes")
+
+    @classmethod
+    async def refresh(cls, db: AsyncSession, wpcs: List[str] = None) -> List[str]:
+        '''
+            Reloads the schemes (all, or only wpcs) whose latest portfolio_date is not the one in memory and
+            drops the ones without holdings any more. Returns the wpcs that changed.
+        '''
+        if not cls.is_loaded() and wpcs is None:
+            await cls.load(db)
+            return list(cls.vectors)
+        portfolio_dates = await cls.get_latest_portfolio_dates(db, wpcs)
+        checked = wpcs if wpcs is not None else list(cls.vectors)
+        stale = {
+            wpc: portfolio_date for wpc, portfolio_date in portfolio_dates.items()
+            if wpc not in cls.vectors or cls.vectors[wpc].portfolio_date != portfolio_date
+        }
+        removed = [wpc for wpc in checked if wpc in cls.vectors and wpc not in portfolio_dates]
+        fetched = await cls.fetch_vectors(db, stale)
+        # no await from here on: a refresh that finished while fetching is kept, only newer portfolios
+        # replace what is in memory
+        vectors = dict(cls.vectors)
+        for wpc, vector in fetched.items():
+            if wpc not in vectors or vectors[wpc].portfolio_date < vector.portfolio_date:
+                vectors[wpc] = vector
+        for wpc in removed:
+            vectors.pop(wpc, None)
+        changed = [wpc for wpc in set(vectors) | set(cls.vectors) if vectors.get(wpc) is not cls.vectors.get(wpc)]
+        cls.vectors = vectors
+        if changed:
+            cls.version += 1
+            logger.info(f"Refreshed holding vectors of {len(changed)} schemes")
+        return changed
+
+    @classmethod
+    async def run_refresh_loop(cls, session_factory, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with session_factory() as db:
+                    await cls.refresh(db)
+            except Exception as e:
+                logger.error(f"Failed to refresh holding vectors. {e}")
+
+    @classmethod
+    async def get_vectors(cls, db: AsyncSession, wpcs: List[str]) -> Dict[str, HoldingVector]:
+        '''
+            Vectors of wpcs, reading the ones that are not in memory yet (worker not loaded, or a scheme
+            whose first portfolio landed after the last refresh) from the database.
+        '''
+        missing = [wpc for wpc in wpcs if wpc not in cls.vectors]
+        if missing:
+            await cls.refresh(db, missing)
+        return {wpc: cls.vectors[wpc] for wpc in wpcs if wpc in cls.vectors}
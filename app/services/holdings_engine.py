@@ -0,0 +1,122 @@
+import hashlib
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+import numpy as np
+
+
+class HoldingVector(NamedTuple):
+    '''
+        Sparse weight vector of one scheme portfolio: holding keys sorted and unique, with the holding name,
+        holding_third_party_id, summed holding_percentage and summed market_value of every key at the same
+        position.
+    '''
+    portfolio_date: object
+    keys: np.ndarray
+    names: List[str]
+    weights: np.ndarray
+    third_party_ids: List[str]
+    market_values: np.ndarray
+
+
+class HoldingsEngine:
+    '''
+        Portfolio comparisons on HoldingVectors. Keys are kept sorted so that two portfolios are
+        intersected with one merge (np.intersect1d) instead of dict lookups per holding.
+    '''
+
+    @staticmethod
+    def make_vector(
+            portfolio_date, keys: Sequence[str], names: Sequence[str], weights: Sequence[float],
+            third_party_ids: Sequence[str] = None, market_values: Sequence[float] = None
+    ) -> HoldingVector:
+        keys = np.asarray(keys, dtype=str)
+        third_party_ids = keys.tolist() if third_party_ids is None else third_party_ids
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        # a holding reported twice (several lines of the same security) counts once with the summed weight
+        summed_weights = np.zeros(unique_keys.size)
+        np.add.at(summed_weights, inverse, np.asarray(weights, dtype=np.float64))
+        summed_market_values = np.zeros(unique_keys.size)
+        if market_values is not None:
+            np.add.at(summed_market_values, inverse, np.asarray(market_values, dtype=np.float64))
+        first = first.tolist()
+        return HoldingVector(
+            portfolio_date, unique_keys, [names[i] for i in first], summed_weights,
+            [third_party_ids[i] for i in first], summed_market_values
+        )
+
+    @staticmethod
+    def intersect(a: HoldingVector, b: HoldingVector) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+            Positions of the common holdings in a and in b.
+        '''
+        _, a_indices, b_indices = np.intersect1d(a.keys, b.keys, assume_unique=True, return_indices=True)
+        return a_indices, b_indices
+
+    @classmethod
+    def weighted_overlap(cls, a: HoldingVector, b: HoldingVector) -> float:
+        '''
+            Sum over the common holdings of the smaller of the two weights, in percent.
+        '''
+        a_indices, b_indices = cls.intersect(a, b)
+        return float(np.minimum(a.weights[a_indices], b.weights[b_indices]).sum())
+
+    @staticmethod
+    def common_keys(vectors: Sequence[HoldingVector]) -> np.ndarray:
+        keys = vectors[0].keys
+        for vector in vectors[1:]:
+            keys = np.intersect1d(keys, vector.keys, assume_unique=True)
+        return keys
+
+    @staticmethod
+    def hash_keys(keys: Sequence[str]) -> np.ndarray:
+        '''
+            Stable 64 bit hashes of holding keys (the same in every worker, unlike hash()).
+        '''
+        return np.asarray(
+            [int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') for key in keys],
+            dtype=np.uint64
+        )
+
+    @staticmethod
+    def make_permutations(count: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(seed)
+        multipliers = rng.integers(0, np.iinfo(np.uint64).max, count, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        increments = rng.integers(0, np.iinfo(np.uint64).max, count, dtype=np.uint64, endpoint=True)
+        return multipliers, increments
+
+    @staticmethod
+    def minhash_signatures(
+            hashes: np.ndarray, offsets: np.ndarray, permutations: Tuple[np.ndarray, np.ndarray]
+    ) -> np.ndarray:
+        '''
+            (len(offsets) - 1, number of permutations) uint32 MinHash signatures of the sets
+            hashes[offsets[i]:offsets[i + 1]], none of which may be empty. Every permutation is a
+            multiply-shift hash (a * x + b mod 2^64) >> 32, a odd.
+        '''
+        multipliers, increments = permutations
+        with np.errstate(over='ignore'):
+            permuted = (hashes[:, None] * multipliers[None, :] + increments[None, :]) >> np.uint64(32)
+        return np.minimum.reduceat(permuted, offsets[:-1], axis=0).astype(np.uint32)
+
+    @staticmethod
+    def band_keys(signature: np.ndarray, bands: int) -> List[bytes]:
+        '''
+            LSH bucket key of every band of a signature; two sets land in the same bucket of a band when
+            all the rows of that band are equal.
+        '''
+        raw = signature.tobytes()
+        width = len(raw) // bands
+        return [raw[start:start + width] for start in range(0, len(raw), width)]
+
+    @staticmethod
+    def aggregate(keys: np.ndarray, weights: np.ndarray, market_values: np.ndarray) -> Dict[str, np.ndarray]:
+        '''
+            Per unique key of the concatenated holdings of many schemes: the number of schemes holding it
+            (keys are unique within a scheme), the summed weight and the summed market value.
+        '''
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        return dict(
+            keys=unique_keys,
+            counts=np.bincount(inverse, minlength=unique_keys.size),
+            weights=np.bincount(inverse, weights=weights, minlength=unique_keys.size),
+            market_values=np.bincount(inverse, weights=market_values, minlength=unique_keys.size),
+        )
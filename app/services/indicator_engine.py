@@ -0,0 +1,186 @@
+from typing import Any, Dict, Optional
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class IndicatorEngine:
+    '''
+        NumPy kernels for the technical indicators stored on Stock (rsi, macd, ema, sma, std).
+        compute_series gives the full series for a close history, while initial_state/extend_state keep
+        only what is needed to carry the recursive indicators forward, so a daily update only processes
+        the new closes plus the last rolling window.
+        Warm-up values (not enough closes yet) are NaN.
+    '''
+    DEFAULT_PARAMS = dict(
+        rsi_period=14, macd_fast=12, macd_slow=26, macd_signal=9, ema_span=20, sma_window=20, std_window=20
+    )
+    # the ema recurrence is evaluated in closed form per block, small enough for (1 - alpha) ** -block to stay finite
+    EMA_BLOCK_SIZE = 128
+
+    @classmethod
+    def get_params(cls, params: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        final_params = dict(cls.DEFAULT_PARAMS)
+        final_params.update({k: v for k, v in (params or {}).items() if v})
+        return final_params
+
+    @classmethod
+    def ema(cls, values: np.ndarray, alpha: float, initial: Optional[float] = None) -> np.ndarray:
+        '''
+            y[t] = alpha * x[t] + (1 - alpha) * y[t - 1], seeded with initial (or x[0] when not given).
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        result = np.empty(values.shape)
+        if not values.size:
+            return result
+        decay = 1 - alpha
+        if decay <= 0:
+            result[:] = values
+            return result
+        if initial is None:
+            initial, values, offset = values[0], values[1:], 1
+            result[0] = initial
+        else:
+            offset = 0
+        prev = initial
+        for start in range(0, values.size, cls.EMA_BLOCK_SIZE):
+            block = values[start:start + cls.EMA_BLOCK_SIZE]
+            powers = decay ** np.arange(block.size)
+            block_result = decay * powers * prev + alpha * powers * np.cumsum(block / powers)
+            result[offset + start:offset + start + block.size] = block_result
+            prev = block_result[-1]
+        return result
+
+    @staticmethod
+    def sma(values: np.ndarray, window: int) -> np.ndarray:
+        result = np.full(values.shape, np.nan)
+        if values.size >= window:
+            cumsum = np.cumsum(np.concatenate(([0.0], values)))
+            result[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+        return result
+
+    @staticmethod
+    def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+        result = np.full(values.shape, np.nan)
+        if values.size >= window:
+            result[window - 1:] = sliding_window_view(values, window).std(axis=1)
+        return result
+
+    @classmethod
+    def wilder_averages(cls, closes: np.ndarray, period: int):
+        '''
+            Wilder smoothed average gain/loss, seeded with the simple average of the first period changes.
+        '''
+        avg_gain, avg_loss = np.full(closes.shape, np.nan), np.full(closes.shape, np.nan)
+        if closes.size <= period:
+            return avg_gain, avg_loss
+        deltas = np.diff(closes)
+        gains, losses = np.clip(deltas, 0, None), np.clip(-deltas, 0, None)
+        avg_gain[period] = gains[:period].mean()
+        avg_loss[period] = losses[:period].mean()
+        avg_gain[period + 1:] = cls.ema(gains[period:], 1 / period, initial=avg_gain[period])
+        avg_loss[period + 1:] = cls.ema(losses[period:], 1 / period, initial=avg_loss[period])
+        return avg_gain, avg_loss
+
+    @staticmethod
+    def rsi_from_averages(avg_gain: np.ndarray, avg_loss: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+        # no losses in the window means an rsi of 100
+        return np.where((avg_loss == 0) & ~np.isnan(avg_gain), 100.0, rsi)
+
+    @classmethod
+    def compute_series(cls, closes: np.ndarray, params: Optional[Dict[str, int]] = None) -> Dict[str, np.ndarray]:
+        params = cls.get_params(params)
+        closes = np.asarray(closes, dtype=np.float64)
+        ema_fast = cls.ema(closes, 2 / (params['macd_fast'] + 1))
+        ema_slow = cls.ema(closes, 2 / (params['macd_slow'] + 1))
+        macd = ema_fast - ema_slow
+        macd_signal = cls.ema(macd, 2 / (params['macd_signal'] + 1))
+        avg_gain, avg_loss = cls.wilder_averages(closes, params['rsi_period'])
+        series = dict(
+            rsi=cls.rsi_from_averages(avg_gain, avg_loss),
+            macd=macd,
+            macd_signal=macd_signal,
+            macd_hist=macd - macd_signal,
+            ema=cls.ema(closes, 2 / (params['ema_span'] + 1)),
+            sma=cls.sma(closes, params['sma_window']),
+            std=cls.rolling_std(closes, params['std_window']),
+        )
+        # the emas are seeded with the first close, hide them until their span is covered
+        series['ema'][:params['ema_span'] - 1] = np.nan
+        for key in ('macd', 'macd_signal', 'macd_hist'):
+            series[key][:params['macd_slow'] - 1] = np.nan
+        return series
+
+    @classmethod
+    def initial_state(cls, closes: np.ndarray, params: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        params = cls.get_params(params)
+        closes = np.asarray(closes, dtype=np.float64)
+        if closes.size <= params['rsi_period']:
+            return None
+        ema_fast = cls.ema(closes, 2 / (params['macd_fast'] + 1))
+        ema_slow = cls.ema(closes, 2 / (params['macd_slow'] + 1))
+        macd_signal = cls.ema(ema_fast - ema_slow, 2 / (params['macd_signal'] + 1))
+        avg_gain, avg_loss = cls.wilder_averages(closes, params['rsi_period'])
+        tail_size = max(params['sma_window'], params['std_window'])
+        return dict(
+            count=int(closes.size),
+            last_close=float(closes[-1]),
+            ema=float(cls.ema(closes, 2 / (params['ema_span'] + 1))[-1]),
+            ema_fast=float(ema_fast[-1]),
+            ema_slow=float(ema_slow[-1]),
+            macd_signal=float(macd_signal[-1]),
+            avg_gain=float(avg_gain[-1]),
+            avg_loss=float(avg_loss[-1]),
+            tail=closes[-tail_size:].tolist(),
+        )
+
+    @classmethod
+    def extend_state(
+            cls, state: Dict[str, Any], new_closes: np.ndarray, params: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Any]:
+        '''
+            Carries a state from initial_state forward over the closes that came after it.
+        '''
+        params = cls.get_params(params)
+        new_closes = np.asarray(new_closes, dtype=np.float64)
+        if not new_closes.size:
+            return state
+        deltas = np.diff(np.concatenate(([state['last_close']], new_closes)))
+        ema_fast = cls.ema(new_closes, 2 / (params['macd_fast'] + 1), initial=state['ema_fast'])
+        ema_slow = cls.ema(new_closes, 2 / (params['macd_slow'] + 1), initial=state['ema_slow'])
+        macd_signal = cls.ema(ema_fast - ema_slow, 2 / (params['macd_signal'] + 1), initial=state['macd_signal'])
+        alpha = 1 / params['rsi_period']
+        tail_size = max(params['sma_window'], params['std_window'])
+        return dict(
+            count=state['count'] + int(new_closes.size),
+            last_close=float(new_closes[-1]),
+            ema=float(cls.ema(new_closes, 2 / (params['ema_span'] + 1), initial=state['ema'])[-1]),
+            ema_fast=float(ema_fast[-1]),
+            ema_slow=float(ema_slow[-1]),
+            macd_signal=float(macd_signal[-1]),
+            avg_gain=float(cls.ema(np.clip(deltas, 0, None), alpha, initial=state['avg_gain'])[-1]),
+            avg_loss=float(cls.ema(np.clip(-deltas, 0, None), alpha, initial=state['avg_loss'])[-1]),
+            tail=np.concatenate((state['tail'], new_closes))[-tail_size:].tolist(),
+        )
+
+    @classmethod
+    def latest_values(cls, state: Dict[str, Any], params: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+        params = cls.get_params(params)
+        tail = np.asarray(state['tail'], dtype=np.float64)
+        rsi = cls.rsi_from_averages(np.array([state['avg_gain']]), np.array([state['avg_loss']]))[0]
+        sma, std = np.nan, np.nan
+        if tail.size >= params['sma_window']:
+            sma = tail[-params['sma_window']:].mean()
+        if tail.size >= params['std_window']:
+            std = tail[-params['std_window']:].std()
+        # same warm-up as compute_series, the emas are seeded with the first close
+        ema = state['ema'] if state['count'] >= params['ema_span'] else np.nan
+        macd = state['ema_fast'] - state['ema_slow'] if state['count'] >= params['macd_slow'] else np.nan
+        return dict(
+            rsi=float(rsi),
+            macd=float(macd),
+            ema=float(ema),
+            sma=float(sma),
+            std=float(std),
+        )
@@ -1,23 +1,93 @@
+import logging
+from itertools import islice
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import IntegrityError
-from typing import List, Type, Dict, Any
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Type
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
+from sqlalchemy import literal_column, text
+
+logger = logging.getLogger("app")
 
 class ModalGenericService:
     @staticmethod
-    async def safe_bulk_create(db: AsyncSession, model: Type[Any], objs: List[Dict[str, Any]]):
-        try:
-            db.add_all([model(**obj) for obj in objs])
+    def get_row_values(model: Type[Any], obj: Any) -> Dict[str, Any]:
+        if isinstance(obj, dict):
+            return obj
+        values = {c.name: getattr(obj, c.name, None) for c in model.__table__.columns}
+        # let the database fill unset primary keys (serial ids)
+        return {k: v for k, v in values.items() if not (v is None and model.__table__.columns[k].primary_key)}
+
+    @classmethod
+    async def bulk_upsert(
+        cls,
+        db: AsyncSession,
+        model: Type[Any],
+        objs: List[Any],
+        conflict_columns: Optional[Sequence[str]] = None,
+        update_columns: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        commit: bool = True,
+    ) -> Dict[str, int]:
+        """
+        Inserts objs (dicts or model instances) batch_size rows per INSERT ... ON CONFLICT statement.
+        Conflicting rows are skipped (ON CONFLICT DO NOTHING) unless conflict_columns and update_columns
+        are given, in which case they are updated. Every batch runs in a savepoint; when one fails for any
+        other reason it is split in halves until the bad rows are isolated, so a few bad rows cost
+        O(log batch_size) extra statements instead of one round trip per row.
+        Returns the inserted/updated/skipped/rejected counts.
+        """
+        counts = dict(inserted=0, updated=0, skipped=0, rejected=0)
+        if not objs:
+            return counts
+        rows = [cls.get_row_values(model, obj) for obj in objs]
+        for i in range(0, len(rows), batch_size):
+            await cls.insert_batch_isolating_failures(
+                db, model, rows[i:i + batch_size], conflict_columns, update_columns, counts
+            )
+        if commit:
             await db.commit()
-        except IntegrityError:
-            await db.rollback()
-            for obj in objs:
-                try:
-                    merged_obj = await db.merge(model(**obj))
-                    await db.commit()
-                except IntegrityError:
-                    await db.rollback()
+        if counts['rejected']:
+            logger.error(f"Bulk upsert for model {model.__name__} rejected {counts['rejected']} rows. {counts}")
+        return counts
+
+    @classmethod
+    async def insert_batch_isolating_failures(
+        cls, db: AsyncSession, model: Type[Any], rows: List[Dict[str, Any]], conflict_columns, update_columns,
+        counts: Dict[str, int]
+    ):
+        stmt = insert(model).values(rows)
+        if conflict_columns and update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(conflict_columns), set_={c: stmt.excluded[c] for c in update_columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(conflict_columns) if conflict_columns else None)
+        # xmax is 0 only for freshly inserted tuples, rows updated on conflict carry the updating xid
+        stmt = stmt.returning(literal_column("(xmax = 0)").label("inserted"))
+        try:
+            async with db.begin_nested():
+                result = await db.execute(stmt)
+                inserted_flags = result.scalars().all()
+        except (DBAPIError, SQLAlchemyError) as e:
+            if len(rows) == 1:
+                logger.error(f"Failed to save row {rows[0]} for model {model.__name__}. {e}")
+                counts['rejected'] += 1
+                return
+            middle = len(rows) // 2
+            for half in (rows[:middle], rows[middle:]):
+                await cls.insert_batch_isolating_failures(db, model, half, conflict_columns, update_columns, counts)
+            return
+        inserted = sum(1 for flag in inserted_flags if flag)
+        counts['inserted'] += inserted
+        counts['updated'] += len(inserted_flags) - inserted
+        counts['skipped'] += len(rows) - len(inserted_flags)
+
+    @classmethod
+    async def safe_bulk_create(
+        cls, db: AsyncSession, model: Type[Any], objs: List[Any], batch_size: int = 1000
+    ) -> Dict[str, int]:
+        return await cls.bulk_upsert(db, model, objs, batch_size=batch_size)
 
     @staticmethod
     async def optimized_update(
@@ -38,3 +108,75 @@ class ModalGenericService:
             stmt = stmt.where(additional_condition)
         await db.execute(stmt)
         await db.commit()
+
+    @staticmethod
+    async def bulk_update_from_arrays(
+        db: AsyncSession,
+        table: str,
+        key_column: str,
+        data: Dict[str, List[Any]],
+        column_types: Dict[str, str],
+        commit: bool = True,
+    ) -> int:
+        """
+        Updates many rows with one UPDATE ... FROM unnest(...) statement. data holds one list per column
+        (key_column included) and column_types the postgres array element type of each column. Array
+        parameters keep the bind count fixed however many rows are updated.
+        """
+        if not data.get(key_column):
+            return 0
+        columns = [c for c in column_types if c != key_column]
+        set_str = ", ".join(f"{c} = v.{c}" for c in columns)
+        arrays_str = ", ".join(f"CAST(:{c} AS {column_types[c]}[])" for c in [key_column, *columns])
+        query = f"UPDATE {table} AS t SET {set_str} " \
+                f"FROM unnest({arrays_str}) AS v({key_column}, {', '.join(columns)}) " \
+                f"WHERE t.{key_column} = v.{key_column}"
+        result = await db.execute(text(query), {c: data[c] for c in [key_column, *columns]})
+        if commit:
+            await db.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def copy_upsert(
+        db: AsyncSession,
+        table: str,
+        columns: Sequence[str],
+        records: Iterable[tuple],
+        conflict_columns: Sequence[str],
+        update_columns: Optional[Sequence[str]] = None,
+        chunk_size: int = 10000,
+    ) -> int:
+        """
+        Streams records (tuples in the order of columns) into a temp staging table with COPY, chunk_size
+        rows at a time, then merges the whole stage into table with one INSERT ... ON CONFLICT DO UPDATE.
+        No bind parameters are used for the rows, so there is no limit on how many can be written.
+        Records must be unique on conflict_columns. Runs inside the session's transaction, the caller commits.
+        Only works with the asyncpg driver.
+        """
+        update_columns = [c for c in (update_columns or columns) if c not in conflict_columns]
+        stage = f"_stage_{table}"
+        columns_str = ", ".join(columns)
+        await db.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+        await db.execute(text(
+            f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {columns_str} FROM {table} WITH NO DATA"
+        ))
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            await driver_connection.copy_records_to_table(stage, records=chunk, columns=list(columns))
+
+        if update_columns:
+            set_str = ", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+            conflict_action = f"DO UPDATE SET {set_str}"
+        else:
+            conflict_action = "DO NOTHING"
+        result = await db.execute(text(
+            f"INSERT INTO {table} ({columns_str}) SELECT {columns_str} FROM {stage} "
+            f"ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action}"
+        ))
+        return result.rowcount
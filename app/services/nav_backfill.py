@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import sessionmanager
+from app.services.cache import CacheKeysService
+from app.utils.concurrent import execute_coroutines_concurrently
+
+logger = logging.getLogger("app")
+
+
+class NavBackfillService:
+    '''
+        Resumable backfill over every scheme, in wpc order. Each wave takes CONCURRENCY chunks of CHUNK_SIZE
+        wpcs and runs them at the same time, each chunk on its own session. Once a wave is committed, its
+        last wpc is saved under get_hist_nav_last_processed_pointer_cache_key(service_name), so a restarted
+        run resumes after it and at most one wave is redone after a crash.
+        A processor is async (db, wpcs, start_date) -> rows written, and commits its own work.
+    '''
+    CHECKPOINT_EXPIRE = 30 * 24 * 60 * 60
+
+    @staticmethod
+    async def recompute_hist_nav_changes(db: AsyncSession, wpcs: List[str], start_date: Optional[date] = None) -> int:
+        '''
+            Recomputes diff/percentage_change of the stored NAVs (against the previous stored NAV) from
+            start_date on. Rows that already hold the right values are not rewritten.
+        '''
+        start_date_filter_str = "and h.nav_date >= :start_date " if start_date else ""
+        query = "UPDATE public.funnal_schemehistnavdata AS h " \
+                "SET diff = c.diff, percentage_change = c.percentage_change " \
+                "FROM (select id, coalesce(round(nav - prev_nav, 6), 0) as diff, " \
+                "coalesce(round((nav - prev_nav) * 100 / nullif(prev_nav, 0), 6), 0) as percentage_change " \
+                "from (select id, nav, lag(nav) over (partition by wpc order by nav_date) as prev_nav " \
+                "from public.funnal_schemehistnavdata where wpc = any(CAST(:wpcs AS varchar[]))) as w) AS c " \
+                f"WHERE h.id = c.id {start_date_filter_str}" \
+                "and (h.diff, h.percentage_change) is distinct from (c.diff, c.percentage_change)"
+        params = dict(wpcs=wpcs, start_date=start_date) if start_date else dict(wpcs=wpcs)
+        result = await db.execute(text(query), params)
+        await db.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def populate_nfo_hist_navs(db: AsyncSession, wpcs: List[str], start_date: Optional[date] = None) -> int:
+        from app.services.service import SchemeHistNavService
+
+        return await SchemeHistNavService.populate_hist_nav_for_nfos(db, wpcs=wpcs)
+
+    PROCESSORS: Dict[str, Callable[..., Awaitable[int]]] = dict(
+        hist_nav_changes=recompute_hist_nav_changes,
+        nfo_hist_navs=populate_nfo_hist_navs,
+    )
+
+    @staticmethod
+    async def get_checkpoint(service_name: str) -> Optional[Dict[str, Any]]:
+        value = await CacheKeysService.get_cache_value(
+            CacheKeysService.get_hist_nav_last_processed_pointer_cache_key(service_name)
+        )
+        return json.loads(value) if value else None
+
+    @classmethod
+    async def save_checkpoint(cls, service_name: str, checkpoint: Dict[str, Any]):
+        await CacheKeysService.set_cache_value(
+            CacheKeysService.get_hist_nav_last_processed_pointer_cache_key(service_name),
+            json.dumps(checkpoint, default=str), expire=cls.CHECKPOINT_EXPIRE
+        )
+
+    @staticmethod
+    async def get_next_wpcs(db: AsyncSession, after_wpc: Optional[str], limit: int) -> List[str]:
+        query = "select wpc from public.funnal_scheme where wpc is not null " \
+                "and (CAST(:after_wpc AS varchar) is null or wpc > CAST(:after_wpc AS varchar)) " \
+                "order by wpc limit :limit"
+        result = await db.execute(text(query), dict(after_wpc=after_wpc, limit=limit))
+        return result.scalars().all()
+
+    @classmethod
+    async def process_chunk(cls, processor, wpcs: List[str], start_date: Optional[date]) -> int:
+        async with sessionmanager.session() as db:
+            return await processor(db, wpcs, start_date)
+
+    @classmethod
+    async def backfill(
+            cls, service_name: str, start_date: Optional[date] = None, restart: bool = False,
+            chunk_size: int = None, concurrency: int = None
+    ) -> Dict[str, Any]:
+        '''
+            Runs PROCESSORS[service_name] over every wpc after the saved checkpoint (from the first one when
+            restart or there is none). A resumed run keeps the start_date it was started with.
+        '''
+        processor = cls.PROCESSORS[service_name]
+        chunk_size = chunk_size or settings.NAV_BACKFILL_CHUNK_SIZE
+        concurrency = concurrency or settings.NAV_BACKFILL_CONCURRENCY
+        checkpoint = None if restart else await cls.get_checkpoint(service_name)
+        if checkpoint and checkpoint.get('completed_at'):
+            checkpoint = None
+        if checkpoint:
+            start_date = date.fromisoformat(checkpoint['start_date']) if checkpoint.get('start_date') else None
+            logger.info(f"Resuming {service_name} backfill after {checkpoint['wpc']}")
+        else:
+            checkpoint = dict(wpc=None, start_date=start_date, rows=0, wpcs=0, started_at=datetime.now())
+        started_at, rows, wpcs_count = time.monotonic(), 0, 0
+
+        while True:
+            # a short session per wave, so no transaction stays open for the whole run
+            async with sessionmanager.session() as db:
+                wpcs = await cls.get_next_wpcs(db, checkpoint['wpc'], chunk_size * concurrency)
+            if not wpcs:
+                break
+            chunks = [wpcs[i:i + chunk_size] for i in range(0, len(wpcs), chunk_size)]
+            results = await execute_coroutines_concurrently(
+                functions_list=[cls.process_chunk] * len(chunks),
+                kwargs_list=[dict(processor=processor, wpcs=chunk, start_date=start_date) for chunk in chunks],
+                workers_count=concurrency, raise_exception=True
+            )
+            rows += sum(results)
+            wpcs_count += len(wpcs)
+            checkpoint.update(
+                wpc=wpcs[-1], rows=checkpoint['rows'] + sum(results), wpcs=checkpoint['wpcs'] + len(wpcs),
+                updated_at=datetime.now()
+            )
+            await cls.save_checkpoint(service_name, checkpoint)
+            elapsed = max(time.monotonic() - started_at, 1e-6)
+            logger.info(
+                f"{service_name} backfill at {wpcs[-1]}: {checkpoint['wpcs']} wpcs, {checkpoint['rows']} rows, "
+                f"{wpcs_count / elapsed:.1f} wpcs/s, {rows / elapsed:.1f} rows/s"
+            )
+
+        checkpoint['completed_at'] = datetime.now()
+        await cls.save_checkpoint(service_name, checkpoint)
+        logger.info(f"{service_name} backfill completed in {time.monotonic() - started_at:.1f}s. {checkpoint}")
+        return checkpoint
+
+
+if __name__ == "__main__":
+    asyncio.run(NavBackfillService.backfill(sys.argv[1]))
@@ -0,0 +1,260 @@
+import asyncio
+import csv
+import logging
+import os
+import sys
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import sessionmanager
+from app.exceptions import WealthyValidationError
+from app.services.cache import CacheKeysService
+from app.services.modal_generic import ModalGenericService
+from app.services.nav_backfill import NavBackfillService
+from app.services.nav_store import NavStore
+from app.services.nav_store_sync import NavStoreService
+
+logger = logging.getLogger("app")
+
+
+class NavIngestionService:
+    '''
+        Loads a day's NAV file (csv with wpc, nav_date, nav and an optional adj_nav column) into
+        SchemeHistNavData. The previous NAV of every row is read with one query, diff/percentage_change
+        are computed as arrays, the rows are upserted through COPY, Scheme.latest_hnav_date is moved forward,
+        the NavStore (when enabled) is synced and only the NAV cache of the updated schemes is invalidated.
+    '''
+    Modal = "funnal_schemehistnavdata"
+    COLUMNS = ('wpc', 'nav_date', 'nav', 'adj_nav', 'diff', 'percentage_change')
+    DECIMAL_PLACES = 6
+
+    @staticmethod
+    def parse_nav_rows(rows: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, np.ndarray], int]:
+        '''
+            Returns columnar data sorted by (wpc, nav_date), the last row winning for duplicates, and the
+            number of rows that could not be parsed.
+        '''
+        navs_by_key, invalid = {}, 0
+        for row in rows:
+            try:
+                wpc = (row.get('wpc') or '').strip()
+                nav_date = row['nav_date']
+                if not isinstance(nav_date, date):
+                    nav_date = date.fromisoformat(str(nav_date).strip()[:10])
+                nav = Decimal(str(row['nav']).strip())
+                adj_nav = Decimal(str(row.get('adj_nav') or nav).strip())
+            except (KeyError, TypeError, ValueError, InvalidOperation):
+                invalid += 1
+                continue
+            if not wpc or not nav.is_finite() or nav <= 0 or not adj_nav.is_finite():
+                invalid += 1
+                continue
+            navs_by_key[(wpc, nav_date)] = (nav, adj_nav)
+        keys = sorted(navs_by_key)
+        data = dict(
+            wpc=np.asarray([k[0] for k in keys], dtype=object),
+            nav_date=np.asarray([k[1] for k in keys], dtype='datetime64[D]'),
+            nav=np.asarray([navs_by_key[k][0] for k in keys], dtype=object),
+            adj_nav=np.asarray([navs_by_key[k][1] for k in keys], dtype=object),
+        )
+        return data, invalid
+
+    @classmethod
+    def get_raw_query_for_previous_navs(cls) -> str:
+        '''
+            For every (wpc, nav_date) pair of the bound arrays, whether the scheme exists, its last NAV
+            before that date and whether it has a NAV after that date. Rows come back by their 1-based
+            position in the arrays.
+        '''
+        return f"select r.idx, exists(select 1 from public.funnal_scheme s where s.wpc = r.wpc) as known, h.nav, " \
+               f"exists(select 1 from public.{cls.Modal} n where n.wpc = r.wpc and n.nav_date > r.nav_date) " \
+               f"as has_next " \
+               f"from unnest(CAST(:wpcs AS varchar[]), CAST(:nav_dates AS date[])) with ordinality as r(wpc, nav_date, idx) " \
+               f"left join lateral (select nav from public.{cls.Modal} where wpc = r.wpc and nav_date < r.nav_date " \
+               f"order by nav_date desc limit 1) as h on true;"
+
+    @classmethod
+    async def get_previous_navs(
+            cls, db: AsyncSession, data: Dict[str, np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            Returns (known, previous_navs, has_next) aligned with data. previous_navs is NaN where there is no
+            earlier NAV, has_next tells the rows that land before a stored NAV of their wpc.
+        '''
+        size = data['wpc'].size
+        known, previous_navs, has_next = np.zeros(size, dtype=bool), np.full(size, np.nan), np.zeros(size, dtype=bool)
+        if not size:
+            return known, previous_navs, has_next
+        result = await db.execute(
+            text(cls.get_raw_query_for_previous_navs()),
+            dict(wpcs=data['wpc'].tolist(), nav_dates=data['nav_date'].tolist())
+        )
+        rows = result.fetchall()
+        indices = np.asarray([r.idx - 1 for r in rows], dtype=np.int64)
+        known[indices] = [r.known for r in rows]
+        previous_navs[indices] = [np.nan if r.nav is None else float(r.nav) for r in rows]
+        has_next[indices] = [r.has_next for r in rows]
+        return known, previous_navs, has_next
+
+    @staticmethod
+    def compute_changes(
+            wpcs: np.ndarray, navs: np.ndarray, previous_navs: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+            diff and percentage_change of rows sorted by (wpc, nav_date). A row whose wpc also has an earlier
+            row in the file is compared with that row instead of the stored NAV. No previous NAV gives 0.
+        '''
+        navs = navs.astype(np.float64)
+        previous_navs = previous_navs.copy()
+        if navs.size > 1:
+            same_wpc = np.concatenate(([False], wpcs[1:] == wpcs[:-1]))
+            previous_navs[same_wpc] = navs[np.flatnonzero(same_wpc) - 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff = navs - previous_navs
+            percentage_change = diff * 100 / previous_navs
+        diff = np.where(np.isfinite(diff), diff, 0)
+        percentage_change = np.where(np.isfinite(percentage_change), percentage_change, 0)
+        return diff, percentage_change
+
+    @classmethod
+    def make_hist_nav_records(
+            cls, data: Dict[str, np.ndarray], diff: np.ndarray, percentage_change: np.ndarray
+    ) -> List[tuple]:
+        diff = np.round(diff, cls.DECIMAL_PLACES).tolist()
+        percentage_change = np.round(percentage_change, cls.DECIMAL_PLACES).tolist()
+        return [
+            (wpc, nav_date, nav, adj_nav, Decimal(repr(d)), Decimal(repr(p)))
+            for wpc, nav_date, nav, adj_nav, d, p in zip(
+                data['wpc'].tolist(), data['nav_date'].tolist(), data['nav'].tolist(), data['adj_nav'].tolist(),
+                diff, percentage_change
+            )
+        ]
+
+    @staticmethod
+    async def recompute_following_changes(db: AsyncSession, data: Dict[str, np.ndarray], has_next: np.ndarray) -> int:
+        '''
+            A NAV upserted before a stored NAV of its wpc (a correction or a late NAV) changes the
+            diff/percentage_change of the stored row after it, which compute_changes cannot see. Those of the
+            affected wpcs are recomputed from the earliest such date on. Returns the number of rows fixed.
+        '''
+        if not has_next.any():
+            return 0
+        wpcs = sorted(set(data['wpc'][has_next].tolist()))
+        return await NavBackfillService.recompute_hist_nav_changes(db, wpcs, data['nav_date'][has_next].min().item())
+
+    @staticmethod
+    async def update_latest_hnav_dates(db: AsyncSession, wpcs: List[str], nav_dates: List[date]) -> List[Any]:
+        '''
+            Moves Scheme.latest_hnav_date forward to the newest ingested date (never backwards) and returns
+            the (wpc, wschemecode) of every scheme that got new NAVs.
+        '''
+        query = "UPDATE public.funnal_scheme AS s " \
+                "SET latest_hnav_date = GREATEST(s.latest_hnav_date, v.nav_date) " \
+                "FROM (select wpc, max(nav_date) as nav_date " \
+                "from unnest(CAST(:wpcs AS varchar[]), CAST(:nav_dates AS date[])) as r(wpc, nav_date) " \
+                "group by wpc) AS v " \
+                "WHERE s.wpc = v.wpc RETURNING s.wpc, s.wschemecode"
+        result = await db.execute(text(query), dict(wpcs=wpcs, nav_dates=nav_dates))
+        return result.fetchall()
+
+    @staticmethod
+    async def invalidate_nav_cache(schemes: List[Any]) -> int:
+        '''
+            Moves the NAV version of the updated schemes on, which drops their NAV keys of every date range
+            and flag at once, and deletes their latest_hist_nav_updated keys. Returns the number of schemes.
+        '''
+        wpcs = [scheme.wpc for scheme in schemes]
+        keys = [CacheKeysService.get_latest_hist_nav_updated_cache_key(scheme.wschemecode) for scheme in schemes]
+        try:
+            await CacheKeysService.set_hist_nav_versions(wpcs)
+            await CacheKeysService.delete_cache_keys([key for key in keys if key])
+        except Exception as e:
+            logger.error(f"Failed to invalidate NAV cache keys. {e}")
+        return len(wpcs)
+
+    @staticmethod
+    async def sync_nav_store(db: AsyncSession, wpcs: List[str], nav_dates: List[date]) -> Optional[Dict[str, int]]:
+        '''
+            Appends the ingested NAVs to the NavStore. Appending only takes NAVs after the last stored one
+            of their wpc, so a NAV on or before it (a correction) rebuilds the store instead.
+        '''
+        if not settings.NAV_STORE_PATH:
+            return None
+        try:
+            store = NavStore.open(settings.NAV_STORE_PATH)
+            full = store is None
+            if store:
+                last_dates = {wpc: store.get_last_date(wpc) for wpc in set(wpcs)}
+                full = any(
+                    last_dates[wpc] is not None and nav_date <= last_dates[wpc]
+                    for wpc, nav_date in zip(wpcs, nav_dates)
+                )
+            return await NavStoreService.sync(db, full=full)
+        except Exception as e:
+            logger.error(f"Failed to sync NAV store after ingestion. {e}")
+            return None
+
+    @classmethod
+    async def ingest_navs(cls, db: AsyncSession, rows: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        started_at = time.monotonic()
+        data, invalid = cls.parse_nav_rows(rows)
+        known, previous_navs, has_next = await cls.get_previous_navs(db, data)
+        counts = dict(received=int(data['wpc'].size) + invalid, invalid=invalid, unknown=int((~known).sum()))
+        if not known.all():
+            logger.warning(f"Skipping NAVs of unknown wpcs: {sorted(set(data['wpc'][~known].tolist()))[:20]}")
+            data = {column: values[known] for column, values in data.items()}
+            previous_navs, has_next = previous_navs[known], has_next[known]
+        diff, percentage_change = cls.compute_changes(data['wpc'], data['nav'], previous_navs)
+        records = cls.make_hist_nav_records(data, diff, percentage_change)
+        loaded_at = time.monotonic()
+        counts['upserted'] = await ModalGenericService.copy_upsert(
+            db, table=cls.Modal, columns=cls.COLUMNS, records=records, conflict_columns=('wpc', 'nav_date')
+        )
+        schemes = await cls.update_latest_hnav_dates(db, data['wpc'].tolist(), data['nav_date'].tolist())
+        await db.commit()
+        counts['schemes'] = len(schemes)
+        counts['recomputed'] = await cls.recompute_following_changes(db, data, has_next)
+        written_at = time.monotonic()
+        # versions first: the store synced next is newer than them and covers these schemes again, until
+        # then they are read from Postgres
+        counts['cache_schemes'] = await cls.invalidate_nav_cache(schemes)
+        await cls.sync_nav_store(db, data['wpc'].tolist(), data['nav_date'].tolist())
+        logger.info(
+            f"NAV ingestion {counts}. load {loaded_at - started_at:.1f}s, write {written_at - loaded_at:.1f}s, "
+            f"cache and store {time.monotonic() - written_at:.1f}s"
+        )
+        return counts
+
+    @staticmethod
+    def get_nav_file_path(file_name: str) -> str:
+        '''
+            Path of the NAV file file_name in settings.NAV_INGEST_DIR. Only the bare name of a file directly
+            in that directory is accepted, so a caller cannot have any other file of the server read.
+        '''
+        if not settings.NAV_INGEST_DIR:
+            raise WealthyValidationError("NAV ingestion is not configured")
+        root = os.path.realpath(settings.NAV_INGEST_DIR)
+        path = os.path.realpath(os.path.join(root, file_name or ''))
+        if not file_name or os.path.basename(file_name) != file_name or os.path.dirname(path) != root \
+                or not os.path.isfile(path):
+            raise WealthyValidationError("Invalid NAV file", params=dict(file_name=file_name))
+        return path
+
+    @classmethod
+    async def ingest_nav_file(cls, db: AsyncSession, path: str) -> Dict[str, int]:
+        with open(path, newline='') as f:
+            return await cls.ingest_navs(db, csv.DictReader(f))
+
+    @classmethod
+    async def run(cls, path: str) -> Dict[str, int]:
+        async with sessionmanager.session() as db:
+            return await cls.ingest_nav_file(db, path)
+
+
+if __name__ == "__main__":
+    asyncio.run(NavIngestionService.run(sys.argv[1]))
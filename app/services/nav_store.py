@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.utils.constants import EPOCH
+
+
+class NavStore:
+    '''
+        Read-only columnar copy of SchemeHistNavData. The rows are sorted by (wpc, nav_date) and kept as
+        three memory-mapped arrays: dates (int32 days since the epoch), navs and adj_navs (float64), with
+        offsets[i]:offsets[i + 1] being the rows of wpcs[i]. Every worker maps the same files, so the data
+        lives once in the page cache and lookups are binary searches over array views.
+        A store is a generation directory under root, named by the CURRENT file. A new generation is
+        written next to it and CURRENT is switched with an atomic rename, so open stores are never changed.
+    '''
+    ARRAYS = ('offsets', 'dates', 'navs', 'adj_navs')
+    KEEP_GENERATIONS = 2
+
+    def __init__(self, root: str, generation: str, meta: Dict, arrays: Dict[str, np.ndarray]):
+        self.root, self.generation, self.meta = root, generation, meta
+        self.wpcs: List[str] = meta['wpcs']
+        self.index = {wpc: i for i, wpc in enumerate(self.wpcs)}
+        self.offsets, self.dates = arrays['offsets'], arrays['dates']
+        self.navs, self.adj_navs = arrays['navs'], arrays['adj_navs']
+        self.synced_at = datetime.fromisoformat(meta['synced_at'])
+
+    @staticmethod
+    def get_current_generation(root: str) -> Optional[str]:
+        try:
+            with open(os.path.join(root, 'CURRENT')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open(cls, root: str) -> Optional['NavStore']:
+        generation = cls.get_current_generation(root)
+        if not generation:
+            return None
+        path = os.path.join(root, generation)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in cls.ARRAYS}
+        return cls(root, generation, meta, arrays)
+
+    @staticmethod
+    def group_rows(codes: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        '''
+            wpcs and offsets of rows sorted by wpc.
+        '''
+        if not codes.size:
+            return [], np.zeros(1, dtype=np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+        return codes[starts].tolist(), np.concatenate((starts, [codes.size])).astype(np.int64)
+
+    @classmethod
+    def write(
+            cls, root: str, wpcs: List[str], offsets: np.ndarray, dates: np.ndarray, navs: np.ndarray,
+            adj_navs: np.ndarray, synced_at: datetime = None
+    ) -> str:
+        generation = int(time.time() * 1000)
+        while os.path.exists(os.path.join(root, str(generation))):
+            generation += 1
+        generation = str(generation)
+        tmp_path = os.path.join(root, f"{generation}.tmp")
+        os.makedirs(tmp_path)
+        arrays = dict(
+            offsets=np.asarray(offsets, dtype=np.int64), dates=np.asarray(dates, dtype=np.int32),
+            navs=np.asarray(navs, dtype=np.float64), adj_navs=np.asarray(adj_navs, dtype=np.float64)
+        )
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(dict(wpcs=list(wpcs), synced_at=(synced_at or datetime.now()).isoformat()), f)
+        os.rename(tmp_path, os.path.join(root, generation))
+        with open(os.path.join(root, 'CURRENT.tmp'), 'w') as f:
+            f.write(generation)
+        os.replace(os.path.join(root, 'CURRENT.tmp'), os.path.join(root, 'CURRENT'))
+        cls.remove_old_generations(root, generation)
+        return generation
+
+    @classmethod
+    def remove_old_generations(cls, root: str, current: str):
+        # workers still mapping a removed generation keep reading it until they reopen
+        generations = sorted((g for g in os.listdir(root) if g.isdigit()), key=int)
+        for generation in generations[:-cls.KEEP_GENERATIONS]:
+            if generation != current:
+                shutil.rmtree(os.path.join(root, generation), ignore_errors=True)
+
+    def merge(
+            self, codes: np.ndarray, days: np.ndarray, navs: np.ndarray, adj_navs: np.ndarray
+    ) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            Arrays of this store plus new rows sorted by (wpc, day). Only rows after the last stored date of
+            their wpc are taken, corrections of older NAVs need a full rebuild.
+        '''
+        wpc_indices = np.asarray([self.index.get(code, -1) for code in codes.tolist()], dtype=np.int64)
+        known = wpc_indices >= 0
+        last_days = np.full(len(self.wpcs), np.iinfo(np.int32).min, dtype=np.int64)
+        non_empty = self.offsets[1:] > self.offsets[:-1]
+        last_days[non_empty] = self.dates[self.offsets[1:][non_empty] - 1]
+        take = known.copy()
+        take[known] = days[known] > last_days[wpc_indices[known]]
+        positions = self.offsets[1:][wpc_indices[take]]
+        merged_dates = np.insert(np.asarray(self.dates), positions, days[take])
+        merged_navs = np.insert(np.asarray(self.navs), positions, navs[take])
+        merged_adj_navs = np.insert(np.asarray(self.adj_navs), positions, adj_navs[take])
+        counts = np.bincount(wpc_indices[take], minlength=len(self.wpcs))
+        offsets = np.asarray(self.offsets) + np.concatenate(([0], np.cumsum(counts)))
+
+        # wpcs new to the store go at the end
+        new_wpcs, new_offsets = self.group_rows(codes[~known])
+        wpcs = self.wpcs + new_wpcs
+        offsets = np.concatenate((offsets, offsets[-1] + new_offsets[1:]))
+        merged_dates = np.concatenate((merged_dates, days[~known]))
+        merged_navs = np.concatenate((merged_navs, navs[~known]))
+        merged_adj_navs = np.concatenate((merged_adj_navs, adj_navs[~known]))
+        return wpcs, offsets, merged_dates, merged_navs, merged_adj_navs
+
+    def is_fresh(self, max_age: int) -> bool:
+        return (datetime.now() - self.synced_at).total_seconds() <= max_age
+
+    def get_bounds(self, wpc: str) -> Optional[Tuple[int, int]]:
+        i = self.index.get(wpc)
+        if i is None:
+            return None
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def get_last_date(self, wpc: str) -> Optional[date]:
+        bounds = self.get_bounds(wpc)
+        if not bounds or bounds[0] == bounds[1]:
+            return None
+        return date.fromordinal(EPOCH.toordinal() + int(self.dates[bounds[1] - 1]))
+
+    def get_series(self, wpc: str, since: date = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (dates, navs, adj_navs) views of a wpc, from since on when given.
+        '''
+        bounds = self.get_bounds(wpc) or (0, 0)
+        start, end = bounds
+        if since is not None and end > start:
+            start += int(np.searchsorted(self.dates[start:end], (since - EPOCH).days, side='left'))
+        return self.dates[start:end], self.navs[start:end], self.adj_navs[start:end]
+
+    def get_as_on(self, wpc: str, as_on: date, approx: bool = True) -> Optional[Tuple[date, float, float]]:
+        '''
+            (nav_date, nav, adj_nav) of the last NAV on or before as_on, or only on as_on when not approx.
+        '''
+        bounds = self.get_bounds(wpc)
+        if not bounds or bounds[0] == bounds[1]:
+            return None
+        start, end = bounds
+        day = (as_on - EPOCH).days
+        position = start + int(np.searchsorted(self.dates[start:end], day, side='right')) - 1
+        if position < start or (not approx and self.dates[position] != day):
+            return None
+        nav_date = date.fromordinal(EPOCH.toordinal() + int(self.dates[position]))
+        return nav_date, float(self.navs[position]), float(self.adj_navs[position])
+
+    @staticmethod
+    def to_dates(days: np.ndarray) -> List[str]:
+        return np.asarray(days, dtype='datetime64[D]').astype(str).tolist()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import sessionmanager
+from app.models.scheme import SchemeHistNavData
+from app.services.cache import CacheKeysService
+from app.services.nav_store import NavStore
+
+logger = logging.getLogger("app")
+
+
+class NavStoreService:
+    '''
+        Builds the NavStore under settings.NAV_STORE_PATH from Postgres and serves it to the read path.
+        sync() with full rebuilds it from a snapshot of SchemeHistNavData, otherwise only the NAVs of the
+        last APPEND_LOOKBACK days before the previous sync are read and appended. get_store() returns the
+        current generation of this worker, or None when the store is disabled, missing or older than
+        NAV_STORE_MAX_AGE, in which case callers read Postgres. A wpc added or ingested since the last
+        sync may still be missing or behind in a current store, get_covering_store() and
+        get_uncovered_wpcs() tell which wpcs the store can answer for. synced_at is taken before the
+        rows are read, so a NAV written while a sync runs always counts as newer than the store.
+    '''
+    CHUNK_SIZE = 100000
+    APPEND_LOOKBACK = timedelta(days=10)
+
+    store: Optional[NavStore] = None
+    checked_at: float = 0
+
+    @classmethod
+    def get_store(cls) -> Optional[NavStore]:
+        if not settings.NAV_STORE_PATH:
+            return None
+        if time.monotonic() - cls.checked_at >= settings.NAV_STORE_RELOAD_INTERVAL:
+            cls.checked_at = time.monotonic()
+            try:
+                generation = NavStore.get_current_generation(settings.NAV_STORE_PATH)
+                if generation and (cls.store is None or cls.store.generation != generation):
+                    cls.store = NavStore.open(settings.NAV_STORE_PATH)
+            except Exception as e:
+                logger.error(f"Failed to open NAV store. {e}")
+        if cls.store and cls.store.is_fresh(settings.NAV_STORE_MAX_AGE):
+            return cls.store
+        return None
+
+    @staticmethod
+    async def get_uncovered_wpcs(store: NavStore, wpcs: List[str]) -> List[str]:
+        '''
+            wpcs the store cannot answer for: missing from it, or whose NAV version (moved on by every NAV
+            write, see CacheKeysService.set_hist_nav_versions) is newer than the store. The versions come
+            from the local cache or redis, so a covered wpc costs no database query. Every wpc is uncovered
+            when the versions cannot be read.
+        '''
+        try:
+            versions = await CacheKeysService.get_hist_nav_versions(wpcs)
+        except Exception as e:
+            logger.error(f"Failed to read NAV versions. {e}")
+            return list(wpcs)
+        synced_at = store.synced_at.timestamp() * 1000
+        return [
+            wpc for wpc in wpcs
+            if store.get_last_date(wpc) is None or int(versions.get(wpc) or 0) > synced_at
+        ]
+
+    @classmethod
+    async def get_covering_store(cls, wpc: str) -> Optional[NavStore]:
+        '''
+            The store when it has every NAV of wpc, else None so that the caller reads Postgres.
+        '''
+        store = cls.get_store()
+        if not store or await cls.get_uncovered_wpcs(store, [wpc]):
+            return None
+        return store
+
+    @classmethod
+    async def load_rows(
+            cls, db: AsyncSession, since: date = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (wpcs, days, navs, adj_navs) arrays sorted by (wpc, nav_date), streamed in chunks.
+        '''
+        Modal = SchemeHistNavData
+        query = select(Modal.wpc, Modal.nav_date, Modal.nav, Modal.adj_nav)
+        if since:
+            query = query.where(Modal.nav_date >= since)
+        query = query.order_by(Modal.wpc, Modal.nav_date).execution_options(yield_per=cls.CHUNK_SIZE)
+        codes, days, navs, adj_navs = [], [], [], []
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            chunk_codes, chunk_dates, chunk_navs, chunk_adj_navs = zip(*rows)
+            codes.append(np.asarray(chunk_codes, dtype=object))
+            days.append(np.asarray(chunk_dates, dtype='datetime64[D]').astype(np.int32))
+            navs.append(np.asarray(chunk_navs, dtype=np.float64))
+            adj_navs.append(np.asarray(chunk_adj_navs, dtype=np.float64))
+        if not codes:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int32), np.empty(0), np.empty(0)
+        return np.concatenate(codes), np.concatenate(days), np.concatenate(navs), np.concatenate(adj_navs)
+
+    @classmethod
+    async def sync(cls, db: AsyncSession, full: bool = False) -> Dict[str, int]:
+        started_at, synced_at = time.monotonic(), datetime.now()
+        root = settings.NAV_STORE_PATH
+        os.makedirs(root, exist_ok=True)
+        store = None if full else NavStore.open(root)
+        since = store.synced_at.date() - cls.APPEND_LOOKBACK if store else None
+        codes, days, navs, adj_navs = await cls.load_rows(db, since=since)
+        loaded_at = time.monotonic()
+        if store:
+            wpcs, offsets, days, navs, adj_navs = store.merge(codes, days, navs, adj_navs)
+        else:
+            wpcs, offsets = NavStore.group_rows(codes)
+        generation = NavStore.write(root, wpcs, offsets, days, navs, adj_navs, synced_at=synced_at)
+        counts = dict(wpcs=len(wpcs), rows=int(days.size), read=int(codes.size))
+        logger.info(
+            f"NAV store generation {generation} written {counts}. "
+            f"load {loaded_at - started_at:.1f}s, write {time.monotonic() - loaded_at:.1f}s"
+        )
+        return counts
+
+    @classmethod
+    async def run(cls, full: bool = False) -> Dict[str, int]:
+        async with sessionmanager.session() as db:
+            return await cls.sync(db, full=full)
+
+
+if __name__ == "__main__":
+    asyncio.run(NavStoreService.run(full='--full' in sys.argv))
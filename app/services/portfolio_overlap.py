@@ -0,0 +1,79 @@
+import logging
+from itertools import combinations
+from typing import Any, Dict, List
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.exceptions import WealthyValidationError
+from app.services.holding_vectors import SchemeHoldingVectors
+from app.services.holdings_engine import HoldingsEngine
+
+logger = logging.getLogger("app")
+
+
+class PortfolioOverlapService:
+    '''
+        Overlap between the latest portfolios of 2 to MAX_SCHEMES schemes, from the in-memory
+        SchemeHoldingVectors. The overlap of a pair is the sum over the common holdings of the smaller
+        weight (in percent), i.e. the part of either portfolio that is invested in the same securities.
+    '''
+    MIN_SCHEMES = 2
+    MAX_SCHEMES = 20
+
+    @staticmethod
+    def round_weight(value: float) -> float:
+        return round(float(value), 4)
+
+    @classmethod
+    def get_pair_overlap(cls, wpc_a: str, a, wpc_b: str, b) -> Dict[str, Any]:
+        a_indices, b_indices = HoldingsEngine.intersect(a, b)
+        a_weights, b_weights = a.weights[a_indices], b.weights[b_indices]
+        min_weights = np.minimum(a_weights, b_weights)
+        order = np.argsort(-min_weights, kind='stable')
+        return dict(
+            wpc_a=wpc_a,
+            wpc_b=wpc_b,
+            overlap=cls.round_weight(min_weights.sum()),
+            common_count=int(a_indices.size),
+            common_holdings=[
+                dict(
+                    holding_key=str(a.keys[a_indices[i]]), holding_name=a.names[a_indices[i]],
+                    weight_a=cls.round_weight(a_weights[i]), weight_b=cls.round_weight(b_weights[i])
+                )
+                for i in order.tolist()
+            ]
+        )
+
+    @classmethod
+    async def get_overlap(cls, db: AsyncSession, wpcs: List[str]) -> Dict[str, Any]:
+        wpcs = list(dict.fromkeys(wpcs))
+        if not cls.MIN_SCHEMES <= len(wpcs) <= cls.MAX_SCHEMES:
+            raise WealthyValidationError(
+                f"Select between {cls.MIN_SCHEMES} and {cls.MAX_SCHEMES} schemes", params=dict(wpcs=wpcs)
+            )
+        vectors = await SchemeHoldingVectors.get_vectors(db, wpcs)
+        missing = [wpc for wpc in wpcs if wpc not in vectors]
+        if missing:
+            raise WealthyValidationError("Holdings not available", params=dict(wpcs=missing))
+
+        pairs = [
+            cls.get_pair_overlap(wpc_a, vectors[wpc_a], wpc_b, vectors[wpc_b])
+            for wpc_a, wpc_b in combinations(wpcs, 2)
+        ]
+        common_keys = HoldingsEngine.common_keys([vectors[wpc] for wpc in wpcs])
+        common_holdings = []
+        for key in common_keys.tolist():
+            weights = {}
+            for wpc in wpcs:
+                index = int(np.searchsorted(vectors[wpc].keys, key))
+                weights[wpc] = cls.round_weight(vectors[wpc].weights[index])
+            holding_name = vectors[wpcs[0]].names[int(np.searchsorted(vectors[wpcs[0]].keys, key))]
+            common_holdings.append(dict(holding_key=key, holding_name=holding_name, weights=weights))
+        common_holdings.sort(key=lambda holding: -min(holding['weights'].values()))
+        return dict(
+            schemes=[
+                dict(wpc=wpc, portfolio_date=vectors[wpc].portfolio_date, holdings_count=int(vectors[wpc].keys.size))
+                for wpc in wpcs
+            ],
+            pairs=pairs,
+            common_holdings=common_holdings
+        )
@@ -0,0 +1,147 @@
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+
+
+class ReturnsEngine:
+    '''
+        Builds the units / invested value / current value series for lump-sum and SIP investments
+        as NumPy arrays in one shot. Values are kept at full precision while computing and are only
+        rounded when they are written back into the response rows (see serialize/attach_series).
+    '''
+
+    @staticmethod
+    def to_array(values: Sequence[Any]) -> np.ndarray:
+        return np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def onetime_series(cls, amount: float, adj_navs: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        adj_navs = cls.to_array(adj_navs)
+        units = np.full(adj_navs.shape, amount / adj_navs[0])
+        invested_value = np.full(adj_navs.shape, amount)
+        current_value = units * adj_navs
+        return units, invested_value, current_value
+
+    @classmethod
+    def sip_series(cls, amount: float, adj_navs: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        adj_navs = cls.to_array(adj_navs)
+        units = np.cumsum(amount / adj_navs)
+        invested_value = amount * np.arange(1, adj_navs.size + 1)
+        current_value = units * adj_navs
+        return units, invested_value, current_value
+
+    @staticmethod
+    def serialize(values: np.ndarray, decimal_places: int = 4) -> List[Any]:
+        if np.issubdtype(values.dtype, np.integer):
+            return values.tolist()
+        return np.round(values, decimal_places).tolist()
+
+    @classmethod
+    def attach_series(
+            cls, nav_data: List[Dict[str, Any]], units: np.ndarray, invested_value: np.ndarray, current_value: np.ndarray
+    ) -> List[Dict[str, Any]]:
+        rows = zip(nav_data, cls.serialize(units), cls.serialize(invested_value), cls.serialize(current_value, decimal_places=2))
+        for nd, u, iv, cv in rows:
+            nd['units'] = u
+            nd['invested_value'] = iv
+            nd['current_value'] = cv
+        return nav_data
+
+    @staticmethod
+    def segment_as_of_indices(
+            segment_ids: np.ndarray, days: np.ndarray, target_segment_ids: np.ndarray, target_days: np.ndarray
+    ) -> np.ndarray:
+        '''
+            As-of lookup for many series stored back to back. segment_ids/days must be sorted by (segment, day).
+            For every (target segment, target day) returns the index of the last row of that segment on or
+            before the target day, or -1 when the segment has no such row. One searchsorted for all targets.
+        '''
+        if not (segment_ids.size and target_segment_ids.size):
+            return np.full(target_segment_ids.shape, -1, dtype=np.int64)
+        base = min(days.min(), target_days.min())
+        span = int(max(days.max(), target_days.max()) - base) + 1
+        keys = segment_ids.astype(np.int64) * span + (days - base)
+        target_keys = target_segment_ids.astype(np.int64) * span + (target_days - base)
+        indices = np.searchsorted(keys, target_keys, side='right') - 1
+        found = indices >= 0
+        found[found] = segment_ids[indices[found]] == target_segment_ids[found]
+        return np.where(found, indices, -1)
+
+    @staticmethod
+    def absolute_returns(current: np.ndarray, base: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (current / base - 1) * 100
+
+    @staticmethod
+    def cagr(current: np.ndarray, base: np.ndarray, years: float) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.power(current / base, 1 / years) - 1) * 100
+
+    @staticmethod
+    def sip_day_indices(
+            nav_dates: np.ndarray, sip_day: int, today: np.datetime64, include_left_end_edge_case: bool = True,
+            include_right_end_edge_case: bool = True
+    ) -> np.ndarray:
+        '''
+            Indices of the SIP instalment NAVs among unique, ascending nav_dates (datetime64[D]): in every
+            month the first NAV on or after the sip_day, plus with the edge cases the first NAV of a month
+            that is on or after the sip_day, and the last NAV of a month that ends before its sip_day (when
+            that sip_day is before today). Same rules as lag/lead over a per-month window ordered by nav_date.
+        '''
+        nav_dates = np.asarray(nav_dates, dtype='datetime64[D]')
+        if not nav_dates.size:
+            return np.empty(0, dtype=np.int64)
+        months = nav_dates.astype('datetime64[M]')
+        month_starts = np.concatenate(([True], months[1:] != months[:-1]))
+        month_ends = np.concatenate((months[1:] != months[:-1], [True]))
+        lag_dates = np.where(month_starts, nav_dates, np.roll(nav_dates, 1))
+        lead_dates = np.where(month_ends, nav_dates, np.roll(nav_dates, -1))
+        required_dates = months.astype('datetime64[D]') + (sip_day - 1)
+        selected = (lag_dates < required_dates) & (required_dates <= nav_dates)
+        if include_left_end_edge_case:
+            selected |= (lag_dates == nav_dates) & (required_dates <= nav_dates)
+        if include_right_end_edge_case:
+            selected |= (nav_dates == lead_dates) & (required_dates > nav_dates) & (required_dates < today)
+        return np.flatnonzero(selected)
+
+    @staticmethod
+    def shift_years(dates: np.ndarray, years: int) -> np.ndarray:
+        '''
+            dates (datetime64[D]) moved back by calendar years like relativedelta(years=years), the day
+            being clamped to the end of the target month (29 Feb -> 28 Feb).
+        '''
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        months = dates.astype('datetime64[M]')
+        days_of_month = (dates - months.astype('datetime64[D]')).astype(np.int64)
+        target_months = months - 12 * years
+        month_lengths = ((target_months + 1).astype('datetime64[D]') - target_months.astype('datetime64[D]')).astype(np.int64)
+        return target_months.astype('datetime64[D]') + np.minimum(days_of_month, month_lengths - 1)
+
+    @classmethod
+    def rolling_cagr(cls, nav_dates: np.ndarray, values: np.ndarray, years: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+            CAGR of every window of years ending on a NAV date, against the last value on or before the same
+            date years back. Returns (end indices, cagr). Windows starting before the first NAV are skipped.
+            One searchsorted for all windows.
+        '''
+        nav_dates = np.asarray(nav_dates, dtype='datetime64[D]')
+        values = cls.to_array(values)
+        if not nav_dates.size:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        base_indices = np.searchsorted(nav_dates, cls.shift_years(nav_dates, years), side='right') - 1
+        end_indices = np.flatnonzero(base_indices >= 0)
+        return end_indices, cls.cagr(values[end_indices], values[base_indices[end_indices]], years)
+
+    @staticmethod
+    def distribution(values: np.ndarray, beat_percentage: float) -> Dict[str, Any]:
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return dict(count=0, min=None, max=None, median=None, mean=None, beat_percentage=None, negative_percentage=None)
+        return dict(
+            count=int(values.size),
+            min=round(float(values.min()), 2),
+            max=round(float(values.max()), 2),
+            median=round(float(np.median(values)), 2),
+            mean=round(float(values.mean()), 2),
+            beat_percentage=round(float((values > beat_percentage).mean() * 100), 2),
+            negative_percentage=round(float((values < 0).mean() * 100), 2),
+        )
@@ -0,0 +1,223 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.exceptions import WealthyValidationError
+from app.services.holding_vectors import SchemeHoldingVectors
+from app.services.holdings_engine import HoldingsEngine, HoldingVector
+
+logger = logging.getLogger("app")
+
+
+class ReverseHoldingsIndex:
+    '''
+        Per-worker inverted index of SchemeHoldingVectors: holding key (isin, holding_third_party_id when
+        there is none) -> {wpc: (holding_percentage, market_value)} postings, with the third party ids
+        as aliases of their key. sync() only moves the postings of the schemes whose vector changed since
+        the last sync, i.e. of the schemes with a new portfolio_date. The postings of a key are sorted into
+        arrays the first time they are read after a change, the cross-scheme aggregates are rebuilt once
+        per sync and fund_type.
+    '''
+    postings: Dict[str, Dict[str, Tuple[float, float]]] = {}
+    names: Dict[str, str] = {}
+    aliases: Dict[str, str] = {}
+    key_aliases: Dict[str, Set[str]] = {}
+    indexed_vectors: Dict[str, HoldingVector] = {}
+    fund_types: Dict[str, Optional[str]] = {}
+    sorted_postings: Dict[str, Dict[str, np.ndarray]] = {}
+    aggregates: Dict[Optional[str], Dict[str, np.ndarray]] = {}
+    synced_version: int = -1
+
+    @staticmethod
+    async def get_fund_types(db: AsyncSession, wpcs: List[str]) -> Dict[str, Optional[str]]:
+        query = "select wpc, fund_type from public.funnal_scheme where wpc = any(CAST(:wpcs AS varchar[]))"
+        result = await db.execute(text(query), dict(wpcs=wpcs))
+        return {r.wpc: r.fund_type for r in result.fetchall()}
+
+    @classmethod
+    def remove(cls, wpc: str):
+        vector = cls.indexed_vectors.pop(wpc, None)
+        if vector is None:
+            return
+        for key in vector.keys.tolist():
+            postings = cls.postings.get(key)
+            if postings is not None:
+                postings.pop(wpc, None)
+                if not postings:
+                    # no scheme holds the security any more, forget it entirely
+                    del cls.postings[key]
+                    cls.names.pop(key, None)
+                    for third_party_id in cls.key_aliases.pop(key, ()):
+                        if cls.aliases.get(third_party_id) == key:
+                            del cls.aliases[third_party_id]
+            cls.sorted_postings.pop(key, None)
+
+    @classmethod
+    def add(cls, wpc: str, vector: HoldingVector):
+        cls.indexed_vectors[wpc] = vector
+        weights, market_values = vector.weights.tolist(), vector.market_values.tolist()
+        for i, key in enumerate(vector.keys.tolist()):
+            cls.postings.setdefault(key, {})[wpc] = (weights[i], market_values[i])
+            cls.names.setdefault(key, vector.names[i])
+            if vector.third_party_ids[i]:
+                cls.aliases[vector.third_party_ids[i]] = key
+                cls.key_aliases.setdefault(key, set()).add(vector.third_party_ids[i])
+            cls.sorted_postings.pop(key, None)
+
+    @classmethod
+    async def sync(cls, db: AsyncSession) -> int:
+        '''
+            Brings the index in line with SchemeHoldingVectors, returns the number of schemes re-indexed.
+        '''
+        if cls.synced_version == SchemeHoldingVectors.version:
+            return 0
+        started_at = time.monotonic()
+        version = SchemeHoldingVectors.version
+        vectors = SchemeHoldingVectors.vectors
+        removed = [wpc for wpc in cls.indexed_vectors if wpc not in vectors]
+        # vectors are replaced, never mutated, on a portfolio change
+        changed = [wpc for wpc, vector in vectors.items() if cls.indexed_vectors.get(wpc) is not vector]
+        fund_types = await cls.get_fund_types(db, changed) if changed else {}
+        for wpc in removed + changed:
+            cls.remove(wpc)
+            cls.fund_types.pop(wpc, None)
+        for wpc in changed:
+            cls.add(wpc, vectors[wpc])
+            cls.fund_types[wpc] = fund_types.get(wpc)
+        cls.aggregates = {}
+        cls.synced_version = version
+        if removed or changed:
+            logger.info(
+                f"Reverse holdings index synced, {len(changed)} schemes indexed, {len(removed)} removed in "
+                f"{time.monotonic() - started_at:.2f}s"
+            )
+        return len(changed) + len(removed)
+
+    @classmethod
+    def resolve_key(cls, id_value: str) -> Optional[str]:
+        if id_value in cls.postings:
+            return id_value
+        return cls.aliases.get(id_value)
+
+    @classmethod
+    def get_sorted_postings(cls, key: str) -> Dict[str, np.ndarray]:
+        '''
+            Postings of key as arrays sorted by holding_percentage, largest first.
+        '''
+        if key not in cls.sorted_postings:
+            postings = cls.postings.get(key, {})
+            wpcs = np.asarray(list(postings), dtype=object)
+            values = np.asarray(list(postings.values()), dtype=np.float64).reshape(-1, 2)
+            order = np.argsort(-values[:, 0], kind='stable')
+            cls.sorted_postings[key] = dict(
+                wpcs=wpcs[order], weights=values[order, 0], market_values=values[order, 1]
+            )
+        return cls.sorted_postings[key]
+
+    @classmethod
+    def get_aggregates(cls, fund_type: Optional[str] = None) -> Dict[str, np.ndarray]:
+        if fund_type not in cls.aggregates:
+            vectors = [
+                vector for wpc, vector in cls.indexed_vectors.items()
+                if fund_type is None or cls.fund_types.get(wpc) == fund_type
+            ]
+            if vectors:
+                aggregates = HoldingsEngine.aggregate(
+                    np.concatenate([vector.keys for vector in vectors]),
+                    np.concatenate([vector.weights for vector in vectors]),
+                    np.concatenate([vector.market_values for vector in vectors]),
+                )
+            else:
+                aggregates = dict(
+                    keys=np.empty(0, dtype=str), counts=np.empty(0, dtype=np.int64), weights=np.empty(0),
+                    market_values=np.empty(0)
+                )
+            aggregates['schemes_count'] = len(vectors)
+            cls.aggregates[fund_type] = aggregates
+        return cls.aggregates[fund_type]
+
+
+class ReverseHoldingsService:
+    '''
+        Schemes holding a security and the most held securities, from ReverseHoldingsIndex. Weights are
+        holding_percentage of the scheme portfolio, market values are summed as reported in SchemeHolding.
+    '''
+    HOLDER_SORT_FIELDS = ('holding_percentage', 'market_value')
+    MOST_HELD_SORT_FIELDS = ('funds_count', 'market_value', 'average_holding_percentage')
+
+    @staticmethod
+    def round_value(value: float) -> float:
+        return round(float(value), 4)
+
+    @classmethod
+    async def get_index(cls, db: AsyncSession):
+        if not SchemeHoldingVectors.is_loaded():
+            await SchemeHoldingVectors.refresh(db)
+        await ReverseHoldingsIndex.sync(db)
+        return ReverseHoldingsIndex
+
+    @classmethod
+    async def get_holders(
+            cls, db: AsyncSession, id_value: str, sort_by: str = 'holding_percentage', fund_type: str = None,
+            limit: int = 100, offset: int = 0
+    ) -> Dict[str, Any]:
+        if sort_by not in cls.HOLDER_SORT_FIELDS:
+            raise WealthyValidationError("Invalid sort_by", params=dict(sort_by=sort_by))
+        index = await cls.get_index(db)
+        key = index.resolve_key(id_value)
+        if not key:
+            raise WealthyValidationError("No scheme holds this security", params=dict(id_value=id_value))
+        postings = index.get_sorted_postings(key)
+        wpcs, weights, market_values = postings['wpcs'], postings['weights'], postings['market_values']
+        if fund_type:
+            selected = np.asarray([index.fund_types.get(wpc) == fund_type for wpc in wpcs.tolist()], dtype=bool)
+            wpcs, weights, market_values = wpcs[selected], weights[selected], market_values[selected]
+        if sort_by == 'market_value':
+            order = np.argsort(-market_values, kind='stable')
+            wpcs, weights, market_values = wpcs[order], weights[order], market_values[order]
+        page = slice(offset, offset + limit)
+        return dict(
+            holding_key=key,
+            holding_name=index.names.get(key),
+            funds_count=int(wpcs.size),
+            total_market_value=cls.round_value(market_values.sum()),
+            holders=[
+                dict(
+                    wpc=wpc, holding_percentage=cls.round_value(weight), market_value=cls.round_value(market_value),
+                    portfolio_date=index.indexed_vectors[wpc].portfolio_date
+                )
+                for wpc, weight, market_value in zip(
+                    wpcs[page].tolist(), weights[page].tolist(), market_values[page].tolist()
+                )
+            ]
+        )
+
+    @classmethod
+    async def get_most_held(
+            cls, db: AsyncSession, fund_type: str = None, sort_by: str = 'funds_count', limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        if sort_by not in cls.MOST_HELD_SORT_FIELDS:
+            raise WealthyValidationError("Invalid sort_by", params=dict(sort_by=sort_by))
+        index = await cls.get_index(db)
+        aggregates = index.get_aggregates(fund_type)
+        counts, market_values = aggregates['counts'], aggregates['market_values']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average_weights = aggregates['weights'] / counts
+        sort_values = dict(
+            funds_count=counts, market_value=market_values, average_holding_percentage=average_weights
+        )[sort_by]
+        # ties broken by the number of schemes, then by market value
+        order = np.lexsort((-market_values, -counts, -sort_values))[:limit]
+        return [
+            dict(
+                holding_key=key,
+                holding_name=index.names.get(key),
+                funds_count=int(counts[i]),
+                funds_percentage=cls.round_value(counts[i] * 100 / aggregates['schemes_count']),
+                total_market_value=cls.round_value(market_values[i]),
+                average_holding_percentage=cls.round_value(average_weights[i]),
+            )
+            for i, key in zip(order.tolist(), aggregates['keys'][order].tolist())
+        ]
@@ -0,0 +1,97 @@
+from typing import Dict
+import numpy as np
+
+
+class RiskEngine:
+    '''
+        Risk statistics for many schemes at once from a (schemes x dates) matrix of NAVs aligned on a
+        common calendar of trading days, NaN where a scheme has no NAV yet (or any more). Daily simple
+        returns are taken between consecutive columns and every statistic is reduced along axis 1, so a
+        chunk of schemes costs a handful of array passes. The benchmark matrix has the same shape, a row
+        of NaN meaning no benchmark. Percent values are returned for volatility, drawdown and alpha.
+    '''
+    PERIODS_PER_YEAR = 252
+
+    @staticmethod
+    def daily_returns(values: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return values[:, 1:] / values[:, :-1] - 1
+
+    @staticmethod
+    def masked_mean(values: np.ndarray, mask: np.ndarray, count: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(mask, values, 0).sum(axis=1) / count
+
+    @classmethod
+    def drawdowns(cls, values: np.ndarray) -> Dict[str, np.ndarray]:
+        '''
+            Max drawdown of every row with the column indices of its peak (last close at that high), trough
+            and recovery (first close back at the peak), -1 where there is none.
+        '''
+        rows, columns = np.arange(values.shape[0]), np.arange(values.shape[1])
+        finite = np.isfinite(values)
+        peaks = np.fmax.accumulate(values, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = values / peaks - 1
+        troughs = np.where(finite, drawdown, np.inf).argmin(axis=1)
+        max_drawdown = np.where(finite.any(axis=1), drawdown[rows, troughs], np.nan)
+        has_drawdown = max_drawdown < 0
+        before_trough = finite & (columns <= troughs[:, None])
+        peak_values = np.where(before_trough, values, -np.inf).max(axis=1, initial=-np.inf)
+        at_peak = before_trough & (values == peak_values[:, None])
+        peak_indices = values.shape[1] - 1 - at_peak[:, ::-1].argmax(axis=1)
+        recovered = finite & (columns > troughs[:, None]) & (values >= peak_values[:, None])
+        recovery_indices = np.where(recovered.any(axis=1), recovered.argmax(axis=1), -1)
+        return dict(
+            max_drawdown=np.where(np.isfinite(max_drawdown), max_drawdown * 100, np.nan),
+            peak_index=np.where(has_drawdown, peak_indices, -1),
+            trough_index=np.where(has_drawdown, troughs, -1),
+            recovery_index=np.where(has_drawdown, recovery_indices, -1),
+        )
+
+    @classmethod
+    def compute(
+            cls, values: np.ndarray, benchmark_values: np.ndarray, risk_free_rate: float, min_observations: int = 2
+    ) -> Dict[str, np.ndarray]:
+        '''
+            risk_free_rate is an annual percentage. Rows with fewer than min_observations daily returns get NaN.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        benchmark_values = np.asarray(benchmark_values, dtype=np.float64)
+        ppy = cls.PERIODS_PER_YEAR
+        risk_free = risk_free_rate / 100 / ppy
+        returns = cls.daily_returns(values)
+        valid = np.isfinite(returns)
+        count = valid.sum(axis=1)
+        enough = count >= max(min_observations, 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = cls.masked_mean(returns, valid, count)
+            std = np.sqrt(np.where(valid, (returns - mean[:, None]) ** 2, 0).sum(axis=1) / (count - 1))
+            downside = np.sqrt(np.where(valid, np.minimum(returns - risk_free, 0) ** 2, 0).sum(axis=1) / count)
+            sharpe = (mean - risk_free) / std * np.sqrt(ppy)
+            sortino = (mean - risk_free) / downside * np.sqrt(ppy)
+
+            benchmark_returns = cls.daily_returns(benchmark_values)
+            paired = valid & np.isfinite(benchmark_returns)
+            paired_count = paired.sum(axis=1)
+            paired_mean = cls.masked_mean(returns, paired, paired_count)
+            benchmark_mean = cls.masked_mean(benchmark_returns, paired, paired_count)
+            covariance = np.where(
+                paired, (returns - paired_mean[:, None]) * (benchmark_returns - benchmark_mean[:, None]), 0
+            ).sum(axis=1)
+            benchmark_variance = np.where(paired, (benchmark_returns - benchmark_mean[:, None]) ** 2, 0).sum(axis=1)
+            beta = covariance / benchmark_variance
+            alpha = ((paired_mean - risk_free) - beta * (benchmark_mean - risk_free)) * ppy * 100
+        with_benchmark = paired_count >= max(min_observations, 2)
+
+        metrics = dict(
+            observations=count,
+            annualized_return=np.where(enough, mean * ppy * 100, np.nan),
+            volatility=np.where(enough, std * np.sqrt(ppy) * 100, np.nan),
+            sharpe=np.where(enough & np.isfinite(sharpe), sharpe, np.nan),
+            sortino=np.where(enough & np.isfinite(sortino), sortino, np.nan),
+            beta=np.where(with_benchmark & np.isfinite(beta), beta, np.nan),
+            alpha=np.where(with_benchmark & np.isfinite(alpha), alpha, np.nan),
+        )
+        metrics.update(cls.drawdowns(values))
+        return metrics
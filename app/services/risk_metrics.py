@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import sessionmanager
+from app.models.scheme import SchemeRiskMetrics
+from app.models.stock import Stock, StockBSEHistPriceData, StockNSEHistPriceData
+from app.services.modal_generic import ModalGenericService
+from app.services.nav_store_sync import NavStoreService
+from app.services.returns_engine import ReturnsEngine
+from app.services.risk_engine import RiskEngine
+from app.services.stock_returns import StockReturnsService
+from app.utils.constants import EPOCH
+
+logger = logging.getLogger("app")
+
+
+class SchemeRiskMetricsService:
+    '''
+        Nightly job filling SchemeRiskMetrics for every active scheme and period from the adj_nav history.
+        All NAVs are put on one calendar (the union of NAV dates in the period) with the last NAV carried
+        forward, chunks of CHUNK_SIZE schemes become (schemes x dates) matrices and RiskEngine runs on them
+        in a process pool, one chunk per core at a time.
+        The benchmark of a scheme is the close series of the Stock whose third_party_id is the scheme's
+        benchmark_tpid (NSE, BSE when there are no NSE prices). Schemes without one get no beta/alpha.
+    '''
+    PERIODS = (1, 3, 5)
+    CHUNK_SIZE = 500
+    # about six months of trading days
+    MIN_OBSERVATIONS = 120
+    COLUMNS = (
+        'wpc', 'period_years', 'as_on', 'benchmark_tpid', 'observations', 'annualized_return', 'volatility',
+        'sharpe', 'sortino', 'max_drawdown', 'max_drawdown_peak_date', 'max_drawdown_trough_date',
+        'max_drawdown_recovery_date', 'beta', 'alpha', 'computed_at'
+    )
+    METRIC_COLUMNS = ('annualized_return', 'volatility', 'sharpe', 'sortino', 'max_drawdown', 'beta', 'alpha')
+
+    @staticmethod
+    async def get_active_schemes(db: AsyncSession) -> Dict[str, str]:
+        query = "select wpc, benchmark_tpid from public.funnal_scheme where wpc is not null and deprecated_at is null"
+        result = await db.execute(text(query))
+        return {r.wpc: r.benchmark_tpid for r in result.fetchall()}
+
+    @staticmethod
+    async def query_nav_series(
+            db: AsyncSession, wpcs: List[str], since: date, until: date
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        query = text(
+            "select wpc, nav_date, adj_nav from public.funnal_schemehistnavdata "
+            "where nav_date >= :since and nav_date <= :until and wpc = any(CAST(:wpcs AS varchar[])) "
+            "order by wpc, nav_date"
+        ).execution_options(yield_per=StockReturnsService.CHUNK_SIZE)
+        codes, days, adj_navs = [], [], []
+        result = await db.stream(query, dict(since=since, until=until, wpcs=list(wpcs)))
+        async for rows in result.partitions():
+            chunk_codes, chunk_dates, chunk_adj_navs = zip(*rows)
+            codes.append(np.asarray(chunk_codes, dtype=object))
+            days.append(np.asarray(chunk_dates, dtype='datetime64[D]').astype(np.int64))
+            adj_navs.append(np.asarray(chunk_adj_navs, dtype=np.float64))
+        if not codes:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(codes), np.concatenate(days), np.concatenate(adj_navs)
+
+    @classmethod
+    async def load_nav_series(
+            cls, db: AsyncSession, wpcs: List[str], since: date, until: date
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (wpcs, days, adj_navs) of the NAVs from since to until, grouped by wpc and sorted by day within a
+            wpc, days being integer days since the epoch. The wpcs the NavStore does not cover are read from
+            Postgres.
+        '''
+        store = NavStoreService.get_store()
+        if not store:
+            return await cls.query_nav_series(db, wpcs, since, until)
+        uncovered = set(await NavStoreService.get_uncovered_wpcs(store, wpcs))
+        until_day = (until - EPOCH).days
+        codes, days, adj_navs = [], [], []
+        for wpc in sorted(set(wpcs) - uncovered):
+            wpc_days, _, wpc_adj_navs = store.get_series(wpc, since=since)
+            # the series is sorted, cut it at until
+            end = int(np.searchsorted(wpc_days, until_day, side='right'))
+            codes.append(np.full(end, wpc, dtype=object))
+            days.append(np.asarray(wpc_days[:end], dtype=np.int64))
+            adj_navs.append(np.asarray(wpc_adj_navs[:end]))
+        if uncovered:
+            logger.info(f"Reading NAVs of {len(uncovered)} schemes not covered by the NAV store from Postgres")
+            queried = await cls.query_nav_series(db, sorted(uncovered), since, until)
+            for arrays, values in zip((codes, days, adj_navs), queried):
+                arrays.append(values)
+        if not codes:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(codes), np.concatenate(days), np.concatenate(adj_navs)
+
+    @staticmethod
+    async def load_benchmark_series(
+            db: AsyncSession, benchmark_tpids: List[str], since: date
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (benchmark_tpids, days, closes) sorted by (benchmark_tpid, date).
+        '''
+        result = await db.execute(
+            select(Stock.wstockcode, Stock.third_party_id).where(Stock.third_party_id.in_(benchmark_tpids))
+        )
+        tpid_by_wstockcode = {r.wstockcode: r.third_party_id for r in result.fetchall()}
+        series = []
+        nse = await StockReturnsService.load_close_series(
+            db, StockNSEHistPriceData, since, wstockcodes=list(tpid_by_wstockcode)
+        )
+        bse = await StockReturnsService.load_close_series(
+            db, StockBSEHistPriceData, since, exclude_wstockcodes=set(nse[0].tolist()),
+            wstockcodes=list(tpid_by_wstockcode)
+        )
+        for codes, days, closes in (nse, bse):
+            tpids = np.asarray([tpid_by_wstockcode[c] for c in codes.tolist()], dtype=object)
+            series.append((tpids, days, closes))
+        tpids, days, closes = (np.concatenate(arrays) for arrays in zip(*series))
+        # several stocks may share a third party id, keep the first one of each
+        order = np.lexsort((days, tpids.astype(str)))
+        tpids, days, closes = tpids[order], days[order], closes[order]
+        keep = np.ones(tpids.size, dtype=bool)
+        keep[1:] = (tpids[1:] != tpids[:-1]) | (days[1:] != days[:-1])
+        return tpids[keep], days[keep], closes[keep]
+
+    @staticmethod
+    def segment(
+            codes: np.ndarray, days: np.ndarray, values: np.ndarray, keys: List[str]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (segment_ids, days, values) of the rows of keys sorted by (position of the key in keys, day), the
+            rows of other codes dropped. Done once per run, the rows of keys[start:end] are then the slice
+            of segment_ids between start and end.
+        '''
+        segment_of_key = {key: i for i, key in enumerate(keys)}
+        # codes come grouped, one lookup per run of equal codes instead of one per row
+        starts = np.empty(0, dtype=np.int64)
+        if codes.size:
+            starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+        run_ids = np.asarray([segment_of_key.get(c, -1) for c in codes[starts].tolist()], dtype=np.int64)
+        segment_ids = np.repeat(run_ids, np.diff(np.append(starts, codes.size)).astype(np.int64))
+        selected = segment_ids >= 0
+        segment_ids, days, values = segment_ids[selected], days[selected], values[selected]
+        order = np.lexsort((days, segment_ids))
+        return segment_ids[order], days[order], values[order]
+
+    @staticmethod
+    def align(
+            segment_ids: np.ndarray, days: np.ndarray, values: np.ndarray, count: int, grid: np.ndarray
+    ) -> np.ndarray:
+        '''
+            (count x len(grid)) matrix of the last value on or before every grid day of segments 0 to count - 1
+            (rows as returned by segment), NaN before the first value and after the last one of a segment.
+        '''
+        if not segment_ids.size:
+            return np.full((count, grid.size), np.nan)
+        target_segment_ids = np.repeat(np.arange(count), grid.size)
+        target_days = np.tile(grid, count)
+        indices = ReturnsEngine.segment_as_of_indices(segment_ids, days, target_segment_ids, target_days)
+        matrix = np.where(indices >= 0, values[indices], np.nan).reshape(count, grid.size)
+        last_days = np.full(count, np.iinfo(np.int64).min)
+        ends = np.concatenate((np.flatnonzero(segment_ids[1:] != segment_ids[:-1]), [segment_ids.size - 1]))
+        last_days[segment_ids[ends]] = days[ends]
+        matrix[grid[None, :] > last_days[:, None]] = np.nan
+        return matrix
+
+    @classmethod
+    def make_records(
+            cls, wpcs: List[str], period_years: int, as_on: date, benchmark_tpids: List[str], grid: np.ndarray,
+            metrics: Dict[str, np.ndarray], computed_at: datetime
+    ) -> List[tuple]:
+        def to_date(index):
+            return EPOCH + timedelta(days=int(grid[index])) if index >= 0 else None
+
+        def to_value(value):
+            return round(value, 4) if np.isfinite(value) else None
+
+        columns = {c: metrics[c].tolist() for c in cls.METRIC_COLUMNS}
+        records = []
+        for i, wpc in enumerate(wpcs):
+            records.append((
+                wpc, period_years, as_on, benchmark_tpids[i], int(metrics['observations'][i]),
+                *(to_value(columns[c][i]) for c in cls.METRIC_COLUMNS[:5]),
+                to_date(metrics['peak_index'][i]), to_date(metrics['trough_index'][i]),
+                to_date(metrics['recovery_index'][i]),
+                *(to_value(columns[c][i]) for c in cls.METRIC_COLUMNS[5:]),
+                computed_at
+            ))
+        return records
+
+    @classmethod
+    async def refresh_risk_metrics(cls, db: AsyncSession, as_on: date = None) -> int:
+        started_at = time.monotonic()
+        as_on = as_on or date.today()
+        since = as_on - relativedelta(years=max(cls.PERIODS), days=15)
+        benchmark_by_wpc = await cls.get_active_schemes(db)
+        wpcs = sorted(benchmark_by_wpc)
+        codes, days, adj_navs = await cls.load_nav_series(db, wpcs, since, until=as_on)
+        benchmark_tpids = sorted({tpid for tpid in benchmark_by_wpc.values() if tpid})
+        benchmark_codes, benchmark_days, benchmark_closes = await cls.load_benchmark_series(db, benchmark_tpids, since)
+        as_on_day = (as_on - EPOCH).days
+        until_as_on = benchmark_days <= as_on_day
+        benchmarks = cls.segment(
+            benchmark_codes[until_as_on], benchmark_days[until_as_on], benchmark_closes[until_as_on], benchmark_tpids
+        )
+        segment_ids, days, adj_navs = cls.segment(codes, days, adj_navs, wpcs)
+        loaded_at = time.monotonic()
+
+        # metrics are as on as_on, nothing after it may be used even when as_on is in the past
+        calendar = np.unique(days[days <= as_on_day])
+        computed_at = datetime.now()
+        loop = asyncio.get_running_loop()
+        records = []
+        with ProcessPoolExecutor(
+                max_workers=settings.RISK_METRICS_WORKERS, mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            for period_years in cls.PERIODS:
+                start_day = (as_on - relativedelta(years=period_years) - EPOCH).days
+                grid = calendar[calendar >= start_day]
+                benchmark_matrix = cls.align(*benchmarks, len(benchmark_tpids), grid)
+                benchmark_index = {tpid: i for i, tpid in enumerate(benchmark_tpids)}
+                chunks, futures = [], []
+                for start in range(0, len(wpcs), cls.CHUNK_SIZE):
+                    chunk = wpcs[start:start + cls.CHUNK_SIZE]
+                    lo, hi = np.searchsorted(segment_ids, [start, start + len(chunk)]).tolist()
+                    values = cls.align(segment_ids[lo:hi] - start, days[lo:hi], adj_navs[lo:hi], len(chunk), grid)
+                    rows = [benchmark_index.get(benchmark_by_wpc[wpc], -1) for wpc in chunk]
+                    benchmark_values = np.full(values.shape, np.nan)
+                    has_benchmark = np.asarray(rows) >= 0
+                    benchmark_values[has_benchmark] = benchmark_matrix[np.asarray(rows)[has_benchmark]]
+                    chunks.append(chunk)
+                    futures.append(loop.run_in_executor(
+                        executor, RiskEngine.compute, values, benchmark_values, settings.RISK_FREE_RATE,
+                        cls.MIN_OBSERVATIONS
+                    ))
+                for chunk, metrics in zip(chunks, await asyncio.gather(*futures)):
+                    records += cls.make_records(
+                        chunk, period_years, as_on, [benchmark_by_wpc[wpc] for wpc in chunk], grid, metrics, computed_at
+                    )
+        computed = time.monotonic()
+        count = await ModalGenericService.copy_upsert(
+            db, SchemeRiskMetrics.__tablename__, columns=cls.COLUMNS, records=records,
+            conflict_columns=('wpc', 'period_years')
+        )
+        await db.commit()
+        logger.info(
+            f"Risk metrics refreshed for {len(wpcs)} schemes ({count} rows) from {codes.size} NAVs. "
+            f"load {loaded_at - started_at:.1f}s, compute {computed - loaded_at:.1f}s, "
+            f"write {time.monotonic() - computed:.1f}s"
+        )
+        return count
+
+    @staticmethod
+    async def get_risk_metrics(db: AsyncSession, wpc: str) -> List[Any]:
+        result = await db.execute(
+            select(SchemeRiskMetrics).where(SchemeRiskMetrics.wpc == wpc).order_by(SchemeRiskMetrics.period_years)
+        )
+        return result.scalars().all()
+
+    @classmethod
+    async def run(cls) -> int:
+        async with sessionmanager.session() as db:
+            return await cls.refresh_risk_metrics(db)
+
+
+if __name__ == "__main__":
+    asyncio.run(SchemeRiskMetricsService.run())
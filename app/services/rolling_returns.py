@@ -0,0 +1,59 @@
+import logging
+from typing import Any, Dict
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.exceptions import WealthyValidationError
+from app.services.cache import CacheKeysService
+from app.services.nav_store_sync import NavStoreService
+from app.services.returns_engine import ReturnsEngine
+from app.services.service import HIST_NAVS_CACHE_TIMEOUT_AT
+from app.utils.cache import from_cache
+
+logger = logging.getLogger("app")
+
+
+class SchemeRollingReturnsService:
+    '''
+        Distribution of the rolling CAGRs of a scheme over its whole adj_nav history: one window per NAV
+        date for every period, each measured against the last NAV on or before the same date period years
+        back (see ReturnsEngine.rolling_cagr). Cached until the next NAV publication.
+    '''
+    PERIODS = (1, 3, 5)
+
+    @staticmethod
+    async def get_adj_nav_series(db: AsyncSession, wpc: str):
+        store = await NavStoreService.get_covering_store(wpc)
+        if store:
+            days, _, adj_navs = store.get_series(wpc)
+            return days.astype('datetime64[D]'), np.asarray(adj_navs)
+        query = "select nav_date, adj_nav from public.funnal_schemehistnavdata where wpc = :wpc order by nav_date;"
+        result = await db.execute(text(query), dict(wpc=wpc))
+        rows = result.fetchall()
+        return (
+            np.asarray([r.nav_date for r in rows], dtype='datetime64[D]'),
+            np.asarray([r.adj_nav for r in rows], dtype=np.float64)
+        )
+
+    @classmethod
+    @from_cache(
+        cache_func=CacheKeysService.get_scheme_rolling_returns_cache_key, timeout_at=HIST_NAVS_CACHE_TIMEOUT_AT,
+        version_func=CacheKeysService.get_hist_nav_version
+    )
+    async def get_rolling_returns(cls, db: AsyncSession, wpc: str, beat_percentage: float = 10) -> Dict[str, Any]:
+        nav_dates, adj_navs = await cls.get_adj_nav_series(db, wpc)
+        if not nav_dates.size:
+            raise WealthyValidationError("Data not available", params=dict(wpc=wpc))
+        periods = {}
+        for years in cls.PERIODS:
+            end_indices, cagr = ReturnsEngine.rolling_cagr(nav_dates, adj_navs, years)
+            distribution = ReturnsEngine.distribution(cagr, beat_percentage)
+            distribution.update(
+                start_date=str(nav_dates[end_indices[0]]) if end_indices.size else None,
+                latest=round(float(cagr[-1]), 2) if end_indices.size and np.isfinite(cagr[-1]) else None
+            )
+            periods[f"{years}y"] = distribution
+        return dict(
+            wpc=wpc, nav_date_from=str(nav_dates[0]), nav_date_to=str(nav_dates[-1]),
+            beat_percentage=beat_percentage, periods=periods
+        )
@@ -11,6 +11,7 @@ from sqlalchemy.future import select
 from app.services.cache import CacheKeysService
 from app.models.scheme import WSchemeCodeWPCMapping, ISINWPCMapping, SchemeCodeWPCMapping, TPSLSchemeCodeWPCMapping,WPCToTWPCMapping
 from app.cache.redis_cache import get_cache_value, set_cache_value
+from app.services.scheme_id_resolver import SchemeIDResolver
 class SchemeService:
     @staticmethod
     def get_scheme(db: Session, wschemecode: str) -> Optional[Scheme]:
@@ -296,6 +297,8 @@ class SchemeUniqueIDsCacheService:
 
     @staticmethod
     async def get_wpc_to_target_wpc_mapping(db: AsyncSession, refresh=False):
+        if not refresh and SchemeIDResolver.is_loaded():
+            return SchemeIDResolver.get_target_wpc_mapping()
         cache_key = CacheKeysService.get_wpc_to_twpc_mapping_cache_key()
         if not refresh:
             mapping = await get_cache_value(cache_key)
@@ -354,9 +357,15 @@ class SchemeUniqueIDsCacheService:
     async def get_tpsl_scheme_code_wpc_mapping_from_db(db: AsyncSession, tpsl_scheme_codes):
         if not tpsl_scheme_codes:
             return {}
+        mapping = defaultdict(list)
+        if SchemeIDResolver.is_loaded():
+            # codes created since the last refresh are not in memory yet, read only those from the db
+            mapping.update(SchemeIDResolver.get_mapping('tpsl_scheme_code', tpsl_scheme_codes))
+            tpsl_scheme_codes = [c for c in tpsl_scheme_codes if c not in mapping]
+            if not tpsl_scheme_codes:
+                return mapping
         result = await db.execute(select(TPSLSchemeCodeWPCMapping).filter(TPSLSchemeCodeWPCMapping.tpsl_scheme_code.in_(tpsl_scheme_codes), TPSLSchemeCodeWPCMapping.hidden == False).order_by(TPSLSchemeCodeWPCMapping.created_at))
         objs = result.scalars().all()
-        mapping = defaultdict(list)
         for o in objs:
             mapping[o.tpsl_scheme_code].append(o.wpc)
         return mapping
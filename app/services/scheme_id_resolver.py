@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models.scheme import (
+    WSchemeCodeWPCMapping, ISINWPCMapping, SchemeCodeWPCMapping, TPSLSchemeCodeWPCMapping, WPCToTWPCMapping
+)
+
+logger = logging.getLogger("app")
+
+
+class SchemeIDResolver:
+    '''
+        Per-worker in-memory copy of the non-hidden scheme id -> wpc mappings, ordered by created_at
+        (oldest wpc first) exactly like the *_mapping_from_db queries of SchemeUniqueIDsCacheService.
+        load() reads every mapping once at startup and refresh() only pulls rows created since the
+        last seen created_at. Rows that get hidden later are only dropped on the next load().
+    '''
+    # mapping name -> (Modal, id column)
+    SOURCES = {
+        'wschemecode': (WSchemeCodeWPCMapping, 'wschemecode'),
+        'isin': (ISINWPCMapping, 'isin'),
+        'scheme_code': (SchemeCodeWPCMapping, 'scheme_code'),
+        'tpsl_scheme_code': (TPSLSchemeCodeWPCMapping, 'tpsl_scheme_code'),
+    }
+
+    mappings: Dict[str, Dict[str, List[str]]] = {}
+    wpc_to_target_wpc: Dict[str, str] = {}
+    last_created_at: Dict[str, Optional[datetime]] = {}
+    loaded_at: Optional[datetime] = None
+
+    @classmethod
+    def is_loaded(cls) -> bool:
+        return cls.loaded_at is not None
+
+    @classmethod
+    async def load(cls, db: AsyncSession):
+        mappings, last_created_at = {}, {}
+        for name in cls.SOURCES:
+            mappings[name] = {}
+            last_created_at[name] = await cls.fetch_mapping_rows(db, name, mappings[name])
+        wpc_to_target_wpc = {}
+        last_created_at['wpc_to_target_wpc'] = await cls.fetch_target_wpc_rows(db, wpc_to_target_wpc)
+        # swap in one go so concurrent lookups never see a half built mapping
+        cls.mappings, cls.wpc_to_target_wpc, cls.last_created_at = mappings, wpc_to_target_wpc, last_created_at
+        cls.loaded_at = datetime.now()
+        counts = {name: len(mapping) for name, mapping in mappings.items()}
+        logger.info(f"Loaded scheme id mappings: {counts}")
+
+    @classmethod
+    async def refresh(cls, db: AsyncSession):
+        if not cls.is_loaded():
+            return await cls.load(db)
+        for name in cls.SOURCES:
+            created_at = await cls.fetch_mapping_rows(db, name, cls.mappings[name], cls.last_created_at.get(name))
+            cls.last_created_at[name] = created_at or cls.last_created_at.get(name)
+        created_at = await cls.fetch_target_wpc_rows(
+            db, cls.wpc_to_target_wpc, cls.last_created_at.get('wpc_to_target_wpc')
+        )
+        cls.last_created_at['wpc_to_target_wpc'] = created_at or cls.last_created_at.get('wpc_to_target_wpc')
+
+    @classmethod
+    async def run_refresh_loop(cls, session_factory, interval: int, reload_interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with session_factory() as db:
+                    if not cls.is_loaded() or (datetime.now() - cls.loaded_at).total_seconds() >= reload_interval:
+                        await cls.load(db)
+                    else:
+                        await cls.refresh(db)
+            except Exception as e:
+                logger.error(f"Failed to refresh scheme id mappings. {e}")
+
+    @classmethod
+    async def fetch_mapping_rows(
+            cls, db: AsyncSession, name: str, mapping: Dict[str, List[str]], created_at_gte: Optional[datetime] = None
+    ) -> Optional[datetime]:
+        Modal, id_col = cls.SOURCES[name]
+        id_column = getattr(Modal, id_col)
+        query = select(id_column, Modal.wpc, Modal.created_at).where(Modal.hidden.is_(False))
+        if created_at_gte:
+            # >= and not > so rows sharing the last created_at are not missed, duplicates are skipped below
+            query = query.where(Modal.created_at >= created_at_gte)
+        result = await db.execute(query.order_by(Modal.created_at))
+        last_created_at = None
+        for id_value, wpc, created_at in result.all():
+            wpcs = mapping.setdefault(sys.intern(id_value), [])
+            if wpc not in wpcs:
+                wpcs.append(sys.intern(wpc))
+            last_created_at = created_at
+        return last_created_at
+
+    @classmethod
+    async def fetch_target_wpc_rows(
+            cls, db: AsyncSession, mapping: Dict[str, str], created_at_gte: Optional[datetime] = None
+    ) -> Optional[datetime]:
+        query = select(WPCToTWPCMapping.wpc, WPCToTWPCMapping.target_wpc, WPCToTWPCMapping.created_at).where(
+            WPCToTWPCMapping.hidden.is_(False)
+        )
+        if created_at_gte:
+            query = query.where(WPCToTWPCMapping.created_at >= created_at_gte)
+        result = await db.execute(query.order_by(WPCToTWPCMapping.created_at))
+        last_created_at = None
+        for wpc, target_wpc, created_at in result.all():
+            mapping[sys.intern(wpc)] = sys.intern(target_wpc)
+            last_created_at = created_at
+        return last_created_at
+
+    @classmethod
+    def get_mapping(cls, name: str, id_values: List[Any]) -> Dict[str, List[str]]:
+        mapping = cls.mappings.get(name) or {}
+        return {v: mapping[v] for v in id_values if v in mapping}
+
+    @classmethod
+    def get_target_wpc(cls, wpc: str) -> Optional[str]:
+        return cls.wpc_to_target_wpc.get(wpc)
+
+    @classmethod
+    def get_target_wpc_mapping(cls) -> Dict[str, str]:
+        return dict(cls.wpc_to_target_wpc)
@@ -1,4 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime, time
+import pytz
+from itertools import groupby
+import numpy as np
 from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -6,7 +9,14 @@ from app.models.scheme import SchemeHistNavData, ISINWPCMapping ,Scheme,WSchemeC
 from app.schemas.scheme import SchemeHistNavDataSchema, ResolveResultSchema
 from sqlalchemy import and_
 from app.cache.redis_cache import get_cache_value, set_cache_value
+from app.core.config import settings
+from app.services.cache import CacheKeysService
+from app.utils.cache import (
+    from_cache, get_timeout_till, get_versioned_cache_key, serialize_cache_value, deserialize_cache_value
+)
 from app.utils.futils import get_float
+from app.services.returns_engine import ReturnsEngine
+from app.services.scheme_id_resolver import SchemeIDResolver
 from pyxirr import xirr
 from app.utils.constants import NavTypeChoices, WHistoricalNAVField
 from sqlalchemy import text
@@ -14,12 +24,17 @@ from dateutil.relativedelta import relativedelta
 from fastapi import Depends
 from app.db.base import get_db
 from app.exceptions import WealthyValidationError
-from app.utils.concurrent import execute_functions_concurrently
+from app.utils.concurrent import execute_coroutines_concurrently
+from app.services.modal_generic import ModalGenericService
+from app.services.nav_store import NavStore
+from app.services.nav_store_sync import NavStoreService
 import logging
 from sqlalchemy.exc import SQLAlchemyError
 from app.schemas.scheme import InvestmentTypeChoices
 logger = logging.getLogger("app")
 
+HIST_NAVS_CACHE_TIMEOUT_AT = time(hour=11, minute=0, second=0, tzinfo=pytz.timezone(settings.INDIAN_TZ))
+
 class ReturnsCalculator:
     def __init__(self, validated_data: Dict[str, Any]):
         self.wpc = validated_data['wpc']
@@ -44,8 +59,9 @@ class ReturnsCalculator:
             absolute_returns=None, absolute_returns_percentage=None, returns_details=None
         )
 
-    async def calculate_returns_for_onetime(self, db: AsyncSession) -> Dict[str, Any]:
-        returns_data = {
+    @staticmethod
+    def empty_returns_data() -> Dict[str, Any]:
+        return {
             'invested_value': None,
             'current_value': None,
             'xirr': None,
@@ -54,99 +70,130 @@ class ReturnsCalculator:
             'absolute_returns_percentage': None,
             'returns_details': []
         }
+
+    async def calculate_returns_for_onetime(self, db: AsyncSession) -> Dict[str, Any]:
         now = datetime.now().date()
         params = {'wpc': self.wpc, 'n_years': self.n_years, 'sip_day': min(now.day, 28)}
         nav_data = await SchemeHistNavService.get_hist_nav_data_for_n_years_with_sip_day(db, **params)
         if not nav_data:
-            return returns_data
+            return self.empty_returns_data()
+        current_nav_details = await SchemeHistNavService.get_as_on_hist_nav_data(db, wpc=self.wpc, as_on=now)
+        return self.build_onetime_returns(self.amount, nav_data, current_nav_details)
+
+    async def calculate_returns_for_sip(self, db: AsyncSession) -> Dict[str, Any]:
+        now = datetime.now().date()
+        params = {'wpc': self.wpc, 'n_years': self.n_years, 'sip_day': self.sip_day}
+        nav_data = await SchemeHistNavService.get_hist_nav_data_for_n_years_with_sip_day(db, **params)
         current_nav_details = await SchemeHistNavService.get_as_on_hist_nav_data(db, wpc=self.wpc, as_on=now)
-        n_years_back_nav_details = nav_data[0]
-        current_nav = current_nav_details['adj_nav'] or 0
-        if not current_nav_details or not n_years_back_nav_details:
+        return self.build_sip_returns(self.amount, nav_data, current_nav_details)
+
+    @classmethod
+    async def calculate_batch_returns(cls, data_list: List[Dict[str, Any]], db: AsyncSession) -> List[Dict[str, Any]]:
+        """
+        Computes returns for many (scheme, amount, period, sip_day, investment_type) requests using
+        one id resolution pass per id type and a single NAV history query for all wpcs.
+        """
+        from app.validator import RequestValidator
+        validated_list = await RequestValidator.returns_calculator_batch(data_list, db)
+        now = datetime.now().date()
+        start_dates = {}
+        for vd in validated_list:
+            if vd['error']:
+                continue
+            data = vd['data']
+            if data['investment_type'] == InvestmentTypeChoices.ONETIME:
+                data['sip_day'] = min(now.day, 28)
+            data['nav_date_gte'] = SchemeHistNavService.get_sip_day_start_date(
+                n_years=data['n_years'], sip_day=data['sip_day']
+            )
+            if not data['nav_date_gte']:
+                continue
+            wpc = data['wpc']
+            start_dates[wpc] = min(start_dates.get(wpc, data['nav_date_gte']), data['nav_date_gte'])
+
+        nav_rows = await SchemeHistNavService.get_hist_nav_rows_for_wpcs(db, start_dates=start_dates)
+        results = []
+        for req, vd in zip(data_list, validated_list):
+            result = dict(request=req, wpc=None, error=vd['error'], returns=cls.empty_returns_data())
+            results.append(result)
+            if vd['error']:
+                continue
+            data = vd['data']
+            result['wpc'] = data['wpc']
+            rows = nav_rows.get(data['wpc']) or []
+            nav_data = SchemeHistNavService.sample_sip_day_navs(
+                rows, sip_day=data['sip_day'], nav_date_gte=data['nav_date_gte'], today=now
+            )
+            current_row = next((r for r in reversed(rows) if r.nav_date <= now), None)
+            if not (nav_data and current_row):
+                continue
+            current_nav_details = dict(nav_date=current_row.nav_date, nav=current_row.nav, adj_nav=current_row.adj_nav)
+            if data['investment_type'] == InvestmentTypeChoices.ONETIME:
+                result['returns'] = cls.build_onetime_returns(data['amount'], nav_data, current_nav_details)
+            else:
+                result['returns'] = cls.build_sip_returns(data['amount'], nav_data, current_nav_details)
+        return results
+
+    @classmethod
+    def build_onetime_returns(
+            cls, amount: int, nav_data: List[Dict[str, Any]], current_nav_details: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        returns_data = cls.empty_returns_data()
+        if not (nav_data and current_nav_details):
             return returns_data
         current_nav = current_nav_details.get('adj_nav') or 0
-        if not current_nav:
-            return returns_data
-        n_years_back_nav = n_years_back_nav_details.get('adj_nav') or 0
-        if not n_years_back_nav:
+        n_years_back_nav = nav_data[0].get('adj_nav') or 0
+        if not (current_nav and n_years_back_nav):
             return returns_data
-        units = get_float(self.amount / n_years_back_nav)
-        for nd in nav_data:
-            nd['units'] = units
-            nd['invested_value'] = self.amount
-            nd['current_value'] = get_float(units * nd['adj_nav'], decimal_places=2)
         current_nav_date = str(current_nav_details['nav_date'])
-        dates = [n_years_back_nav_details['nav_date'], current_nav_date]
-        current_nav = get_float(current_nav)
         if nav_data[-1]['nav_date'] != current_nav_date:
-            current_nav_details['nav_date'] = current_nav_date
-            current_nav_details['nav'] = current_nav_details.get('nav') or 0
-            current_nav_details['nav'] = get_float(current_nav_details['nav'])
-            current_nav_details['adj_nav'] = current_nav
-            current_nav_details['units'] = units
-            current_nav_details['invested_value'] = self.amount
-            current_nav_details['current_value'] = get_float(units * current_nav, decimal_places=2)
-            nav_data.append(current_nav_details)
+            nav_data.append(dict(
+                nav_date=current_nav_date, nav=get_float(current_nav_details.get('nav') or 0),
+                adj_nav=get_float(current_nav)
+            ))
+        adj_navs = [nd['adj_nav'] for nd in nav_data]
+        units, invested_value, current_value = ReturnsEngine.onetime_series(amount, adj_navs)
+        ReturnsEngine.attach_series(nav_data, units, invested_value, current_value)
         current_value = nav_data[-1]['current_value']
-        cashflows = [-self.amount, current_value]
+        dates = [nav_data[0]['nav_date'], current_nav_date]
+        cashflows = [-amount, current_value]
         xirr_value = get_float(xirr(dates, cashflows), decimal_places=7)
-        diff = get_float(current_value - self.amount)
-        returns_data['invested_value'] = self.amount
+        diff = get_float(current_value - amount)
+        returns_data['invested_value'] = amount
         returns_data['current_value'] = current_value
         returns_data['xirr'] = xirr_value
         returns_data['xirr_percentage'] = get_float(xirr_value * 100)
-        returns_data['absolute_returns'] = get_float(diff / self.amount)
-        returns_data['absolute_returns_percentage'] = get_float((diff * 100) / self.amount)
+        returns_data['absolute_returns'] = get_float(diff / amount)
+        returns_data['absolute_returns_percentage'] = get_float((diff * 100) / amount)
         returns_data['returns_details'] = nav_data
         return returns_data
 
-    async def calculate_returns_for_sip(self, db: AsyncSession) -> Dict[str, Any]:
-        now = datetime.now().date()
-        returns_data = {
-            'invested_value': None,
-            'current_value': None,
-            'xirr': None,
-            'xirr_percentage': None,
-            'absolute_returns': None,
-            'absolute_returns_percentage': None,
-            'returns_details': []
-        }
-        params = {'wpc': self.wpc, 'n_years': self.n_years, 'sip_day': self.sip_day}
-        nav_data = await SchemeHistNavService.get_hist_nav_data_for_n_years_with_sip_day(db, **params)
-        current_nav_details = await SchemeHistNavService.get_as_on_hist_nav_data(db, wpc=self.wpc, as_on=now)
-        current_nav = current_nav_details.get('adj_nav') or 0
-        if not current_nav:
-            return returns_data
-        if not nav_data:
+    @classmethod
+    def build_sip_returns(
+            cls, amount: int, nav_data: List[Dict[str, Any]], current_nav_details: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        returns_data = cls.empty_returns_data()
+        current_nav = (current_nav_details or {}).get('adj_nav') or 0
+        if not (current_nav and nav_data):
             return returns_data
-        total_units = 0
-        dates = []
-        for i, nd in enumerate(nav_data):
-            units_purchased = self.amount / nd['adj_nav']
-            total_units = get_float(total_units + units_purchased)
-            nd['units'] = total_units   
-            nd['invested_value'] = self.amount * (i + 1)
-            nd['current_value'] = get_float(total_units * nd['adj_nav'], decimal_places=2)
-            dates.append(nd['nav_date'])
+        adj_navs = [nd['adj_nav'] for nd in nav_data]
+        units, invested_values, current_values = ReturnsEngine.sip_series(amount, adj_navs)
+        ReturnsEngine.attach_series(nav_data, units, invested_values, current_values)
+        total_units = float(units[-1])
         current_nav_date = str(current_nav_details['nav_date'])
-        dates.append(current_nav_date)
+        dates = [nd['nav_date'] for nd in nav_data] + [current_nav_date]
         current_nav = get_float(current_nav)
-        invested_dates_len = len(nav_data)
         invested_value = nav_data[-1]['invested_value']
         current_value = get_float(total_units * current_nav)
-        cashflows = [-self.amount] * invested_dates_len + [current_value]
+        cashflows = [-amount] * len(nav_data) + [current_value]
         xirr_value = get_float(xirr(dates, cashflows), decimal_places=7)
         if nav_data[-1]['nav_date'] != current_nav_date:
-            current_nav_details['nav_date'] = current_nav_date
-            current_nav_details['nav'] = current_nav_details.get('nav') or 0
-            current_nav_details['nav'] = get_float(current_nav_details['nav'])
-            current_nav_details['adj_nav'] = current_nav
-            current_nav_details['units'] = get_float(total_units)
-            current_nav_details['invested_value'] = invested_value
-            current_nav_details['current_value'] = current_value
-            nav_data.append(current_nav_details)
+            nav_data.append(dict(
+                nav_date=current_nav_date, nav=get_float(current_nav_details.get('nav') or 0),
+                adj_nav=current_nav, units=get_float(total_units), invested_value=invested_value,
+                current_value=current_value
+            ))
         diff = get_float(current_value - invested_value)
-        absolute_returns = get_float((diff * 100) / invested_value)
         absolute_returns_percentage = get_float((diff * 100) / invested_value)
         returns_data['invested_value'] = invested_value
         returns_data['current_value'] = current_value
@@ -158,12 +205,6 @@ class ReturnsCalculator:
         return returns_data
 
 
-
-
-
-    
-
-
 class SchemeHistNavService:
     Modal = SchemeHistNavData
     
@@ -183,12 +224,21 @@ class SchemeHistNavService:
             return None
 
     @classmethod
-   # @from_cache(cache_func=CacheKeysService.scheme_hist_nav_data_for_n_years_cache_key, timeout=3 * 60 * 60)
+    @from_cache(
+        cache_func=CacheKeysService.scheme_hist_nav_data_for_n_years_cache_key, timeout=3 * 60 * 60,
+        version_func=CacheKeysService.get_hist_nav_version
+    )
     async def get_hist_nav_data_for_n_years(cls, db: AsyncSession, wpc: str, years: int, step: int = 1, as_list: bool = False, nav_type: str = 'Nav') -> Any:
         nav_data = {}
         if not (wpc and years):
             return nav_data
         now = datetime.now().date()
+        store = await NavStoreService.get_covering_store(wpc)
+        if store:
+            dates, navs, adj_navs = store.get_series(wpc, since=now - relativedelta(years=years))
+            values = adj_navs if nav_type == NavTypeChoices.AdjNav else navs
+            nav_dates, values = NavStore.to_dates(dates[::step]), np.round(values[::step], 4).tolist()
+            return [list(nd) for nd in zip(nav_dates, values)] if as_list else dict(zip(nav_dates, values))
         vl = ['nav_date', 'nav']
         if nav_type == NavTypeChoices.AdjNav:
             vl = ['nav_date', 'adj_nav']
@@ -200,11 +250,39 @@ class SchemeHistNavService:
         return nav_data
 
 
+    @classmethod
+    async def get_hist_nav_rows_for_wpcs(cls, db: AsyncSession, start_dates: Dict[str, date]) -> Dict[str, List[Any]]:
+        """
+        Fetches the NAV history of many wpcs with a single query, each wpc from its own start date.
+        Returns {wpc: rows ordered by nav_date}.
+        """
+        nav_rows = {}
+        if not start_dates:
+            return nav_rows
+        query = text(
+            "SELECT h.wpc, h.nav_date, h.nav, h.adj_nav "
+            "FROM unnest(CAST(:wpcs AS varchar[]), CAST(:start_dates AS date[])) AS r(wpc, start_date) "
+            "JOIN funnal_schemehistnavdata h ON h.wpc = r.wpc AND h.nav_date >= r.start_date "
+            "ORDER BY h.wpc, h.nav_date"
+        )
+        params = dict(wpcs=list(start_dates.keys()), start_dates=list(start_dates.values()))
+        result = await db.execute(query, params)
+        for row in result.fetchall():
+            nav_rows.setdefault(row.wpc, []).append(row)
+        return nav_rows
+
     @classmethod
     async def get_as_on_hist_nav_data(cls, db: AsyncSession, wpc: str, as_on: datetime, approx: bool = True) -> Dict[str, Any]:
         nav_data = dict(nav_date=None, nav=None, adj_nav=None)
         if not (wpc and as_on):
             return nav_data
+        as_on_date = as_on.date() if isinstance(as_on, datetime) else as_on
+        store = await NavStoreService.get_covering_store(wpc)
+        if store:
+            as_on_nav = store.get_as_on(wpc, as_on_date, approx=approx)
+            if as_on_nav:
+                nav_data = dict(zip(('nav_date', 'nav', 'adj_nav'), as_on_nav))
+            return nav_data
         if not approx:
             query = select(cls.Modal).filter(cls.Modal.wpc == wpc, cls.Modal.nav_date == as_on).order_by(cls.Modal.nav_date.desc()).limit(1)
         else:
@@ -222,42 +300,45 @@ class SchemeHistNavService:
         return nav_data
 
     @classmethod
-   # @from_cache(cache_func=CacheKeysService.get_hist_nav_data_for_n_years_with_sip_day_cache_key, timeout=6 * 60 * 60)
+    @from_cache(
+        cache_func=CacheKeysService.get_hist_nav_data_for_n_years_with_sip_day_cache_key, timeout=6 * 60 * 60,
+        version_func=CacheKeysService.get_hist_nav_version
+    )
     async def get_hist_nav_data_for_n_years_with_sip_day(
             cls, db: AsyncSession, wpc: str, n_years: int, sip_day: int, include_left_end_edge_case: bool = True, include_right_end_edge_case: bool = True,
             nav_date_gte: Optional[datetime] = None, show_percentage_change: bool = False
     ) -> Optional[List[Dict[str, Any]]]:
         if not (wpc and n_years and sip_day):
             return 
-        raw_query = cls.get_raw_query_for_n_years_with_sip_day_hist_nav_data(
-            wpc=wpc, n_years=n_years, sip_day=sip_day,
+        nav_date_gte = cls.get_sip_day_start_date(n_years=n_years, sip_day=sip_day, nav_date_gte=nav_date_gte)
+        store = await NavStoreService.get_covering_store(wpc)
+        if store:
+            days, navs, adj_navs = store.get_series(wpc, since=nav_date_gte)
+            nav_dates = days.astype('datetime64[D]')
+        else:
+            result = await db.execute(text(cls.get_raw_query_for_hist_nav_series()), dict(wpc=wpc, nav_date_gte=nav_date_gte))
+            nav_objs = result.fetchall()
+            nav_dates = np.asarray([no.nav_date for no in nav_objs], dtype='datetime64[D]')
+            navs, adj_navs = [no.nav for no in nav_objs], [no.adj_nav for no in nav_objs]
+        indices = ReturnsEngine.sip_day_indices(
+            nav_dates, sip_day=sip_day, today=np.datetime64(datetime.now().date()),
             include_left_end_edge_case=include_left_end_edge_case,
-            include_right_end_edge_case=include_right_end_edge_case,
-            nav_date_gte=nav_date_gte
-        )
-        result = await db.execute(text(raw_query))
-        nav_objs = result.fetchall()
-        if not show_percentage_change:
-            return [
-                dict(nav_date=str(no.nav_date), nav=get_float(no.nav), adj_nav=get_float(no.adj_nav)) for no in nav_objs
-            ]
-        results, first_adj_nav = [], None
-        for no in nav_objs:
-            first_adj_nav = no.adj_nav if first_adj_nav is None else first_adj_nav
-            percentage_change = get_float(((no.adj_nav - first_adj_nav) * 100) / first_adj_nav, decimal_places=2)
-            results.append(dict(
-                nav_date=str(no.nav_date), nav=get_float(no.nav), adj_nav=get_float(no.adj_nav),
-                percentage_change=percentage_change
-            ))
+            include_right_end_edge_case=include_right_end_edge_case
+        ).tolist()
+        results = [
+            dict(nav_date=str(nav_dates[i]), nav=get_float(navs[i]), adj_nav=get_float(adj_navs[i])) for i in indices
+        ]
+        if show_percentage_change and indices:
+            first_adj_nav = adj_navs[indices[0]]
+            for nd, i in zip(results, indices):
+                nd['percentage_change'] = get_float(((adj_navs[i] - first_adj_nav) * 100) / first_adj_nav, decimal_places=2)
         return results
 
 
     @staticmethod
-    def get_raw_query_for_n_years_with_sip_day_hist_nav_data(
-            wpc: str, n_years: int, sip_day: int, include_left_end_edge_case: bool = True, include_right_end_edge_case: bool = True, nav_date_gte: Optional[datetime] = None
-    ) -> str:
+    def get_sip_day_start_date(n_years: int, sip_day: int, nav_date_gte: Optional[datetime] = None) -> Optional[date]:
         if not (n_years and sip_day):
-            return ""
+            return None
         if nav_date_gte:
             nav_date_gte = max(datetime.now().date() - relativedelta(years=n_years), nav_date_gte)
         else:
@@ -265,6 +346,47 @@ class SchemeHistNavService:
         if nav_date_gte.day > sip_day:
             nav_date_gte = nav_date_gte + relativedelta(months=1)
             nav_date_gte = nav_date_gte + relativedelta(day=1)
+        return nav_date_gte
+
+    @staticmethod
+    def sample_sip_day_navs(
+            nav_rows: List[Any], sip_day: int, nav_date_gte: date, include_left_end_edge_case: bool = True,
+            include_right_end_edge_case: bool = True, today: Optional[date] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        SIP instalment NAVs (see ReturnsEngine.sip_day_indices) among rows (ordered by nav_date) that were
+        already fetched for a single wpc.
+        """
+        if not (nav_rows and sip_day and nav_date_gte):
+            return []
+        today = today or datetime.now().date()
+        nav_rows = [r for r in nav_rows if r.nav_date >= nav_date_gte]
+        indices = ReturnsEngine.sip_day_indices(
+            np.asarray([r.nav_date for r in nav_rows], dtype='datetime64[D]'), sip_day=sip_day,
+            today=np.datetime64(today), include_left_end_edge_case=include_left_end_edge_case,
+            include_right_end_edge_case=include_right_end_edge_case
+        )
+        return [
+            dict(nav_date=str(nav_rows[i].nav_date), nav=get_float(nav_rows[i].nav), adj_nav=get_float(nav_rows[i].adj_nav))
+            for i in indices.tolist()
+        ]
+
+    @staticmethod
+    def get_raw_query_for_hist_nav_series() -> str:
+        return "select nav_date, nav, adj_nav from public.funnal_schemehistnavdata " \
+               "where wpc = :wpc and nav_date >= :nav_date_gte order by nav_date;"
+
+    @staticmethod
+    def get_raw_query_for_n_years_with_sip_day_hist_nav_data(
+            wpc: str, n_years: int, sip_day: int, include_left_end_edge_case: bool = True, include_right_end_edge_case: bool = True, nav_date_gte: Optional[datetime] = None
+    ) -> str:
+        """
+        SQL form of the SIP day selection, no longer used by get_hist_nav_data_for_n_years_with_sip_day
+        and kept as the reference ReturnsEngine.sip_day_indices is tested against.
+        """
+        nav_date_gte = SchemeHistNavService.get_sip_day_start_date(n_years=n_years, sip_day=sip_day, nav_date_gte=nav_date_gte)
+        if not nav_date_gte:
+            return ""
         query = f"SELECT id, wpc, nav, nav_date, adj_nav " \
                f"FROM (SELECT id, wpc, nav_date, nav, adj_nav, " \
                f"lag(nav_date, 1, nav_date) over w as lag_date, " \
@@ -280,21 +402,49 @@ class SchemeHistNavService:
         return query + ";"
 
     @staticmethod
-    def get_raw_query_for_multiple_ids_for_as_on_date(wpcs: List[str], as_on: datetime, gt: bool = False) -> str:
-        if not (wpcs and as_on):
-            raise ValueError("The list of WPCs and the as_on date cannot be empty.")
-        fields = ['wpc', 'nav_date', 'nav', 'adj_nav']
-        fields = ", ".join(fields)
-        wpcs_str = ", ".join(f"'{wpc}'" for wpc in wpcs)
+    def get_raw_query_for_multiple_ids_for_as_on_date(gt: bool = False) -> str:
+        """
+        Latest NAV on or before :as_on (first NAV after it when gt) for every wpc in the bound :wpcs array.
+        The lateral subquery is a single backward/forward scan of the (wpc, nav_date) unique index per wpc.
+        """
+        fields = ", ".join(['id', 'nav_date', 'nav', 'adj_nav'])
         modal = "funnal_schemehistnavdata"
-        range_filter_str = f"and nav_date <= '{str(as_on)}'"
+        range_filter_str = "nav_date <= :as_on"
         order_by = 'desc'
         if gt:
-            range_filter_str = f"and nav_date > '{str(as_on)}'"
+            range_filter_str = "nav_date > :as_on"
             order_by = 'asc'
-        return f"select id, {fields} from (select id, {fields}, " \
-               f"row_number() OVER w AS rn from public.{modal} where wpc in ({wpcs_str}) {range_filter_str} " \
-               f"window w AS (PARTITION BY wpc ORDER BY nav_date {order_by})) as t where rn = 1 order by wpc;"
+        return f"select w.wpc, h.id, h.nav_date, h.nav, h.adj_nav " \
+               f"from unnest(CAST(:wpcs AS varchar[])) as w(wpc) " \
+               f"join lateral (select {fields} from public.{modal} where wpc = w.wpc and {range_filter_str} " \
+               f"order by nav_date {order_by} limit 1) as h on true order by w.wpc;"
+
+    @classmethod
+    async def get_as_on_hist_nav_data_for_wpcs(
+            cls, db: AsyncSession, wpcs: List[str], as_on: date, gt: bool = False
+    ) -> List[Any]:
+        if not (wpcs and as_on):
+            return []
+        raw_query = cls.get_raw_query_for_multiple_ids_for_as_on_date(gt=gt)
+        result = await db.execute(text(raw_query), dict(wpcs=list(set(wpcs)), as_on=as_on))
+        return result.fetchall()
+
+    @classmethod
+    async def get_as_on_hist_nav_data_for_ids(
+            cls, db: AsyncSession, id_type: str, id_values: List[str], as_on: date, approx: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Bulk counterpart of get_as_on_hist_nav_data: resolves all ids with one lookup per id type and
+        fetches the NAVs of every resolved wpc in a single query. Results follow the order of id_values;
+        unresolved ids or ids without a NAV come back with null nav fields.
+        """
+        from app.validator import RequestValidator
+        mapping = await RequestValidator.validate_request_and_get_wpcs(id_type=id_type, id_values=id_values, db=db)
+        nav_data = await cls.get_as_on_hist_nav_data_for_wpcs(db, wpcs=list(mapping.values()), as_on=as_on)
+        return cls.process_hist_nav_data_for_multiple_ids(
+            req_keys=id_values, nav_data=nav_data, as_on=as_on, col=RequestValidator.normalize_id_type(id_type),
+            mapping=mapping, approx=approx
+        )
 
     @staticmethod
     def get_raw_query_for_max_starting_nav_date_for_wpcs(wpcs: List[str], start_date: Optional[datetime.date] = None) -> str:
@@ -341,7 +491,7 @@ class SchemeHistNavService:
                f"where rn = 1;"
 
     @classmethod
-   # @from_cache(cache_func=CacheKeysService.get_max_starting_nav_date_for_wpcs_cache_key, timeout=24 * 60 * 60)
+    @from_cache(cache_func=CacheKeysService.get_max_starting_nav_date_for_wpcs_cache_key, timeout=24 * 60 * 60)
     async def get_max_starting_nav_date_for_wpcs(
             cls, db: AsyncSession, wpcs: List[str], start_date: Optional[datetime.date] = None, ignore_missing_schemes: bool = False
     ) -> Optional[datetime.date]:
@@ -367,15 +517,16 @@ class SchemeHistNavService:
     @staticmethod
     def process_hist_nav_data_for_multiple_ids(req_keys, nav_data, as_on, col, mapping, approx=True):
         final_data = []
-        if not (req_keys and nav_data and as_on and col and mapping):
+        if not (req_keys and as_on and col):
             return final_data
-        nav_data_dict = {nd.wpc: nd for nd in nav_data}
+        nav_data_dict = {nd.wpc: nd for nd in nav_data or []}
+        mapping = mapping or {}
         for req_key in req_keys:
-            wpc = mapping[req_key]
-            base_nd = dict(id_type=col, id_value=req_key, nav_date=None, nav=None, adj_nav=None)
+            wpc = mapping.get(req_key)
+            base_nd = dict(id_type=col, id_value=req_key, wpc=wpc, nav_date=None, nav=None, adj_nav=None)
             nd = nav_data_dict.get(wpc)
             if nd and (approx or nd.nav_date == as_on):
-                base_nd.update(dict(nav_date=str(nd.nav_date), nav=nd.nav, adj_nav=nd.adj_nav))
+                base_nd.update(dict(nav_date=str(nd.nav_date), nav=get_float(nd.nav), adj_nav=get_float(nd.adj_nav)))
             final_data.append(base_nd)
         return final_data
 
@@ -389,29 +540,53 @@ class SchemeHistNavService:
             diff=data['diff'], percentage_change=data['percentage_change']
         )
 
+    @staticmethod
+    def get_raw_query_for_nfo_hist_nav_backfill(wpcs_filter: bool = True) -> str:
+        """
+        One row per calendar day from launch_date to close_date at nav_at_launch for every NFO selected,
+        generated server side. Either the :wpcs array or every NFO open on :as_on is selected.
+        """
+        modal = "funnal_schemehistnavdata"
+        if wpcs_filter:
+            scheme_filter_str = "s.wpc = any(CAST(:wpcs AS varchar[]))"
+        else:
+            scheme_filter_str = "s.launch_date <= :as_on and s.close_date >= :as_on and s.deprecated_at is null"
+        return f"INSERT INTO public.{modal} (wpc, nav_date, nav, adj_nav, diff, percentage_change) " \
+               f"SELECT s.wpc, gs.nav_date::date, s.nav_at_launch, s.nav_at_launch, 0, 0 " \
+               f"FROM public.funnal_scheme s CROSS JOIN LATERAL " \
+               f"generate_series(s.launch_date::date, s.close_date::date, interval '1 day') AS gs(nav_date) " \
+               f"WHERE {scheme_filter_str} and s.launch_date is not null and s.close_date is not null " \
+               f"and s.nav_at_launch is not null " \
+               f"ON CONFLICT (wpc, nav_date) DO NOTHING;"
+
     @classmethod
-    def populate_hist_nav_for_nfo(cls, scheme_obj):
-        if not scheme_obj:
-            return
-        temp_date = scheme_obj.launch_date
-        close_date = scheme_obj.close_date
-        if not (temp_date and close_date):
-            return
-        wpc = scheme_obj.wpc
-        nav = scheme_obj.nav_at_launch
-        hist_nav_objs = []
-        while temp_date <= close_date:
-            data = dict(nav=nav, adj_nav=nav, nav_date=temp_date, diff=0, percentage_change=0)
-            hist_nav_obj = cls.make_scheme_hnav_obj(wpc, data)
-            if hist_nav_obj:
-                hist_nav_objs.append(hist_nav_obj)
-            temp_date = temp_date + datetime.timedelta(days=1)
-        offset, limit = 0, 100
-        for offset in range(offset, len(hist_nav_objs), limit):
-            ModalGenericService.safe_bulk_create(Modal=SchemeHistNavData, objs=hist_nav_objs[offset: offset + limit])
+    async def populate_hist_nav_for_nfo(cls, db: AsyncSession, scheme_obj) -> int:
+        if not (scheme_obj and scheme_obj.launch_date and scheme_obj.close_date):
+            return 0
+        return await cls.populate_hist_nav_for_nfos(db, wpcs=[scheme_obj.wpc])
+
+    @classmethod
+    async def populate_hist_nav_for_nfos(
+            cls, db: AsyncSession, wpcs: Optional[List[str]] = None, as_on: Optional[date] = None
+    ) -> int:
+        """
+        Backfills the NFO NAVs of the given wpcs, or of every NFO open on as_on (today by default) when no
+        wpcs are given, with a single INSERT ... SELECT. Existing NAV rows are left untouched.
+        """
+        if wpcs is not None and not wpcs:
+            return 0
+        query = cls.get_raw_query_for_nfo_hist_nav_backfill(wpcs_filter=wpcs is not None)
+        params = dict(wpcs=list(wpcs)) if wpcs is not None else dict(as_on=as_on or datetime.now().date())
+        result = await db.execute(text(query), params)
+        await db.commit()
+        logger.info(f"Backfilled {result.rowcount} NFO NAV rows.")
+        return result.rowcount
 
     @classmethod
-   # @from_cache(cache_func=CacheKeysService.get_hist_navs_for_wpc_cache_key, timeout_at=datetime.time(hour=11, minute=0, second=0, tzinfo=pytz.timezone(settings.INDIAN_TZ)))
+    @from_cache(
+        cache_func=CacheKeysService.get_hist_navs_for_wpc_cache_key, timeout_at=HIST_NAVS_CACHE_TIMEOUT_AT,
+        version_func=CacheKeysService.get_hist_nav_version
+    )
     async def get_hist_navs_for_wpc(
             cls, db: AsyncSession, wpc: str, start_date: datetime.date = None, end_date: datetime.date = None, periodicity: str = 'd'
     ):
@@ -419,6 +594,10 @@ class SchemeHistNavService:
             return
         query = cls.get_raw_query_for_hist_navs(wpc=wpc, start_date=start_date, end_date=end_date, periodicity=periodicity)
         objs = await cls.execute_raw_query(db, query=query)
+        return cls.process_hist_navs(objs)
+
+    @staticmethod
+    def process_hist_navs(objs) -> Any:
         results = []
         first_adj_nav = None
         for o in objs:
@@ -427,9 +606,23 @@ class SchemeHistNavService:
             results.append([str(o.nav_date), str(o.nav), str(o.adj_nav), percentage_change])
         return results or "Data not available"
 
+    @staticmethod
+    def get_raw_query_for_hist_navs_for_wpcs(periodicity: str) -> str:
+        modal = "funnal_schemehistnavdata"
+        period = dict(d='day', w='week', m='month')
+        periodicity = period[periodicity]
+        return f"select wpc, nav_date, nav, adj_nav from (select wpc, nav_date, nav, adj_nav, " \
+               f"row_number() OVER w AS rn from public.{modal} where wpc = any(CAST(:wpcs AS varchar[])) " \
+               f"and nav_date >= :start_date and nav_date <= :end_date " \
+               f"window w AS (PARTITION BY wpc, date_trunc('{periodicity}', nav_date) ORDER BY nav_date desc)) as t " \
+               f"where rn = 1 order by wpc, nav_date;"
 
     @classmethod
     async def get_hist_navs_for_wpcs(cls, db: AsyncSession, wpcs: list, start_date: datetime.date):
+        """
+        Chart data of get_hist_navs_for_wpc for many wpcs. Cached wpcs are read from the cache concurrently
+        and all the misses are fetched with a single windowed query, then cached per wpc.
+        """
         if not (wpcs and start_date):
             return
         end_date = datetime.now().date()
@@ -437,51 +630,49 @@ class SchemeHistNavService:
         periodicity = 'd'
         if delta > 366:
             periodicity = 'w'
-        kl = []
-        for wpc in wpcs:
-            params_data = dict(wpc=wpc, start_date=start_date, end_date=end_date, periodicity=periodicity)
-            kl.append(dict(**params_data, cache_func_kwargs=params_data))
-        resp = await execute_functions_concurrently(
-            functions_list=[cls.get_hist_navs_for_wpc] * len(kl), kwargs_list=kl,
-            workers_count=len(kl), raise_exception=False
+        try:
+            versions = await CacheKeysService.get_hist_nav_versions(wpcs)
+        except Exception as e:
+            logger.error(f"Failed to read NAV versions. {e}")
+            versions = {}
+        cache_keys = [
+            get_versioned_cache_key(
+                CacheKeysService.get_hist_navs_for_wpc_cache_key(
+                    wpc=wpc, start_date=start_date, end_date=end_date, periodicity=periodicity
+                ), versions.get(wpc)
+            ) for wpc in wpcs
+        ]
+        cached_values = await execute_coroutines_concurrently(
+            functions_list=[CacheKeysService.get_cache_value] * len(cache_keys),
+            kwargs_list=[dict(key=key) for key in cache_keys],
+            workers_count=settings.CACHE_READ_CONCURRENCY, raise_exception=False
         )
-        results = {}
-        for r in resp:
-            results.update(r)
-        if not results:
-            raise WealthyValidationError("Invalid request")
-        final_result = {}
-        for i, wpc in enumerate(wpcs):
-            final_result[wpc] = results[i]
-        return final_result
-
-    
-    
-class ModalGenericService:
+        final_result, missing_wpcs = {}, []
+        for wpc, cached_value in zip(wpcs, cached_values):
+            if cached_value is None:
+                missing_wpcs.append(wpc)
+            else:
+                final_result[wpc] = deserialize_cache_value(cached_value)
+        cached_result = set(final_result)
 
-    @staticmethod
-    async def safe_bulk_create(db: AsyncSession, Modal, objs: list, batch_size=100) -> None:
-        if not (objs and isinstance(objs, list)):
-            return
-        if not isinstance(objs[0], Modal):
-            return
-        try:
-            for i in range(0, len(objs), batch_size):
-                batch = objs[i:i + batch_size]
-                db.add_all(batch)
-                await db.commit()
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to bulk create for model {Modal}. {e}")
-            for obj in objs:
+        if missing_wpcs:
+            query = cls.get_raw_query_for_hist_navs_for_wpcs(periodicity=periodicity)
+            result = await db.execute(
+                text(query), dict(wpcs=list(set(missing_wpcs)), start_date=start_date, end_date=end_date)
+            )
+            objs_by_wpc = {wpc: list(objs) for wpc, objs in groupby(result.fetchall(), key=lambda o: o.wpc)}
+            expire = get_timeout_till(HIST_NAVS_CACHE_TIMEOUT_AT)
+            for wpc in missing_wpcs:
+                final_result[wpc] = cls.process_hist_navs(objs_by_wpc.get(wpc) or [])
+            missing_cache_keys = {wpc: key for wpc, key in zip(wpcs, cache_keys) if wpc not in cached_result}
+            for wpc, key in missing_cache_keys.items():
                 try:
-                    db.add(obj)
-                    await db.commit()
-                except SQLAlchemyError as e:
-                    logger.error(f"Failed to save object {obj}. {e}")
-                    await db.rollback()
-                    
-
-
+                    await CacheKeysService.set_cache_value(key, serialize_cache_value(final_result[wpc]), expire)
+                except Exception as e:
+                    logger.error(f"Failed to set cache key {key}. {e}")
+        if not final_result:
+            raise WealthyValidationError("Invalid request")
+        return {wpc: final_result[wpc] for wpc in wpcs}
 
 class SchemeUniqueIDsCacheService:
     @staticmethod
@@ -604,6 +795,13 @@ class SchemeUniqueIDsCacheService:
     ) -> Dict[str, List[str]]:
         if not wschemecodes:
             return {}
+        mapping_dict: Dict[str, List[str]] = {}
+        if SchemeIDResolver.is_loaded():
+            # ids created since the last refresh are not in memory yet, read only those from the db
+            mapping_dict = SchemeIDResolver.get_mapping('wschemecode', wschemecodes)
+            wschemecodes = [v for v in wschemecodes if v not in mapping_dict]
+            if not wschemecodes:
+                return mapping_dict
 
         query = select(
             WSchemeCodeWPCMapping.wschemecode,
@@ -618,7 +816,6 @@ class SchemeUniqueIDsCacheService:
         result = await db.execute(query)
         mappings = result.fetchall()
 
-        mapping_dict : Dict[str, List[str]] = {}
         for row in mappings:
             wschemecode, wpc = row.wschemecode, row.wpc
             mapping_dict.setdefault(wschemecode, []).append(wpc)
@@ -633,6 +830,13 @@ class SchemeUniqueIDsCacheService:
     ) -> Dict[str, List[str]]:
         if not scheme_codes:
             return {}
+        mapping_dict: Dict[str, List[str]] = {}
+        if SchemeIDResolver.is_loaded():
+            # ids created since the last refresh are not in memory yet, read only those from the db
+            mapping_dict = SchemeIDResolver.get_mapping('scheme_code', scheme_codes)
+            scheme_codes = [v for v in scheme_codes if v not in mapping_dict]
+            if not scheme_codes:
+                return mapping_dict
 
         query = select(
             SchemeCodeWPCMapping.scheme_code,
@@ -647,7 +851,6 @@ class SchemeUniqueIDsCacheService:
         result = await db.execute(query)
         mappings = result.fetchall()
 
-        mapping_dict: Dict[str, List[str]] = {}
         for row in mappings:
             scheme_code, wpc = row.scheme_code, row.wpc
             mapping_dict.setdefault(scheme_code, []).append(wpc)
@@ -660,6 +863,15 @@ class SchemeUniqueIDsCacheService:
         isins: List[str], 
         db: AsyncSession
     ) -> Dict[str, List[str]]:
+        if not isins:
+            return {}
+        mapping_dict: Dict[str, List[str]] = {}
+        if SchemeIDResolver.is_loaded():
+            # ids created since the last refresh are not in memory yet, read only those from the db
+            mapping_dict = SchemeIDResolver.get_mapping('isin', isins)
+            isins = [v for v in isins if v not in mapping_dict]
+            if not isins:
+                return mapping_dict
         query = select(ISINWPCMapping.isin, ISINWPCMapping.wpc).where(
                         ISINWPCMapping.isin.in_(isins),
                         ISINWPCMapping.hidden == False
@@ -667,7 +879,6 @@ class SchemeUniqueIDsCacheService:
         result = await db.execute(query)
         mappings = result.fetchall()
         
-        mapping_dict: Dict[str, List[str]] = {}
         for row in mappings:
             isin, wpc = row.isin, row.wpc
             mapping_dict.setdefault(isin, []).append(wpc)
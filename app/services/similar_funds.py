@@ -0,0 +1,139 @@
+import logging
+import time
+from typing import Any, Dict, List, Set
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.exceptions import WealthyValidationError
+from app.services.holding_vectors import SchemeHoldingVectors
+from app.services.holdings_engine import HoldingsEngine, HoldingVector
+
+logger = logging.getLogger("app")
+
+
+class SimilarFundsIndex:
+    '''
+        Per-worker MinHash/LSH index over the holding sets of SchemeHoldingVectors. Every scheme gets a
+        NUM_PERMUTATIONS MinHash signature split into BANDS bands; schemes sharing the bucket of at least
+        one band are candidates (roughly the pairs above a Jaccard similarity of (1 / BANDS) ^ (1 / ROWS)),
+        which are then re-ranked by the exact weighted overlap. sync() only re-signs the schemes whose
+        vector changed since the last sync, so a new portfolio costs one signature and BANDS bucket moves.
+    '''
+    NUM_PERMUTATIONS = 128
+    BANDS = 32
+    ROWS = NUM_PERMUTATIONS // BANDS
+    SEED = 1729
+    CHUNK_SIZE = 500
+
+    permutations = HoldingsEngine.make_permutations(NUM_PERMUTATIONS, SEED)
+    signatures: Dict[str, np.ndarray] = {}
+    indexed_vectors: Dict[str, HoldingVector] = {}
+    buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(BANDS)]
+    synced_version: int = -1
+
+    @classmethod
+    def get_signatures(cls, vectors: List[HoldingVector]) -> np.ndarray:
+        signatures = []
+        for start in range(0, len(vectors), cls.CHUNK_SIZE):
+            chunk = vectors[start:start + cls.CHUNK_SIZE]
+            # most securities are held by many schemes, hash each one once
+            keys, inverse = np.unique(np.concatenate([vector.keys for vector in chunk]), return_inverse=True)
+            hashes = HoldingsEngine.hash_keys(keys.tolist())[inverse]
+            offsets = np.concatenate(([0], np.cumsum([vector.keys.size for vector in chunk])))
+            signatures.append(HoldingsEngine.minhash_signatures(hashes, offsets, cls.permutations))
+        if not signatures:
+            return np.empty((0, cls.NUM_PERMUTATIONS), dtype=np.uint32)
+        return np.concatenate(signatures)
+
+    @classmethod
+    def remove(cls, wpc: str):
+        signature = cls.signatures.pop(wpc, None)
+        cls.indexed_vectors.pop(wpc, None)
+        if signature is None:
+            return
+        for band, key in enumerate(HoldingsEngine.band_keys(signature, cls.BANDS)):
+            bucket = cls.buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(wpc)
+                if not bucket:
+                    del cls.buckets[band][key]
+
+    @classmethod
+    def add(cls, wpc: str, vector: HoldingVector, signature: np.ndarray):
+        cls.signatures[wpc] = signature
+        cls.indexed_vectors[wpc] = vector
+        for band, key in enumerate(HoldingsEngine.band_keys(signature, cls.BANDS)):
+            cls.buckets[band].setdefault(key, set()).add(wpc)
+
+    @classmethod
+    def sync(cls) -> int:
+        '''
+            Brings the index in line with SchemeHoldingVectors, returns the number of schemes re-indexed.
+        '''
+        if cls.synced_version == SchemeHoldingVectors.version:
+            return 0
+        started_at = time.monotonic()
+        vectors = SchemeHoldingVectors.vectors
+        removed = [wpc for wpc in cls.indexed_vectors if wpc not in vectors]
+        # vectors are replaced, never mutated, on a portfolio change
+        changed = [
+            wpc for wpc, vector in vectors.items() if vector.keys.size and cls.indexed_vectors.get(wpc) is not vector
+        ]
+        for wpc in removed + changed:
+            cls.remove(wpc)
+        for wpc, signature in zip(changed, cls.get_signatures([vectors[wpc] for wpc in changed])):
+            cls.add(wpc, vectors[wpc], signature)
+        cls.synced_version = SchemeHoldingVectors.version
+        if removed or changed:
+            logger.info(
+                f"Similar funds index synced, {len(changed)} schemes indexed, {len(removed)} removed in "
+                f"{time.monotonic() - started_at:.2f}s"
+            )
+        return len(changed) + len(removed)
+
+    @classmethod
+    def get_candidates(cls, wpc: str) -> Set[str]:
+        candidates = set()
+        for band, key in enumerate(HoldingsEngine.band_keys(cls.signatures[wpc], cls.BANDS)):
+            candidates |= cls.buckets[band].get(key, set())
+        candidates.discard(wpc)
+        return candidates
+
+
+class SimilarFundsService:
+    '''
+        Top k schemes whose latest portfolio overlaps most with the one of wpc, among the LSH candidates
+        of SimilarFundsIndex. estimated_jaccard is the share of equal MinHash rows of the two signatures.
+    '''
+
+    @staticmethod
+    def round_weight(value: float) -> float:
+        return round(float(value), 4)
+
+    @classmethod
+    async def get_similar_funds(cls, db: AsyncSession, wpc: str, k: int = 10) -> Dict[str, Any]:
+        if not SchemeHoldingVectors.is_loaded():
+            await SchemeHoldingVectors.refresh(db)
+        await SchemeHoldingVectors.get_vectors(db, [wpc])
+        SimilarFundsIndex.sync()
+        if wpc not in SimilarFundsIndex.signatures:
+            raise WealthyValidationError("Holdings not available", params=dict(wpc=wpc))
+
+        vector = SimilarFundsIndex.indexed_vectors[wpc]
+        signature = SimilarFundsIndex.signatures[wpc]
+        similar = []
+        for candidate in SimilarFundsIndex.get_candidates(wpc):
+            candidate_vector = SimilarFundsIndex.indexed_vectors[candidate]
+            a_indices, b_indices = HoldingsEngine.intersect(vector, candidate_vector)
+            overlap = np.minimum(vector.weights[a_indices], candidate_vector.weights[b_indices]).sum()
+            similar.append(dict(
+                wpc=candidate,
+                overlap=cls.round_weight(overlap),
+                common_count=int(a_indices.size),
+                estimated_jaccard=cls.round_weight(np.mean(SimilarFundsIndex.signatures[candidate] == signature)),
+                portfolio_date=candidate_vector.portfolio_date,
+            ))
+        candidates_count = len(similar)
+        similar.sort(key=lambda s: (-s['overlap'], -s['common_count'], s['wpc']))
+        return dict(
+            wpc=wpc, portfolio_date=vector.portfolio_date, candidates_count=candidates_count, similar=similar[:k]
+        )
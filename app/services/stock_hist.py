@@ -1,11 +1,16 @@
+import csv
+import io
+import json
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, text
 from datetime import date, datetime
+from typing import AsyncIterator, List, Optional
 import pytz
 from decimal import Decimal
+from app.db.base import sessionmanager
+from app.exceptions import WealthyValidationError
 from app.models.stock import Stock, StockBSEHistPriceData, StockNSEHistPriceData
-from app.schemas.stock import StockHistPriceDataBase
 from app.core.config import settings
 from app.utils.constants import ExchangeChoices, WHistoricalStockPricesField
 from app.utils.constants import WCompanyMasterField
@@ -49,42 +54,68 @@ class StockHistPriceService:
         where rn = 1;
         """
 
-    @staticmethod
+    CANDLE_RESOLUTIONS = dict(d='day', w='week', m='month', q='quarter', y='year')
+
+    @classmethod
     def get_raw_query_for_chart_hprice(
-            exchange: str, wstockcode: str, start_time: date = None, end_time: date = None,
-            periodicity: str = 'd'
+            cls, exchange: str, start_time: date = None, end_time: date = None, periodicity: str = 'd'
     ):
-        period = dict(d='day', w='week', m='month')
-        periodicity = period[periodicity]
-        modal = "stock_nse_hist_price_data" if exchange == ExchangeChoices.NSE else "stock_bse_hist_price_data"
+        '''
+            One OHLCV candle per date_trunc(periodicity) bucket, stamped with the first trading date of the bucket.
+            open/close are the first/last values by price_date, picked inside the group instead of through a
+            full-frame window plus DISTINCT. Binds :wstockcode and, when given, :start_date/:end_date.
+        '''
+        periodicity = cls.CANDLE_RESOLUTIONS[periodicity]
+        modal = "funnal_stocknsehistpricedata" if exchange == ExchangeChoices.NSE else "funnal_stockbsehistpricedata"
         range_filter_str = ''
         if start_time:
-            range_filter_str += f" and price_date >= '{start_time}'"
+            range_filter_str += " and price_date >= :start_date"
         if end_time:
-            range_filter_str += f" and price_date <= '{end_time}'"
+            range_filter_str += " and price_date <= :end_date"
         return f"""
-        SELECT distinct
-            1 AS id,
-            FIRST_VALUE(price_date) OVER w AS price_date,
-            FIRST_VALUE(open) OVER w AS open,
-            MAX(high) OVER w AS high,
-            MIN(low) OVER w AS low,
-            LAST_VALUE(close) OVER w AS close,
-            SUM(volume) OVER w AS volume,
-            SUM(value) OVER w AS value
+        SELECT
+            min(price_date) AS price_date,
+            (array_agg(open ORDER BY price_date))[1] AS open,
+            max(high) AS high,
+            min(low) AS low,
+            (array_agg(close ORDER BY price_date desc))[1] AS close,
+            sum(volume) AS volume,
+            sum(value) AS value
         FROM
-            {modal}
+            public.{modal}
         WHERE
             wstockcode = :wstockcode {range_filter_str}
-            WINDOW w AS (
-                PARTITION BY DATE_TRUNC(:periodicity, price_date)
-                ORDER BY price_date
-                RANGE BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
-            )
+        GROUP BY
+            date_trunc('{periodicity}', price_date)
         ORDER BY
             price_date
         """
 
+    @classmethod
+    async def get_candles_for_wstockcode(
+            cls, db: AsyncSession, exchange: str, wstockcode: str, start_date: date = None, end_date: date = None,
+            resolution: str = 'd'
+    ) -> dict:
+        if exchange not in [e.value for e in ExchangeChoices]:
+            raise WealthyValidationError("Invalid exchange")
+        if resolution not in cls.CANDLE_RESOLUTIONS:
+            raise WealthyValidationError(f"Invalid resolution, expected one of {', '.join(cls.CANDLE_RESOLUTIONS)}")
+        query = cls.get_raw_query_for_chart_hprice(
+            exchange=exchange, start_time=start_date, end_time=end_date, periodicity=resolution
+        )
+        result = await db.execute(
+            text(query), dict(wstockcode=wstockcode, start_date=start_date, end_date=end_date)
+        )
+        candles = dict(wstockcode=wstockcode, exchange=exchange, resolution=resolution, t=[], o=[], h=[], l=[], c=[], v=[])
+        for row in result.fetchall():
+            candles['t'].append(str(row.price_date))
+            candles['o'].append(float(row.open))
+            candles['h'].append(float(row.high))
+            candles['l'].append(float(row.low))
+            candles['c'].append(float(row.close))
+            candles['v'].append(float(row.volume))
+        return candles
+
     @classmethod
     async def get_hist_prices_for_wstockcode(
             cls, db: AsyncSession, exchange: str, wstockcode: str, start_date: date = None, end_date: date = None,
@@ -103,60 +134,244 @@ class StockHistPriceService:
         ) or "Data not available"
 
  
+    HIST_PRICE_STREAM_FIELDS = (
+        'price_date', 'open', 'high', 'low', 'close', 'volume', 'value', 'diff', 'percentage_change'
+    )
+    HIST_PRICE_STREAM_FORMATS = ('ndjson', 'csv')
+
+    @classmethod
+    def clean_hist_price_stream_params(cls, output_format: str, fields: Optional[str]) -> List[str]:
+        if output_format not in cls.HIST_PRICE_STREAM_FORMATS:
+            raise WealthyValidationError(f"Invalid format, expected one of {', '.join(cls.HIST_PRICE_STREAM_FORMATS)}")
+        if not fields:
+            return list(cls.HIST_PRICE_STREAM_FIELDS)
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        invalid_fields = [f for f in fields if f not in cls.HIST_PRICE_STREAM_FIELDS]
+        if invalid_fields:
+            raise WealthyValidationError(f"Invalid fields: {', '.join(invalid_fields)}")
+        if 'price_date' not in fields:
+            fields.insert(0, 'price_date')
+        return fields
+
     @staticmethod
-    async def resync_historical_prices(db: AsyncSession, wstockcode: str, price_data: list, exchange: str):
-        price_data = sorted(price_data, key=lambda x: x[WHistoricalStockPricesField.Date])
-        price_dates = set([hp[WHistoricalStockPricesField.Date] for hp in price_data])
+    def format_hist_price_rows(rows, fields: List[str], output_format: str) -> str:
+        if output_format == 'csv':
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator='\n').writerows(
+                [[str(v) if v is not None else '' for v in row] for row in rows]
+            )
+            return buffer.getvalue()
+        lines = []
+        for row in rows:
+            data = {
+                f: (str(v) if isinstance(v, date) else float(v) if isinstance(v, Decimal) else v)
+                for f, v in zip(fields, row)
+            }
+            lines.append(json.dumps(data, separators=(',', ':')))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    async def stream_hist_prices(
+            cls, exchange: str, wstockcode: str, fields: List[str], start_date: date = None, end_date: date = None,
+            output_format: str = 'ndjson', chunk_size: int = 2000
+    ) -> AsyncIterator[str]:
+        '''
+            Yields the price history of a stock as NDJSON or CSV chunks of chunk_size rows, read through a
+            server side cursor so memory stays flat whatever the length of the history.
+            It opens its own session since the request scoped one is closed before a streamed body is sent.
+        '''
         Modal = StockBSEHistPriceData if exchange == ExchangeChoices.BSE else StockNSEHistPriceData
-        
-        query = select(Modal).filter(Modal.wstockcode == wstockcode)
-        result = await db.execute(query)
-        existing_prices = result.scalars().all()
-        price_objs = {str(o.price_date): o for o in existing_prices}
-        
-        to_create_prices = price_dates.difference(price_objs.keys())
-        objs_to_create, rows_to_update = [], []
-        fields_to_update = [
-            WHistoricalStockPricesField.Open, WHistoricalStockPricesField.Close, WHistoricalStockPricesField.High,
-            WHistoricalStockPricesField.Low, WHistoricalStockPricesField.Value
-        ]
-
-        for i, hp in enumerate(price_data):
-            diff, percentage_change = 0, 0
-            prev_close = price_data[i-1][WHistoricalStockPricesField.Close] if i > 0 else None
+        query = select(*[getattr(Modal, f) for f in fields]).where(Modal.wstockcode == wstockcode)
+        if start_date:
+            query = query.where(Modal.price_date >= start_date)
+        if end_date:
+            query = query.where(Modal.price_date <= end_date)
+        query = query.order_by(Modal.price_date).execution_options(yield_per=chunk_size)
+
+        if output_format == 'csv':
+            yield ','.join(fields) + '\n'
+        async with sessionmanager.session() as db:
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                yield cls.format_hist_price_rows(rows, fields, output_format)
+
+    HIST_PRICE_COLUMNS = (
+        'wstockcode', 'price_date', 'open', 'close', 'low', 'high', 'volume', 'value', 'diff', 'percentage_change'
+    )
+
+    @staticmethod
+    def make_hist_price_records(wstockcode: str, price_data: list) -> List[tuple]:
+        '''
+            Rows of HIST_PRICE_COLUMNS for the incoming prices of a stock, one per date (the last one wins),
+            with diff/percentage_change taken against the previous incoming close.
+        '''
+        prices_by_date = {}
+        for hp in price_data:
+            price_date = hp[WHistoricalStockPricesField.Date]
+            if isinstance(price_date, str):
+                price_date = date.fromisoformat(price_date[:10])
+            prices_by_date[price_date] = hp
+        records, prev_close = [], None
+        for price_date in sorted(prices_by_date):
+            hp = prices_by_date[price_date]
+            close = get_decimal(hp[WHistoricalStockPricesField.Close])
+            diff, percentage_change = Decimal(0), Decimal(0)
             if prev_close:
-                diff = get_decimal(hp[WHistoricalStockPricesField.Close] - prev_close)
+                diff = get_decimal(close - prev_close)
                 percentage_change = get_decimal((diff * 100) / prev_close)
-            hp['diff'] = diff
-            hp['percentage_change'] = percentage_change
-            price_date = hp[WHistoricalStockPricesField.Date]
-            
-            if price_date in to_create_prices:
-                obj = StockHistPriceDataBase(
-                    wstockcode=wstockcode,
-                    price_date=price_date,
-                    open=hp[WHistoricalStockPricesField.Open],
-                    close=hp[WHistoricalStockPricesField.Close],
-                    low=hp[WHistoricalStockPricesField.Low],
-                    high=hp[WHistoricalStockPricesField.High],
-                    volume=hp[WHistoricalStockPricesField.Volume],
-                    value=hp[WHistoricalStockPricesField.Value],
-                    diff=diff,
-                    percentage_change=percentage_change
-                )
-                objs_to_create.append(obj)
-            else:
-                data = {f: hp[f] for f in fields_to_update}
-                data['diff'] = diff
-                data['percentage_change'] = percentage_change
-                data['price_date'] = price_date
-                rows_to_update.append(data)
-
-        await ModalGenericService.safe_bulk_create(db, Modal, objs_to_create)
-        await ModalGenericService.optimized_update(
-            db, Modal, {'price_date': 'price_date'}, ['price_date'], rows_to_update, 
-            and_(Modal.wstockcode == wstockcode)
+            records.append((
+                wstockcode, price_date, get_decimal(hp[WHistoricalStockPricesField.Open]), close,
+                get_decimal(hp[WHistoricalStockPricesField.Low]), get_decimal(hp[WHistoricalStockPricesField.High]),
+                get_decimal(hp[WHistoricalStockPricesField.Volume]), get_decimal(hp[WHistoricalStockPricesField.Value]),
+                diff, percentage_change
+            ))
+            prev_close = close
+        return records
+
+    @staticmethod
+    def get_changed_hist_price_records(records: List[tuple], stored_rows: List[tuple]) -> List[tuple]:
+        '''
+            Keeps only the incoming records (HIST_PRICE_COLUMNS tuples of one stock, sorted by date) that are new
+            or whose values differ from stored_rows (the stored rows of the same columns from the row before
+            the first incoming date on, sorted by date). diff/percentage_change are recomputed over the merged
+            series from the first changed date onward, so a stored row right after a changed close is rewritten
+            too when its diff moves.
+        '''
+        if not records:
+            return []
+        # compare at the precision incoming values are written with
+        def key(row):
+            return tuple(get_decimal(v) for v in row[2:8])
+
+        stored = {row[1]: row for row in stored_rows}
+        incoming = {row[1]: row for row in records}
+        changed_dates = [d for d, row in incoming.items() if d not in stored or key(row) != key(stored[d])]
+        if not changed_dates:
+            return []
+        first_changed = min(changed_dates)
+        merged = dict(stored)
+        merged.update(incoming)
+        changed, prev_close = [], None
+        for price_date in sorted(merged):
+            row = merged[price_date]
+            if price_date < first_changed:
+                prev_close = row[3]
+                continue
+            close = get_decimal(row[3])
+            diff, percentage_change = Decimal(0), Decimal(0)
+            if prev_close:
+                diff = get_decimal(close - prev_close)
+                percentage_change = get_decimal((diff * 100) / prev_close)
+            new_row = (*row[:8], diff, percentage_change)
+            stored_row = stored.get(price_date)
+            if (
+                stored_row is None or key(new_row) != key(stored_row)
+                or (get_decimal(stored_row[8]), get_decimal(stored_row[9])) != (diff, percentage_change)
+            ):
+                changed.append(new_row)
+            prev_close = close
+        return changed
+
+    @classmethod
+    async def get_stored_hist_price_rows(
+            cls, db: AsyncSession, exchange: str, start_dates: dict
+    ) -> dict:
+        '''
+            {wstockcode: stored HIST_PRICE_COLUMNS rows} from the last row before each stock's start date on,
+            for all stocks in one query.
+        '''
+        Modal = StockBSEHistPriceData if exchange == ExchangeChoices.BSE else StockNSEHistPriceData
+        table = Modal.__tablename__
+        columns_str = ", ".join(f"h.{c}" for c in cls.HIST_PRICE_COLUMNS)
+        query = text(
+            f"SELECT {columns_str} FROM unnest(CAST(:wstockcodes AS varchar[]), CAST(:start_dates AS date[])) "
+            f"AS w(wstockcode, start_date) JOIN public.{table} h ON h.wstockcode = w.wstockcode AND h.price_date >= "
+            f"COALESCE((SELECT max(p.price_date) FROM public.{table} p WHERE p.wstockcode = w.wstockcode "
+            f"AND p.price_date < w.start_date), w.start_date) ORDER BY h.wstockcode, h.price_date"
+        )
+        result = await db.execute(
+            query, dict(wstockcodes=list(start_dates.keys()), start_dates=list(start_dates.values()))
         )
+        stored_rows = {}
+        for row in result.fetchall():
+            stored_rows.setdefault(row[0], []).append(tuple(row))
+        return stored_rows
+
+    @classmethod
+    async def get_incremental_hist_price_records(
+            cls, db: AsyncSession, records_by_wstockcode: dict, exchange: str
+    ) -> tuple:
+        '''
+            Narrows the incoming records of every stock to the ones that have to be written, starting from the
+            stock's nse/bse_hist_lcp_date. Also returns the new hist lcp date of every stock.
+        '''
+        lcp_date_column = Stock.bse_hist_lcp_date if exchange == ExchangeChoices.BSE else Stock.nse_hist_lcp_date
+        result = await db.execute(
+            select(Stock.wstockcode, lcp_date_column).where(Stock.wstockcode.in_(list(records_by_wstockcode)))
+        )
+        lcp_dates = dict(result.fetchall())
+        start_dates = {}
+        for wstockcode, records in records_by_wstockcode.items():
+            if not records:
+                continue
+            lcp_date, first_date = lcp_dates.get(wstockcode), records[0][1]
+            start_dates[wstockcode] = lcp_date if lcp_date and lcp_date > first_date else first_date
+        stored_rows = await cls.get_stored_hist_price_rows(db, exchange, start_dates)
+
+        changed_records, new_lcp_dates = {}, {}
+        for wstockcode, start_date in start_dates.items():
+            records = [r for r in records_by_wstockcode[wstockcode] if r[1] >= start_date]
+            changed_records[wstockcode] = cls.get_changed_hist_price_records(records, stored_rows.get(wstockcode) or [])
+            last_date = records[-1][1] if records else None
+            lcp_date = lcp_dates.get(wstockcode)
+            if last_date and (not lcp_date or last_date > lcp_date):
+                new_lcp_dates[wstockcode] = last_date
+        return changed_records, new_lcp_dates
+
+    @classmethod
+    async def resync_historical_prices(
+            cls, db: AsyncSession, wstockcode: str, price_data: list, exchange: str, incremental: bool = False
+    ):
+        return await cls.resync_historical_prices_bulk(db, {wstockcode: price_data}, exchange, incremental=incremental)
+
+    @classmethod
+    async def resync_historical_prices_bulk(
+            cls, db: AsyncSession, price_data_by_wstockcode: dict, exchange: str, incremental: bool = False
+    ) -> int:
+        '''
+            Upserts the prices of many stocks at once: rows are COPYed into a staging table and merged with
+            one INSERT ... ON CONFLICT (wstockcode, price_date) DO UPDATE, all in a single transaction.
+            With incremental, only the rows from the stock's hist lcp date on that are new or changed are
+            written (see get_changed_hist_price_records) and the hist lcp date is moved forward.
+        '''
+        Modal = StockBSEHistPriceData if exchange == ExchangeChoices.BSE else StockNSEHistPriceData
+        records_by_wstockcode = {
+            wstockcode: cls.make_hist_price_records(wstockcode, price_data)
+            for wstockcode, price_data in price_data_by_wstockcode.items()
+        }
+        try:
+            new_lcp_dates = {}
+            if incremental:
+                records_by_wstockcode, new_lcp_dates = await cls.get_incremental_hist_price_records(
+                    db, records_by_wstockcode, exchange
+                )
+            count = await ModalGenericService.copy_upsert(
+                db, Modal.__tablename__, columns=cls.HIST_PRICE_COLUMNS,
+                records=(record for records in records_by_wstockcode.values() for record in records),
+                conflict_columns=('wstockcode', 'price_date')
+            )
+            if new_lcp_dates:
+                lcp_date_column = 'bse_hist_lcp_date' if exchange == ExchangeChoices.BSE else 'nse_hist_lcp_date'
+                await ModalGenericService.bulk_update_from_arrays(
+                    db, table=Stock.__tablename__, key_column='wstockcode',
+                    data={'wstockcode': list(new_lcp_dates), lcp_date_column: list(new_lcp_dates.values())},
+                    column_types={'wstockcode': 'varchar', lcp_date_column: 'date'}, commit=False
+                )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return count
 
     @classmethod
     async def get_max_starting_price_date_for_wstockcodes(
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.base import sessionmanager
+from app.models.stock import Stock, StockBSEHistPriceData, StockNSEHistPriceData
+from app.services.cache import CacheKeysService
+from app.services.indicator_engine import IndicatorEngine
+from app.services.modal_generic import ModalGenericService
+from app.services.stock_returns import StockReturnsService
+from app.utils.cache import serialize_cache_value, deserialize_cache_value
+from app.utils.concurrent import execute_coroutines_concurrently
+from app.utils.constants import EPOCH, ExchangeChoices
+
+logger = logging.getLogger("app")
+
+
+class StockIndicatorService:
+    '''
+        Fills the rsi/macd/ema/sma/std columns of Stock with IndicatorEngine (default windows). The carry-over
+        state of every stock is kept in redis, so the daily run only reads the closes after the last processed
+        date. Stocks without a state (new listings, evicted keys, full=True) are rebuilt from WARMUP of history.
+        NSE closes are used and BSE only for stocks without NSE prices.
+    '''
+    WARMUP = relativedelta(years=2)
+    INDICATOR_COLUMNS = ('rsi', 'macd', 'ema', 'sma', 'std')
+    CACHE_CONCURRENCY = 50
+
+    @staticmethod
+    def iter_segments(
+            codes: np.ndarray, days: np.ndarray, closes: np.ndarray
+    ) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        if not codes.size:
+            return
+        boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [codes.size]))):
+            yield codes[start], days[start:end], closes[start:end]
+
+    @classmethod
+    async def load_states(cls, wstockcodes: List[str]) -> Dict[str, Dict[str, Any]]:
+        cache_keys = [CacheKeysService.get_stock_indicator_state_cache_key(wstockcode) for wstockcode in wstockcodes]
+        values = await execute_coroutines_concurrently(
+            functions_list=[CacheKeysService.get_cache_value] * len(cache_keys),
+            kwargs_list=[dict(key=key) for key in cache_keys], workers_count=cls.CACHE_CONCURRENCY
+        )
+        return {
+            wstockcode: deserialize_cache_value(value) for wstockcode, value in zip(wstockcodes, values) if value
+        }
+
+    @classmethod
+    async def save_states(cls, states: Dict[str, Dict[str, Any]]):
+        await execute_coroutines_concurrently(
+            functions_list=[CacheKeysService.set_cache_value] * len(states),
+            kwargs_list=[
+                dict(key=CacheKeysService.get_stock_indicator_state_cache_key(wstockcode), value=serialize_cache_value(state))
+                for wstockcode, state in states.items()
+            ],
+            workers_count=cls.CACHE_CONCURRENCY
+        )
+
+    @classmethod
+    async def refresh_stock_indicators(cls, db: AsyncSession, full: bool = False) -> int:
+        started_at = time.monotonic()
+        result = await db.execute(select(Stock.wstockcode))
+        wstockcodes = result.scalars().all()
+        states = {} if full else await cls.load_states(wstockcodes)
+        new_states = {}
+
+        # incremental pass: only the closes after the oldest processed date are read
+        if states:
+            since = min(date.fromisoformat(s['last_date']) for s in states.values()) + timedelta(days=1)
+            for exchange, Modal in ((ExchangeChoices.NSE, StockNSEHistPriceData), (ExchangeChoices.BSE, StockBSEHistPriceData)):
+                exchange_codes = [w for w, s in states.items() if s['exchange'] == exchange.value]
+                if not exchange_codes:
+                    continue
+                series = await StockReturnsService.load_close_series(db, Modal, since, wstockcodes=exchange_codes)
+                for wstockcode, days, closes in cls.iter_segments(*series):
+                    state = states[wstockcode]
+                    last_day = (date.fromisoformat(state['last_date']) - EPOCH).days
+                    new_rows = days > last_day
+                    if not new_rows.any():
+                        continue
+                    new_states[wstockcode] = dict(
+                        IndicatorEngine.extend_state(state, closes[new_rows]),
+                        last_date=str(EPOCH + timedelta(days=int(days[-1]))), exchange=exchange.value
+                    )
+
+        # rebuild pass for stocks without a state
+        missing_codes = [w for w in wstockcodes if w not in states]
+        since = date.today() - cls.WARMUP
+        for exchange, Modal in ((ExchangeChoices.NSE, StockNSEHistPriceData), (ExchangeChoices.BSE, StockBSEHistPriceData)):
+            if not missing_codes:
+                break
+            series = await StockReturnsService.load_close_series(db, Modal, since, wstockcodes=missing_codes)
+            for wstockcode, days, closes in cls.iter_segments(*series):
+                state = IndicatorEngine.initial_state(closes)
+                if state:
+                    new_states[wstockcode] = dict(
+                        state, last_date=str(EPOCH + timedelta(days=int(days[-1]))), exchange=exchange.value
+                    )
+            missing_codes = [w for w in missing_codes if w not in new_states]
+
+        computed_at = time.monotonic()
+        data = dict(wstockcode=list(new_states), **{c: [] for c in cls.INDICATOR_COLUMNS})
+        for state in new_states.values():
+            values = IndicatorEngine.latest_values(state)
+            for column in cls.INDICATOR_COLUMNS:
+                value = values[column]
+                data[column].append(round(value, 3) if np.isfinite(value) else 0)
+        column_types = dict(wstockcode='varchar', **{c: 'float8' for c in cls.INDICATOR_COLUMNS})
+        updated = await ModalGenericService.bulk_update_from_arrays(
+            db, table='funnal_stock', key_column='wstockcode', data=data, column_types=column_types
+        )
+        await cls.save_states(new_states)
+        logger.info(
+            f"Stock indicators refreshed for {updated} stocks ({len(states)} incremental). "
+            f"compute {computed_at - started_at:.1f}s, save {time.monotonic() - computed_at:.1f}s"
+        )
+        return updated
+
+    @classmethod
+    async def get_indicator_series(
+            cls, db: AsyncSession, exchange: str, wstockcode: str, start_date: Optional[date] = None,
+            end_date: Optional[date] = None, params: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Any]:
+        '''
+            Indicator series of one stock with the given windows. Enough history before start_date is read
+            for the recursive indicators to settle, and only the [start_date, end_date] part is returned.
+        '''
+        params = IndicatorEngine.get_params(params)
+        start_date = start_date or date.today() - relativedelta(years=1)
+        # ~10 calendar days per bar of the longest window is several times that window in trading days
+        warmup_start = start_date - timedelta(days=max(params.values()) * 10)
+        Modal = StockBSEHistPriceData if exchange == ExchangeChoices.BSE else StockNSEHistPriceData
+        query = select(Modal.price_date, Modal.close).where(
+            Modal.wstockcode == wstockcode, Modal.price_date >= warmup_start
+        )
+        if end_date:
+            query = query.where(Modal.price_date <= end_date)
+        result = await db.execute(query.order_by(Modal.price_date))
+        rows = result.fetchall()
+        price_dates = [r.price_date for r in rows]
+        closes = np.asarray([r.close for r in rows], dtype=np.float64)
+        series = IndicatorEngine.compute_series(closes, params)
+        visible = np.asarray([d >= start_date for d in price_dates], dtype=bool)
+
+        def to_list(values: np.ndarray) -> List[Optional[float]]:
+            return [None if np.isnan(v) else v for v in np.round(values[visible], 4).tolist()]
+
+        data = dict(
+            wstockcode=wstockcode, exchange=exchange, params=params,
+            t=[str(d) for d, v in zip(price_dates, visible) if v], close=to_list(closes)
+        )
+        data.update({key: to_list(values) for key, values in series.items()})
+        return data
+
+    @classmethod
+    async def run(cls, full: bool = False) -> int:
+        async with sessionmanager.session() as db:
+            return await cls.refresh_stock_indicators(db, full=full)
+
+
+if __name__ == "__main__":
+    asyncio.run(StockIndicatorService.run())
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.base import sessionmanager
+from app.models.stock import StockBSEHistPriceData, StockNSEHistPriceData
+from app.services.modal_generic import ModalGenericService
+from app.services.returns_engine import ReturnsEngine
+from app.utils.constants import EPOCH
+
+logger = logging.getLogger("app")
+
+
+class StockReturnsService:
+    '''
+        Nightly job filling the returns_* columns of Stock from the close price history. NSE closes are used
+        and BSE only for stocks without NSE prices. Every return is measured from the stock's latest price
+        date, against the last close on or before the same date one period back. Returns are in percent and
+        stocks without enough history get 0, the column default.
+    '''
+    RETURN_PERIODS = dict(
+        returns_one_week=relativedelta(weeks=1),
+        returns_one_month=relativedelta(months=1),
+        returns_three_months=relativedelta(months=3),
+        returns_six_months=relativedelta(months=6),
+        returns_one_year=relativedelta(years=1),
+        returns_two_years=relativedelta(years=2),
+        returns_three_years=relativedelta(years=3),
+        returns_five_years=relativedelta(years=5),
+    )
+    CAGR_PERIODS = dict(
+        returns_two_years_cagr=2,
+        returns_three_years_cagr=3,
+        returns_five_years_cagr=5,
+    )
+    # a little more than the longest period so the as-of lookup can fall back to an earlier trading day
+    LOOKBACK = relativedelta(years=5, days=15)
+    CHUNK_SIZE = 50000
+
+    @classmethod
+    def get_return_columns(cls) -> List[str]:
+        return ['returns_ytd', *cls.RETURN_PERIODS, *cls.CAGR_PERIODS]
+
+    @classmethod
+    async def load_close_series(
+            cls, db: AsyncSession, Modal, since: date, exclude_wstockcodes: set = None, wstockcodes: List[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            One ordered scan of the price table, streamed in chunks into (wstockcodes, days, closes) arrays
+            sorted by (wstockcode, price_date). days are integer days since the epoch.
+        '''
+        query = select(Modal.wstockcode, Modal.price_date, Modal.close).where(Modal.price_date >= since)
+        if wstockcodes is not None:
+            query = query.where(Modal.wstockcode.in_(wstockcodes))
+        query = query.order_by(Modal.wstockcode, Modal.price_date).execution_options(yield_per=cls.CHUNK_SIZE)
+        codes, days, closes = [], [], []
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            if exclude_wstockcodes:
+                rows = [r for r in rows if r[0] not in exclude_wstockcodes]
+            if not rows:
+                continue
+            chunk_codes, chunk_dates, chunk_closes = zip(*rows)
+            codes.append(np.asarray(chunk_codes, dtype=object))
+            days.append(np.asarray(chunk_dates, dtype='datetime64[D]').astype(np.int64))
+            closes.append(np.asarray(chunk_closes, dtype=np.float64))
+        if not codes:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return np.concatenate(codes), np.concatenate(days), np.concatenate(closes)
+
+    @classmethod
+    def get_target_days(cls, last_days: np.ndarray, offset) -> np.ndarray:
+        # calendar offsets only depend on the latest price date, which most stocks share
+        unique_last_days, inverse = np.unique(last_days, return_inverse=True)
+        targets = []
+        for day in unique_last_days.tolist():
+            last_date = EPOCH + timedelta(days=day)
+            target = offset(last_date) if callable(offset) else last_date - offset
+            targets.append((target - EPOCH).days)
+        return np.asarray(targets, dtype=np.int64)[inverse]
+
+    @classmethod
+    def compute_returns(cls, codes: np.ndarray, days: np.ndarray, closes: np.ndarray) -> Dict[str, List[Any]]:
+        '''
+            Returns columnar {column: values} with one entry per stock for rows sorted by (wstockcode, date).
+        '''
+        if not codes.size:
+            return {column: [] for column in ['wstockcode', *cls.get_return_columns()]}
+        # rows come grouped by wstockcode, so a segment starts wherever the code changes
+        segment_ids = np.concatenate(([0], np.cumsum(codes[1:] != codes[:-1])))
+        last_indices = np.concatenate((np.flatnonzero(np.diff(segment_ids)), [segment_ids.size - 1]))
+        stock_segment_ids = segment_ids[last_indices]
+        last_days, current = days[last_indices], closes[last_indices]
+
+        def base_closes(offset):
+            target_days = cls.get_target_days(last_days, offset)
+            indices = ReturnsEngine.segment_as_of_indices(segment_ids, days, stock_segment_ids, target_days)
+            return np.where(indices >= 0, closes[indices], np.nan)
+
+        values = dict(
+            returns_ytd=ReturnsEngine.absolute_returns(
+                current, base_closes(lambda last_date: date(last_date.year - 1, 12, 31))
+            )
+        )
+        for column, offset in cls.RETURN_PERIODS.items():
+            values[column] = ReturnsEngine.absolute_returns(current, base_closes(offset))
+        for column, years in cls.CAGR_PERIODS.items():
+            values[column] = ReturnsEngine.cagr(current, base_closes(relativedelta(years=years)), years)
+
+        data = dict(wstockcode=codes[last_indices].tolist())
+        for column, column_values in values.items():
+            column_values = np.where(np.isfinite(column_values), column_values, 0)
+            data[column] = np.round(column_values, 3).tolist()
+        return data
+
+    @classmethod
+    async def bulk_update_returns(cls, db: AsyncSession, data: Dict[str, List[Any]]) -> int:
+        column_types = dict(wstockcode='varchar', **{c: 'float8' for c in cls.get_return_columns()})
+        return await ModalGenericService.bulk_update_from_arrays(
+            db, table='funnal_stock', key_column='wstockcode', data=data, column_types=column_types
+        )
+
+    @classmethod
+    async def refresh_stock_returns(cls, db: AsyncSession, as_on: date = None) -> int:
+        started_at = time.monotonic()
+        since = (as_on or date.today()) - cls.LOOKBACK
+        nse_codes, nse_days, nse_closes = await cls.load_close_series(db, StockNSEHistPriceData, since)
+        bse_codes, bse_days, bse_closes = await cls.load_close_series(
+            db, StockBSEHistPriceData, since, exclude_wstockcodes=set(nse_codes.tolist())
+        )
+        loaded_at = time.monotonic()
+        data = cls.compute_returns(nse_codes, nse_days, nse_closes)
+        bse_data = cls.compute_returns(bse_codes, bse_days, bse_closes)
+        for column, values in bse_data.items():
+            data[column].extend(values)
+        computed_at = time.monotonic()
+        updated = await cls.bulk_update_returns(db, data)
+        logger.info(
+            f"Stock returns refreshed for {updated} stocks from {nse_codes.size + bse_codes.size} prices. "
+            f"load {loaded_at - started_at:.1f}s, compute {computed_at - loaded_at:.1f}s, "
+            f"update {time.monotonic() - computed_at:.1f}s"
+        )
+        return updated
+
+    @classmethod
+    async def run(cls) -> int:
+        async with sessionmanager.session() as db:
+            return await cls.refresh_stock_returns(db)
+
+
+if __name__ == "__main__":
+    asyncio.run(StockReturnsService.run())
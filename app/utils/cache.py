@@ -0,0 +1,124 @@
+import datetime
+import functools
+import inspect
+import json
+import logging
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Optional
+from app.cache.redis_cache import get_cache_value, set_cache_value
+
+logger = logging.getLogger("app")
+
+
+def encode_cache_value(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not cache serializable")
+
+
+def decode_cache_value(value: dict) -> Any:
+    if len(value) != 1:
+        return value
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    if "__date__" in value:
+        return datetime.date.fromisoformat(value["__date__"])
+    if "__decimal__" in value:
+        return Decimal(value["__decimal__"])
+    return value
+
+
+def serialize_cache_value(value: Any) -> str:
+    return json.dumps(value, default=encode_cache_value, separators=(',', ':'))
+
+
+def deserialize_cache_value(value: str) -> Any:
+    return json.loads(value, object_hook=decode_cache_value)
+
+
+def get_timeout_till(timeout_at: datetime.time) -> int:
+    '''
+        Seconds from now till the next occurrence of the wall-clock time timeout_at (in its own tzinfo).
+    '''
+    now = datetime.datetime.now(timeout_at.tzinfo)
+    expire_at = now.replace(hour=timeout_at.hour, minute=timeout_at.minute, second=timeout_at.second, microsecond=0)
+    if expire_at <= now:
+        expire_at = expire_at + datetime.timedelta(days=1)
+    return max(int((expire_at - now).total_seconds()), 1)
+
+
+def get_versioned_cache_key(key: str, version: Optional[str]) -> str:
+    return f"{key}_v{version}" if version else key
+
+
+def from_cache(
+        cache_func: Callable[..., Optional[str]], timeout: int = None, timeout_at: datetime.time = None,
+        version_func: Callable[..., Awaitable[Optional[str]]] = None
+):
+    '''
+        Caches the result of an async function in redis under the key built by cache_func.
+        The key is built from `cache_func_kwargs` when the caller passes it, otherwise from the call
+        arguments matching cache_func's parameters. Expiry is either `timeout` seconds or the next
+        occurrence of the wall-clock time `timeout_at`.
+        With `version_func`, the version it returns for the key arguments it takes is appended to the key,
+        so moving that version on drops every key built from them without deleting any.
+        Per call, `use_cache=False` bypasses the cache entirely and `refresh_cache=True` skips the read
+        but stores the fresh result.
+        None results are never cached and a redis failure only logs, it never fails the call.
+    '''
+    key_params = set(inspect.signature(cache_func).parameters)
+    version_params = set(inspect.signature(version_func).parameters) if version_func else set()
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_func_kwargs = kwargs.pop('cache_func_kwargs', None)
+            use_cache = kwargs.pop('use_cache', True)
+            refresh_cache = kwargs.pop('refresh_cache', False)
+            if not use_cache:
+                return await func(*args, **kwargs)
+
+            if cache_func_kwargs is None:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                cache_func_kwargs = {k: v for k, v in bound.arguments.items() if k in key_params}
+            cache_key = cache_func(**cache_func_kwargs)
+            if not cache_key:
+                return await func(*args, **kwargs)
+            if version_func:
+                try:
+                    version = await version_func(**{k: v for k, v in cache_func_kwargs.items() if k in version_params})
+                except Exception as e:
+                    logger.error(f"Failed to read the version of cache key {cache_key}. {e}")
+                    return await func(*args, **kwargs)
+                cache_key = get_versioned_cache_key(cache_key, version)
+
+            if not refresh_cache:
+                try:
+                    cached_value = await get_cache_value(cache_key)
+                    if cached_value is not None:
+                        return deserialize_cache_value(cached_value)
+                except Exception as e:
+                    logger.error(f"Failed to read cache key {cache_key}. {e}")
+
+            value = await func(*args, **kwargs)
+            if value is None:
+                return value
+            expire = get_timeout_till(timeout_at) if timeout_at else timeout
+            try:
+                await set_cache_value(cache_key, serialize_cache_value(value), expire)
+            except Exception as e:
+                logger.error(f"Failed to set cache key {cache_key}. {e}")
+            return value
+
+        return wrapper
+
+    return decorator
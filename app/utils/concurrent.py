@@ -1,3 +1,4 @@
+import asyncio
 import concurrent.futures
 import logging
 
@@ -33,3 +34,34 @@ def execute_functions_concurrently(functions_list, kwargs_list, workers_count=5,
                 logger.info(f'{index} generated an exception: {exc}')
                 if raise_exception:
                     raise exc
+
+
+async def execute_coroutines_concurrently(functions_list, kwargs_list, workers_count=5, raise_exception=False):
+    '''
+        asyncio counterpart of execute_functions_concurrently for coroutine functions. At most workers_count
+        coroutines run at a time and the results are returned as a list in the order of functions_list.
+        A failed call logs and leaves None at its index, unless raise_exception is True in which case the
+        first failure is raised and the calls still pending are cancelled.
+        Note: coroutines sharing one AsyncSession must not run concurrently, a session runs one query at a time.
+    '''
+    if len(functions_list) != len(kwargs_list):
+        raise ValueError("Number of functions and number of kwargs must be equal.")
+    semaphore = asyncio.Semaphore(max(workers_count, 1))
+
+    async def run(index):
+        async with semaphore:
+            try:
+                return await functions_list[index](**kwargs_list[index])
+            except Exception as exc:
+                logger.info(f'{index} generated an exception: {exc}')
+                if raise_exception:
+                    raise exc
+                return None
+
+    tasks = [asyncio.ensure_future(run(index)) for index in range(len(functions_list))]
+    try:
+        return await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -1,5 +1,9 @@
+from datetime import date
 from enum import Enum
 
+# day 0 of the integer day arrays (days since the epoch) of the NAV store and the price/NAV batch jobs
+EPOCH = date(1970, 1, 1)
+
 class ExchangeChoices(str, Enum):
     NSE = "nse"
     BSE = "bse"
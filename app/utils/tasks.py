@@ -6,6 +6,7 @@ from app.db.base import get_idb
 
 app = FastAPI()
 
+
 async def  update_mappings_for_scheme_task(wpc: str, db: AsyncSession):
     from app.models.scheme import Scheme
     from app.services.scheme import SchemeUniqueIDsCacheService
@@ -17,6 +18,7 @@ async def  update_mappings_for_scheme_task(wpc: str, db: AsyncSession):
     if obj:
         await SchemeUniqueIDsCacheService.update_all_mappings_for_scheme(obj=obj)
 
+
 async def reset_cache_keys_affected_by_scheme_update_task(wpc: str, db: AsyncSession):
     from app.models.scheme import Scheme, SchemeAudit
     from app.services.cache import CacheKeysService
@@ -32,12 +34,103 @@ async def reset_cache_keys_affected_by_scheme_update_task(wpc: str, db: AsyncSes
     if sa_obj:
         await CacheKeysService.reset_keys_affected_by_scheme_update(sa_obj)
 
+
 @app.post("/update_mappings_for_scheme/")
 async def update_mappings_for_scheme(wpc: str, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_idb)):
     background_tasks.add_task(update_mappings_for_scheme_task, wpc, db)
     return {"message": "Task to update mappings for scheme has been initiated."}
 
+
 @app.post("/reset_cache_keys_affected_by_scheme_update/")
 async def reset_cache_keys_affected_by_scheme_update(wpc: str, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_idb)):
     background_tasks.add_task(reset_cache_keys_affected_by_scheme_update_task, wpc, db)
-    return {"message": "Task to reset cache keys affected by scheme update has been initiated."}
\ No newline at end of file
+    return {"message": "Task to reset cache keys affected by scheme update has been initiated."}
+
+
+async def refresh_stock_returns_task():
+    from app.services.stock_returns import StockReturnsService
+
+    await StockReturnsService.run()
+
+
+@app.post("/refresh_stock_returns/")
+async def refresh_stock_returns(background_tasks: BackgroundTasks):
+    background_tasks.add_task(refresh_stock_returns_task)
+    return {"message": "Task to refresh stock returns has been initiated."}
+
+
+async def refresh_stock_indicators_task(full: bool = False):
+    from app.services.stock_indicators import StockIndicatorService
+
+    await StockIndicatorService.run(full=full)
+
+
+@app.post("/refresh_stock_indicators/")
+async def refresh_stock_indicators(background_tasks: BackgroundTasks, full: bool = False):
+    background_tasks.add_task(refresh_stock_indicators_task, full)
+    return {"message": "Task to refresh stock indicators has been initiated."}
+
+
+async def populate_hist_nav_for_nfos_task():
+    from app.db.base import sessionmanager
+    from app.services.service import SchemeHistNavService
+
+    async with sessionmanager.session() as db:
+        await SchemeHistNavService.populate_hist_nav_for_nfos(db)
+
+
+@app.post("/populate_hist_nav_for_nfos/")
+async def populate_hist_nav_for_nfos(background_tasks: BackgroundTasks):
+    background_tasks.add_task(populate_hist_nav_for_nfos_task)
+    return {"message": "Task to populate hist navs for open NFOs has been initiated."}
+
+
+async def ingest_nav_file_task(path: str):
+    from app.services.nav_ingestion import NavIngestionService
+
+    await NavIngestionService.run(path)
+
+
+@app.post("/ingest_nav_file/")
+async def ingest_nav_file(file_name: str, background_tasks: BackgroundTasks):
+    from app.services.nav_ingestion import NavIngestionService
+
+    # resolved before the task is queued, a name outside NAV_INGEST_DIR is refused with a 400
+    background_tasks.add_task(ingest_nav_file_task, NavIngestionService.get_nav_file_path(file_name))
+    return {"message": "Task to ingest NAV file has been initiated."}
+
+
+async def backfill_hist_navs_task(service_name: str, restart: bool = False):
+    from app.services.nav_backfill import NavBackfillService
+
+    await NavBackfillService.backfill(service_name, restart=restart)
+
+
+@app.post("/backfill_hist_navs/")
+async def backfill_hist_navs(service_name: str, background_tasks: BackgroundTasks, restart: bool = False):
+    background_tasks.add_task(backfill_hist_navs_task, service_name, restart)
+    return {"message": "Task to backfill hist navs has been initiated."}
+
+
+async def sync_nav_store_task(full: bool = False):
+    from app.services.nav_store_sync import NavStoreService
+
+    await NavStoreService.run(full=full)
+
+
+@app.post("/sync_nav_store/")
+async def sync_nav_store(background_tasks: BackgroundTasks, full: bool = False):
+    background_tasks.add_task(sync_nav_store_task, full)
+    return {"message": "Task to sync NAV store has been initiated."}
+
+
+async def refresh_scheme_risk_metrics_task():
+    from app.services.risk_metrics import SchemeRiskMetricsService
+
+    await SchemeRiskMetricsService.run()
+
+
+@app.post("/refresh_scheme_risk_metrics/")
+async def refresh_scheme_risk_metrics(background_tasks: BackgroundTasks):
+    background_tasks.add_task(refresh_scheme_risk_metrics_task)
+    return {"message": "Task to refresh scheme risk metrics has been initiated."}
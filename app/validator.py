@@ -1,6 +1,6 @@
 # validator.py
 
-from typing import Any, Dict
+from typing import Any, Dict, List
 from app.exceptions import WealthyValidationError
 from app.schemas.scheme import InvestmentTypeChoices, SchemeIdType
 from app.services.service import SchemeUniqueIDsCacheService, SchemeService
@@ -11,6 +11,51 @@ from sqlalchemy import text
 class RequestValidator:
     @classmethod
     async def returns_calculator(cls, data: Dict[str, Any], db: AsyncSession) -> Dict[str, Any]:
+        validated_data = cls.clean_returns_calculator_data(data)
+        validated_data['wpc'] = await cls.validate_request_and_get_wpc(
+            id_type=validated_data.pop('id_type'), id_value=validated_data.pop('id_value'), db=db
+        )
+        return validated_data
+
+    @classmethod
+    async def returns_calculator_batch(cls, data_list: List[Dict[str, Any]], db: AsyncSession) -> List[Dict[str, Any]]:
+        """
+        Validates every returns request in the batch and resolves all of their ids to wpcs with one
+        lookup per id type. Invalid or unresolved items are returned with an `error` instead of
+        failing the whole batch.
+        """
+        if not (data_list and isinstance(data_list, list)):
+            raise WealthyValidationError("Invalid request: Data must be a non-empty list")
+
+        validated_list, ids_by_type = [], {}
+        for data in data_list:
+            try:
+                validated_data = cls.clean_returns_calculator_data(data)
+                validated_data['id_type'] = cls.normalize_id_type(validated_data['id_type'])
+            except WealthyValidationError as e:
+                validated_list.append(dict(data=data, error=e.detail.get('message')))
+                continue
+            ids_by_type.setdefault(validated_data['id_type'], set()).add(validated_data['id_value'])
+            validated_list.append(dict(data=validated_data, error=None))
+
+        resolved_by_type = {}
+        for id_type, id_values in ids_by_type.items():
+            resolved_by_type[id_type] = await cls.validate_request_and_get_wpcs(
+                id_type=id_type, id_values=list(id_values), db=db
+            )
+
+        for vd in validated_list:
+            if vd['error']:
+                continue
+            data = vd['data']
+            wpc = resolved_by_type[data['id_type']].get(data['id_value'])
+            if not wpc:
+                vd['error'] = 'Scheme not found'
+            data['wpc'] = wpc
+        return validated_list
+
+    @staticmethod
+    def clean_returns_calculator_data(data: Dict[str, Any]) -> Dict[str, Any]:
         if not (data and isinstance(data, dict)):
             raise WealthyValidationError("Invalid request: Data must be a non-empty dictionary")
 
@@ -39,15 +84,85 @@ class RequestValidator:
         if amount < 0 or n_years < 0:
             raise WealthyValidationError("Amount and period must be positive numbers")
 
-        wpc = await cls.validate_request_and_get_wpc(id_type=id_type, id_value=id_value, db=db)
         return {
-            'wpc': wpc,
+            'id_type': id_type,
+            'id_value': id_value,
             'amount': amount,
             'n_years': n_years,
             'investment_type': investment_type,
             'sip_day': sip_day
         }
 
+    @staticmethod
+    def normalize_id_type(id_type: str) -> str:
+        if not id_type:
+            raise WealthyValidationError('Invalid request')
+        id_type = id_type.lower().replace('_', '-')
+        if id_type not in SchemeIdType.values():
+            raise WealthyValidationError('Invalid request')
+        return id_type
+
+    @classmethod
+    async def validate_request_and_get_wpcs(cls, id_type: str, id_values: List[str], db: AsyncSession) -> Dict[str, str]:
+        """
+        Bulk counterpart of validate_request_and_get_wpc. Returns {id_value: wpc} for every id that
+        could be resolved; unresolved ids are simply left out.
+        """
+        if not id_values:
+            return {}
+        id_type = cls.normalize_id_type(id_type)
+
+        if id_type == SchemeIdType.WSchemeCode:
+            resolve_result = await SchemeUniqueIDsCacheService.resolve_wpcs_from_wschemecodes(
+                wschemecodes=id_values, db=db
+            )
+            return resolve_result.resolved
+
+        elif id_type == SchemeIdType.ISIN:
+            resolve_result = await SchemeUniqueIDsCacheService.resolve_wpcs_from_isins(
+                isins=id_values, db=db
+            )
+            return resolve_result.resolved
+
+        elif id_type == SchemeIdType.SchemeCode:
+            resolve_result = await SchemeUniqueIDsCacheService.resolve_wpcs_from_scheme_codes(
+                scheme_codes=id_values, db=db
+            )
+            resolved = dict(resolve_result.resolved)
+            if not resolve_result.unresolved:
+                return resolved
+            combinations = {}
+            for scheme_code in resolve_result.unresolved:
+                combinations[scheme_code] = await SchemeUniqueIDsCacheService.get_scheme_code_combinations(
+                    scheme_code=scheme_code
+                )
+            combinations_result = await SchemeUniqueIDsCacheService.resolve_wpcs_from_scheme_codes(
+                scheme_codes=[c for cl in combinations.values() for c in cl], db=db
+            )
+            for scheme_code, combination_list in combinations.items():
+                wpc = next(
+                    (combinations_result.resolved[c] for c in combination_list if c in combinations_result.resolved),
+                    None
+                )
+                if wpc:
+                    resolved[scheme_code] = wpc
+            return resolved
+
+        elif id_type == SchemeIdType.WPC:
+            wpcs = await SchemeService.get_schemes_data(
+                db=db, cols=['wpc'], q=[Scheme.wpc.in_(id_values)], allow_deprecated=True, flat=True
+            )
+            return {wpc: wpc for wpc in wpcs}
+        else:
+            rows = await SchemeService.get_schemes_data(
+                db=db, cols=['third_party_id', 'wpc'], q=[Scheme.third_party_id.in_(id_values), Scheme.ir_scheme.is_(False)],
+                allow_deprecated=True, flat=False
+            )
+        resolved = {}
+        for id_value, wpc in rows:
+            resolved.setdefault(id_value, wpc)
+        return resolved
+
     @classmethod
     async def validate_request_and_get_wpc(cls, id_type: str, id_value: str, db: AsyncSession) -> Any:
         if not (id_type and id_value):
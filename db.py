@@ -4,6 +4,7 @@ from typing import Any, AsyncIterator
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, AsyncConnection, async_sessionmaker
 from sqlalchemy.orm import  sessionmaker
 from app.core.config import settings
+from app.db.base import create_db_engine, engine
 from app.services.service import get_hist_nav_data
 
 
@@ -24,10 +25,9 @@ class DatabaseSessionManager:
             autoflush=False,
         )
     '''
-    def __init__(self, host: str, engine_kwargs: dict[str, Any] | None = None):
-        if engine_kwargs is None:
-            engine_kwargs = {}
-        self._engine = create_async_engine(host, **engine_kwargs)
+    def __init__(self, host: str = None, engine_kwargs: dict[str, Any] | None = None):
+        # reuse the shared engine of app.db.base unless a separate host is explicitly asked for
+        self._engine = create_db_engine(host, **(engine_kwargs or {})) if (host or engine_kwargs) else engine
         self._sessionmaker = async_sessionmaker(
             autocommit=False, autoflush=False, bind=self._engine
         )
@@ -67,10 +67,7 @@ class DatabaseSessionManager:
                 await connection.rollback()
                 raise
 # Instantiate the DatabaseSessionManager with the database URI and engine options
-sessionmanager = DatabaseSessionManager(
-    settings.postgres_database_uri,
-    {"echo": settings.ECHO_SQL , "future": True},  
-)
+sessionmanager = DatabaseSessionManager()
 
 async def get_idb() -> AsyncIterator[AsyncSession]:
     async with sessionmanager.session() as session:
@@ -4,7 +4,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from app.api.v1.router import api_router
 from app.core.config import settings
-from app.db.base import get_db, async_session
+from app.db.base import get_db, async_session, get_pool_status
+from app.cache.redis_cache import listen_for_cache_invalidations
+from app.services.scheme_id_resolver import SchemeIDResolver
+from app.services.holding_vectors import SchemeHoldingVectors
+from app.services.similar_funds import SimilarFundsIndex
+from app.services.reverse_holdings import ReverseHoldingsIndex
 import uvicorn
 import asyncio
 #from fastapi_cache import FastAPICache
@@ -35,6 +40,10 @@ async def test_db(session: AsyncSession = Depends(get_db)):
     result = await session.execute(text("SELECT 1"))
     return {"status": "success", "result": result.scalar()}
 
+@app.get("/db-pool-status")
+async def db_pool_status():
+    return get_pool_status()
+
 @app.on_event("startup")
 async def startup_event():
     async with async_session() as session:
@@ -46,6 +55,35 @@ async def startup_event():
             print(f"Database connection failed: {e}")
             await asyncio.sleep(0)  # Allow event loop to process
             raise SystemExit("Failed to connect to the database.")
+    async with async_session() as session:
+        try:
+            await SchemeIDResolver.load(session)
+        except Exception as e:
+            logger.error(f"Failed to preload scheme id mappings, resolving from the database instead: {e}")
+    async with async_session() as session:
+        try:
+            await SchemeHoldingVectors.load(session)
+            SimilarFundsIndex.sync()
+            await ReverseHoldingsIndex.sync(session)
+        except Exception as e:
+            logger.error(f"Failed to preload holding vectors, loading them on demand instead: {e}")
+    app.state.cache_invalidation_listener = asyncio.create_task(listen_for_cache_invalidations())
+    app.state.scheme_id_resolver_refresher = asyncio.create_task(SchemeIDResolver.run_refresh_loop(
+        async_session, interval=settings.SCHEME_ID_RESOLVER_REFRESH_INTERVAL,
+        reload_interval=settings.SCHEME_ID_RESOLVER_RELOAD_INTERVAL
+    ))
+    app.state.holding_vectors_refresher = asyncio.create_task(SchemeHoldingVectors.run_refresh_loop(
+        async_session, interval=settings.HOLDING_VECTORS_REFRESH_INTERVAL
+    ))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task_name in (
+        "cache_invalidation_listener", "scheme_id_resolver_refresher", "holding_vectors_refresher"
+    ):
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True, log_level="debug")
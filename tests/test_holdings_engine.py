@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from app.services.holdings_engine import HoldingsEngine
+
+
+def random_vector(rng, universe, size):
+    keys = rng.choice(universe, size=size, replace=False).tolist()
+    weights = rng.dirichlet(np.ones(size)) * 100
+    return HoldingsEngine.make_vector(None, keys, keys, weights), dict(zip(keys, weights))
+
+
+def test_weighted_overlap_matches_dict_intersection():
+    rng = np.random.default_rng(3)
+    universe = np.asarray([f"INE{i:06d}" for i in range(300)])
+    for _ in range(20):
+        a, a_weights = random_vector(rng, universe, int(rng.integers(1, 80)))
+        b, b_weights = random_vector(rng, universe, int(rng.integers(1, 80)))
+        expected = sum(min(w, b_weights[k]) for k, w in a_weights.items() if k in b_weights)
+        assert HoldingsEngine.weighted_overlap(a, b) == pytest.approx(expected)
+        assert HoldingsEngine.weighted_overlap(a, a) == pytest.approx(100)
+
+
+def test_make_vector_sums_repeated_holdings():
+    vector = HoldingsEngine.make_vector(None, ['B', 'A', 'B', 'C'], ['b1', 'a', 'b2', 'c'], [10, 20, 5, 1])
+    assert vector.keys.tolist() == ['A', 'B', 'C']
+    assert vector.names == ['a', 'b1', 'c']
+    assert vector.weights.tolist() == [20, 15, 1]
+    other = HoldingsEngine.make_vector(None, ['C', 'B', 'D'], ['c', 'b', 'd'], [4, 3, 2])
+    assert HoldingsEngine.common_keys([vector, other]).tolist() == ['B', 'C']
+    assert HoldingsEngine.weighted_overlap(vector, other) == 4
+
+
+def test_minhash_estimates_jaccard():
+    permutations = HoldingsEngine.make_permutations(256, seed=7)
+    universe = [f"INE{i:06d}" for i in range(200)]
+    sets = [universe[:100], universe[50:150], universe[:100], universe[150:]]
+    hashes = HoldingsEngine.hash_keys([key for keys in sets for key in keys])
+    offsets = np.concatenate(([0], np.cumsum([len(keys) for keys in sets])))
+    signatures = HoldingsEngine.minhash_signatures(hashes, offsets, permutations)
+    assert signatures.shape == (4, 256)
+    # true jaccard of the first two sets is 50 / 150
+    assert np.mean(signatures[0] == signatures[1]) == pytest.approx(1 / 3, abs=0.1)
+    assert (signatures[0] == signatures[2]).all()
+    assert np.mean(signatures[0] == signatures[3]) < 0.05
+    bands = HoldingsEngine.band_keys(signatures[0], 32)
+    assert len(bands) == 32 and bands == HoldingsEngine.band_keys(signatures[2], 32)
+
+
+def test_aggregate_across_schemes():
+    vectors = [
+        HoldingsEngine.make_vector(None, ['A', 'B', 'A'], ['a', 'b', 'a'], [10, 20, 5], ['t1', 't2', 't3'], [100, 200, 50]),
+        HoldingsEngine.make_vector(None, ['B', 'C'], ['b', 'c'], [30, 70], ['t2', 't4'], [30, 70]),
+    ]
+    assert vectors[0].third_party_ids == ['t1', 't2'] and vectors[0].market_values.tolist() == [150, 200]
+    aggregates = HoldingsEngine.aggregate(
+        np.concatenate([v.keys for v in vectors]), np.concatenate([v.weights for v in vectors]),
+        np.concatenate([v.market_values for v in vectors])
+    )
+    assert aggregates['keys'].tolist() == ['A', 'B', 'C']
+    assert aggregates['counts'].tolist() == [1, 2, 1]
+    assert aggregates['weights'].tolist() == [15, 50, 70]
+    assert aggregates['market_values'].tolist() == [150, 230, 70]
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from app.services.indicator_engine import IndicatorEngine
+
+
+def naive_ema(values, alpha, initial):
+    result, prev = [], initial
+    for value in values:
+        prev = alpha * value + (1 - alpha) * prev
+        result.append(prev)
+    return result
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(7)
+    return 100 + np.cumsum(rng.normal(0, 1, 600))
+
+
+def test_ema_matches_recurrence(closes):
+    assert IndicatorEngine.ema(closes, 2 / 27, initial=closes[0]).tolist() == pytest.approx(
+        naive_ema(closes, 2 / 27, closes[0])
+    )
+
+
+def test_rsi_is_wilder_smoothed(closes):
+    deltas = np.diff(closes)
+    gains, losses = np.clip(deltas, 0, None), np.clip(-deltas, 0, None)
+    avg_gain, avg_loss = gains[:14].mean(), losses[:14].mean()
+    for gain, loss in zip(gains[14:], losses[14:]):
+        avg_gain, avg_loss = (avg_gain * 13 + gain) / 14, (avg_loss * 13 + loss) / 14
+    rsi = IndicatorEngine.compute_series(closes)['rsi']
+    assert np.isnan(rsi[13])
+    assert rsi[-1] == pytest.approx(100 - 100 / (1 + avg_gain / avg_loss))
+
+
+def test_extended_state_matches_full_series(closes):
+    state = IndicatorEngine.initial_state(closes[:400])
+    state = IndicatorEngine.extend_state(state, closes[400:550])
+    state = IndicatorEngine.extend_state(state, closes[550:])
+    latest = IndicatorEngine.latest_values(state)
+    series = IndicatorEngine.compute_series(closes)
+    for key in ('rsi', 'macd', 'ema', 'sma', 'std'):
+        assert latest[key] == pytest.approx(series[key][-1])
+
+
+def test_latest_values_warm_up_like_full_series(closes):
+    for size in (16, 21, 27):
+        latest = IndicatorEngine.latest_values(IndicatorEngine.initial_state(closes[:size]))
+        series = IndicatorEngine.compute_series(closes[:size])
+        for key in ('rsi', 'macd', 'ema', 'sma', 'std'):
+            assert latest[key] == pytest.approx(series[key][-1], nan_ok=True)
@@ -0,0 +1,43 @@
+from datetime import date
+import numpy as np
+import pytest
+from app.services.nav_store import NavStore
+from app.utils.constants import EPOCH
+
+
+def day(value: str) -> int:
+    return (date.fromisoformat(value) - EPOCH).days
+
+
+@pytest.fixture
+def store(tmp_path):
+    codes = np.asarray(['A', 'A', 'A', 'B', 'B'], dtype=object)
+    days = np.asarray([day('2024-01-01'), day('2024-01-02'), day('2024-01-04'), day('2024-01-01'), day('2024-01-03')])
+    navs = np.asarray([10.0, 10.5, 11.0, 20.0, 21.0])
+    wpcs, offsets = NavStore.group_rows(codes)
+    NavStore.write(str(tmp_path), wpcs, offsets, days, navs, navs * 2)
+    return NavStore.open(str(tmp_path))
+
+
+def test_as_on_lookup(store):
+    assert store.get_as_on('A', date(2024, 1, 3)) == (date(2024, 1, 2), 10.5, 21.0)
+    assert store.get_as_on('A', date(2024, 1, 3), approx=False) is None
+    assert store.get_as_on('B', date(2023, 12, 31)) is None
+    assert store.get_as_on('C', date(2024, 1, 3)) is None
+    assert store.get_last_date('A') == date(2024, 1, 4) and store.get_last_date('C') is None
+    dates, navs, _ = store.get_series('A', since=date(2024, 1, 2))
+    assert NavStore.to_dates(dates) == ['2024-01-02', '2024-01-04'] and navs.tolist() == [10.5, 11.0]
+
+
+def test_merge_appends_after_each_wpc(store, tmp_path):
+    codes = np.asarray(['A', 'A', 'B', 'C'], dtype=object)
+    days = np.asarray([day('2024-01-04'), day('2024-01-05'), day('2024-01-05'), day('2024-01-05')])
+    navs = np.asarray([99.0, 11.5, 22.0, 30.0])
+    NavStore.write(str(tmp_path), *store.merge(codes, days, navs, navs))
+    merged = NavStore.open(str(tmp_path))
+    assert merged.wpcs == ['A', 'B', 'C']
+    assert merged.get_series('A')[1].tolist() == [10.0, 10.5, 11.0, 11.5]
+    assert merged.get_series('B')[1].tolist() == [20.0, 21.0, 22.0]
+    assert merged.get_as_on('C', date(2024, 1, 6)) == (date(2024, 1, 5), 30.0, 30.0)
+    # the store opened before the merge still reads its own generation
+    assert store.get_series('A')[1].tolist() == [10.0, 10.5, 11.0]
@@ -0,0 +1,63 @@
+from bisect import bisect_right
+from datetime import date
+import numpy as np
+import pytest
+from dateutil.relativedelta import relativedelta
+from app.services.returns_engine import ReturnsEngine
+
+
+def test_onetime_series():
+    units, invested_value, current_value = ReturnsEngine.onetime_series(1000, [10.0, 12.5, 8.0])
+    assert units.tolist() == [100.0, 100.0, 100.0]
+    assert invested_value.tolist() == [1000, 1000, 1000]
+    assert current_value.tolist() == [1000.0, 1250.0, 800.0]
+
+
+def test_sip_series():
+    units, invested_value, current_value = ReturnsEngine.sip_series(1000, [10.0, 20.0, 25.0])
+    assert units.tolist() == pytest.approx([100.0, 150.0, 190.0])
+    assert invested_value.tolist() == [1000, 2000, 3000]
+    assert current_value.tolist() == pytest.approx([1000.0, 3000.0, 4750.0])
+
+
+def test_attach_series_rounds_only_on_output():
+    nav_data = [dict(nav_date='2024-01-05', adj_nav=33.3333), dict(nav_date='2024-02-05', adj_nav=36.1111)]
+    units, invested_value, current_value = ReturnsEngine.sip_series(1000, [nd['adj_nav'] for nd in nav_data])
+    ReturnsEngine.attach_series(nav_data, units, invested_value, current_value)
+    assert nav_data[0]['units'] == 30.0
+    assert nav_data[1]['units'] == round(1000 / 33.3333 + 1000 / 36.1111, 4)
+    assert nav_data[1]['invested_value'] == 2000
+    assert nav_data[1]['current_value'] == round((1000 / 33.3333 + 1000 / 36.1111) * 36.1111, 2)
+
+
+def test_segment_as_of_indices():
+    # two series back to back: segment 0 on days 1, 3, 5 and segment 1 on days 2, 6
+    segment_ids = np.array([0, 0, 0, 1, 1])
+    days = np.array([1, 3, 5, 2, 6])
+    indices = ReturnsEngine.segment_as_of_indices(
+        segment_ids, days, np.array([0, 0, 0, 1, 1, 1]), np.array([0, 4, 9, 1, 5, 6])
+    )
+    assert indices.tolist() == [-1, 1, 2, -1, 3, 4]
+
+
+def test_absolute_returns_and_cagr():
+    current, base = np.array([121.0, 50.0]), np.array([100.0, np.nan])
+    assert ReturnsEngine.absolute_returns(current, base)[0] == pytest.approx(21.0)
+    assert ReturnsEngine.cagr(current, base, years=2)[0] == pytest.approx(10.0)
+    assert np.isnan(ReturnsEngine.cagr(current, base, years=2)[1])
+
+
+def test_rolling_cagr_matches_per_window_loop():
+    rng = np.random.default_rng(3)
+    all_days = np.arange(np.datetime64('2015-01-01'), np.datetime64('2021-03-01'))
+    nav_dates = all_days[rng.random(all_days.size) > 0.35]
+    values = 10 * np.cumprod(1 + rng.normal(0.0004, 0.01, nav_dates.size))
+    end_indices, cagr = ReturnsEngine.rolling_cagr(nav_dates, values, 3)
+    dates = nav_dates.astype(date).tolist()
+    expected = {}
+    for i, end_date in enumerate(dates):
+        base = bisect_right(dates, end_date - relativedelta(years=3)) - 1
+        if base >= 0:
+            expected[i] = ((values[i] / values[base]) ** (1 / 3) - 1) * 100
+    assert end_indices.tolist() == list(expected)
+    assert cagr.tolist() == pytest.approx(list(expected.values()))
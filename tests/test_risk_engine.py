@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from app.services.risk_engine import RiskEngine
+
+
+@pytest.fixture
+def navs():
+    rng = np.random.default_rng(5)
+    values = 10 * np.cumprod(1 + rng.normal(0.0005, 0.01, (3, 400)), axis=1)
+    benchmark = 100 * np.cumprod(1 + rng.normal(0.0004, 0.009, 400))
+    # a scheme launched later and one without a benchmark
+    values[1, :150] = np.nan
+    benchmarks = np.vstack([benchmark, benchmark, np.full(400, np.nan)])
+    return values, benchmarks
+
+
+def test_metrics_match_single_series(navs):
+    values, benchmarks = navs
+    metrics = RiskEngine.compute(values, benchmarks, risk_free_rate=6.5)
+    risk_free = 6.5 / 100 / 252
+    for row in range(2):
+        series = values[row][np.isfinite(values[row])]
+        returns = series[1:] / series[:-1] - 1
+        bench = benchmarks[row][-series.size:]
+        bench_returns = bench[1:] / bench[:-1] - 1
+        beta = np.cov(returns, bench_returns)[0, 1] / np.var(bench_returns, ddof=1)
+        downside = np.sqrt(np.mean(np.minimum(returns - risk_free, 0) ** 2))
+        assert metrics['observations'][row] == returns.size
+        assert metrics['volatility'][row] == pytest.approx(returns.std(ddof=1) * np.sqrt(252) * 100)
+        assert metrics['sharpe'][row] == pytest.approx((returns.mean() - risk_free) / returns.std(ddof=1) * np.sqrt(252))
+        assert metrics['sortino'][row] == pytest.approx((returns.mean() - risk_free) / downside * np.sqrt(252))
+        assert metrics['beta'][row] == pytest.approx(beta)
+        assert metrics['alpha'][row] == pytest.approx(
+            ((returns.mean() - risk_free) - beta * (bench_returns.mean() - risk_free)) * 252 * 100
+        )
+    assert np.isnan(metrics['beta'][2]) and np.isfinite(metrics['sharpe'][2])
+
+
+def test_drawdown_dates():
+    values = np.array([
+        [10, 12, 9, 11, 12, 13],
+        [np.nan, 10, 11, 12, 8, 9],
+        [1, 2, 3, 4, 5, 6],
+    ], dtype=np.float64)
+    drawdowns = RiskEngine.drawdowns(values)
+    assert drawdowns['max_drawdown'].tolist() == pytest.approx([-25.0, -100 / 3, 0.0])
+    assert drawdowns['peak_index'].tolist() == [1, 3, -1]
+    assert drawdowns['trough_index'].tolist() == [2, 4, -1]
+    assert drawdowns['recovery_index'].tolist() == [4, -1, -1]
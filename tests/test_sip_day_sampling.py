@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+import numpy as np
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.scheme import SchemeHistNavData
+from app.services.returns_engine import ReturnsEngine
+from app.services.service import SchemeHistNavService
+
+
+def sql_sip_day_dates(nav_dates, sip_day, today, include_left_end_edge_case=True, include_right_end_edge_case=True):
+    '''
+        Row by row transcription of get_raw_query_for_n_years_with_sip_day_hist_nav_data: lag/lead over
+        a per-month window ordered by nav_date, defaulting to the row's own date.
+    '''
+    selected = []
+    for i, nav_date in enumerate(nav_dates):
+        same_month = lambda other: (other.year, other.month) == (nav_date.year, nav_date.month)
+        lag_date = nav_dates[i - 1] if i > 0 and same_month(nav_dates[i - 1]) else nav_date
+        lead_date = nav_dates[i + 1] if i + 1 < len(nav_dates) and same_month(nav_dates[i + 1]) else nav_date
+        required_date = nav_date.replace(day=sip_day)
+        if (lag_date < required_date <= nav_date) \
+                or (include_left_end_edge_case and lag_date == nav_date and required_date <= nav_date) \
+                or (include_right_end_edge_case and nav_date == lead_date and nav_date < required_date < today):
+            selected.append(nav_date)
+    return selected
+
+
+def random_nav_dates(seed, start=date(2019, 1, 1), days=1500):
+    rng = np.random.default_rng(seed)
+    all_dates = [start + timedelta(days=i) for i in range(days)]
+    # weekends, holidays and whole missing stretches
+    keep = [d.weekday() < 5 and rng.random() > 0.05 for d in all_dates]
+    for gap_start in rng.integers(0, days, 6):
+        for i in range(gap_start, min(gap_start + rng.integers(3, 40), days)):
+            keep[i] = False
+    return [d for d, k in zip(all_dates, keep) if k]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('sip_day', [1, 5, 15, 28])
+@pytest.mark.parametrize('edge_cases', [(True, True), (True, False), (False, True), (False, False)])
+def test_sip_day_indices_match_sql(seed, sip_day, edge_cases):
+    nav_dates = random_nav_dates(seed)
+    today = nav_dates[-1] - timedelta(days=10)
+    indices = ReturnsEngine.sip_day_indices(
+        np.asarray(nav_dates, dtype='datetime64[D]'), sip_day, np.datetime64(today), *edge_cases
+    )
+    assert [nav_dates[i] for i in indices] == sql_sip_day_dates(nav_dates, sip_day, today, *edge_cases)
+
+
+def test_sip_day_indices_edge_cases():
+    nav_dates = [date(2024, 1, 3), date(2024, 1, 12), date(2024, 2, 1), date(2024, 2, 8), date(2024, 3, 20)]
+    indices = ReturnsEngine.sip_day_indices(
+        np.asarray(nav_dates, dtype='datetime64[D]'), 10, np.datetime64(date(2024, 3, 25))
+    )
+    # jan 12 is the first NAV after the 10th, feb 8 is the last NAV of a month without one,
+    # mar 20 is the first NAV of its month and already after the 10th
+    assert [nav_dates[i] for i in indices] == [date(2024, 1, 12), date(2024, 2, 8), date(2024, 3, 20)]
+    assert ReturnsEngine.sip_day_indices(np.asarray([], dtype='datetime64[D]'), 10, np.datetime64(date.today())).size == 0
+
+
+@pytest.mark.asyncio
+async def test_sip_day_sampling_matches_sql_query(db: AsyncSession):
+    nav_dates = random_nav_dates(11, start=date.today() - timedelta(days=3 * 365))
+    for i, nav_date in enumerate(nav_dates):
+        db.add(SchemeHistNavData(wpc='MF00000001', nav_date=nav_date, nav=10 + i / 100, adj_nav=10 + i / 100))
+    await db.commit()
+    for sip_day in (1, 12, 28):
+        raw_query = SchemeHistNavService.get_raw_query_for_n_years_with_sip_day_hist_nav_data(
+            wpc='MF00000001', n_years=2, sip_day=sip_day
+        )
+        result = await db.execute(text(raw_query))
+        expected = sorted(str(row.nav_date)[:10] for row in result.fetchall())
+        nav_data = await SchemeHistNavService.get_hist_nav_data_for_n_years_with_sip_day(
+            db, wpc='MF00000001', n_years=2, sip_day=sip_day, use_cache=False
+        )
+        assert [nd['nav_date'] for nd in nav_data] == expected